@@ -0,0 +1,93 @@
+"""Benchmark of reduced resolution analysis
+
+Watermarks photos held in memory at every analysis scale, the same way as the CLI and the HTTP server,
+and reports how often the corner and watermark type differ from the decision made at full resolution
+along with time spent on analysis and on the whole photo.
+Sample photos are small, use --upscale to emulate photos from a camera.
+
+Run from the project directory: python -m benchmarks.analysis_scale [-f <folder>] [--scales 0.5 0.25 0.125]
+"""
+
+import argparse
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from PIL import Image  # noqa: E402
+
+from core.directory_processors import DirectoryProcessor  # noqa: E402
+from core.profiling import StageTimer  # noqa: E402
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR  # noqa: E402
+
+
+def time_scale(processor: DirectoryProcessor, photos: list[bytes], repeat: int) -> tuple[list[tuple], float, float]:
+    """
+    Watermarks every photo, taking the fastest of repeated runs of each photo
+
+    :param processor: processor with the analysis scale to measure
+    :param photos: contents of photos' files
+    :param repeat: number of timed runs
+    :return: tuple (decisions as tuples (corner, watermark type), analysis and total seconds per photo)
+    """
+    analysis_time = total_time = 0.0
+    for data in photos:
+        timings = []
+        for _ in range(repeat):
+            timer = StageTimer()
+            processor.process_bytes(data, timer)
+            timings.append((sum(timer.durations.values()), timer.durations.get('analysis', 0.0)))
+        total, analysis = min(timings)
+        total_time += total
+        analysis_time += analysis
+
+    decisions = [(result.corner, result.watermark_type) for result in processor.process_images(photos)]
+    return decisions, analysis_time / len(photos), total_time / len(photos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-f', '--folder', dest='folder', default=SAMPLE_PHOTOS_DIR, type=str,
+                        help='Path to a folder with photos, sample photos by default')
+    parser.add_argument('--scales', dest='scales', default=[0.5, 0.25, 0.125], nargs='+', type=float,
+                        help='Analysis scales to compare with full resolution')
+    parser.add_argument('--upscale', dest='upscale', default=1, type=int,
+                        help='Enlarge photos by this factor and encode them as JPEG before processing')
+    parser.add_argument('--repeat', dest='repeat', default=3, type=int,
+                        help='Number of timed runs of each photo, the fastest is reported')
+    args = parser.parse_args()
+
+    photos = []
+    for file in sorted(os.listdir(args.folder)):
+        if os.path.splitext(file)[1].lower() not in DirectoryProcessor.SUPPORTED_PHOTO_FILE_FORMATS:
+            continue
+        filepath = os.path.join(args.folder, file)
+        if args.upscale > 1:
+            with Image.open(filepath) as image:
+                image = image.convert('RGB')
+            image = image.resize((image.width * args.upscale, image.height * args.upscale), Image.Resampling.BICUBIC)
+            encoded = io.BytesIO()
+            image.save(encoded, 'JPEG', quality=90)
+            photos.append(encoded.getvalue())
+        else:
+            with open(filepath, 'rb') as photo:
+                photos.append(photo.read())
+    if not photos:
+        print(f'No photos found in {args.folder}')
+        sys.exit()
+
+    results = {}
+    for scale in [1.0] + args.scales:
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       analysis_scale=scale)
+        results[scale], analysis_time, total_time = time_scale(processor, photos, args.repeat)
+        differences = sum(decision != reference for decision, reference in zip(results[scale], results[1.0]))
+        print(f'scale {scale:<6} analysis {analysis_time * 1000:8.2f} ms/photo, '
+              f'total {total_time * 1000:8.2f} ms/photo, '
+              f'differs from full resolution for {differences}/{len(photos)} photos '
+              f'({differences / len(photos):.1%})')
+
+
+if __name__ == '__main__':
+    main()
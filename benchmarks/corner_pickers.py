@@ -0,0 +1,106 @@
+"""Benchmark of corner pickers
+
+Compares the corners picked by alternative pickers with the exact RgbStdevCornerPicker,
+and reports the agreement rate and the speed-up of the analysis,
+followed by the cost of scoring candidate windows one by one and with summed-area tables,
+see :mod:`core.integral_image`.
+Sample photos are small, use --upscale to emulate photos from a camera.
+
+Run from the project directory: python -m benchmarks.corner_pickers [-f <folder>] [--upscale 8] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from PIL import Image  # noqa: E402
+
+from core.corner_pickers import CornerPicker, PyramidCornerPicker, RgbStdevCornerPicker  # noqa: E402
+from core.directory_processors import DirectoryProcessor  # noqa: E402
+from core.integral_image import IntegralImage, candidate_windows  # noqa: E402
+from core.watermarking import Corner, avg, color_statistics  # noqa: E402
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR  # noqa: E402
+
+
+def time_picker(picker: CornerPicker, images: list[Image.Image], repeat: int) -> tuple[list[Corner], float]:
+    """
+    Picks the corner of every image, taking the fastest of repeated runs
+
+    :param picker: picker to measure
+    :param images: loaded images
+    :param repeat: number of runs
+    :return: tuple (picked corners, seconds per image)
+    """
+    best = float('inf')
+    corners = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        corners = [picker.pick_best_corner(image) for image in images]
+        best = min(best, time.perf_counter() - start)
+    return corners, best / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-f', '--folder', dest='folder', default=SAMPLE_PHOTOS_DIR, type=str,
+                        help='Path to a folder with photos, sample photos by default')
+    parser.add_argument('--upscale', dest='upscale', default=1, type=int,
+                        help='Enlarge photos by this factor before analysis')
+    parser.add_argument('--repeat', dest='repeat', default=5, type=int,
+                        help='Number of timed runs, the fastest is reported')
+    parser.add_argument('--proportion', dest='proportion', default=0.15, type=float,
+                        help='Corner / image width and height ratio')
+    args = parser.parse_args()
+
+    images = []
+    for file in sorted(os.listdir(args.folder)):
+        if os.path.splitext(file)[1].lower() not in DirectoryProcessor.SUPPORTED_PHOTO_FILE_FORMATS:
+            continue
+        with Image.open(os.path.join(args.folder, file)) as image:
+            image = image.convert('RGB')
+        if args.upscale > 1:
+            image = image.resize((image.width * args.upscale, image.height * args.upscale), Image.Resampling.BICUBIC)
+        images.append(image)
+    if not images:
+        print(f'No photos found in {args.folder}')
+        sys.exit()
+
+    corners = list(Corner)
+    exact = RgbStdevCornerPicker(corners, args.proportion, args.proportion)
+    reference, reference_time = time_picker(exact, images, args.repeat)
+    print(f'{len(images)} photos of about {images[0].width}x{images[0].height} pixels')
+    print(f'{type(exact).__name__:<28} {reference_time * 1000:8.2f} ms/photo')
+
+    for picker in [PyramidCornerPicker(corners, args.proportion, args.proportion)]:
+        picked, picker_time = time_picker(picker, images, args.repeat)
+        agreements = sum(corner == expected for corner, expected in zip(picked, reference))
+        print(f'{type(picker).__name__:<28} {picker_time * 1000:8.2f} ms/photo, '
+              f'speed-up {reference_time / picker_time:5.2f}x, '
+              f'agrees for {agreements}/{len(images)} photos ({agreements / len(images):.1%})')
+
+    for grid_steps in (4, 16):
+        windows = [candidate_windows(image.size, (round(image.width * args.proportion),
+                                                  round(image.height * args.proportion)), grid_steps=grid_steps)
+                   for image in images]
+
+        def read_windows():
+            for image, image_windows in zip(images, windows):
+                min(image_windows, key=lambda window: avg(color_statistics(image.crop(window.box)).stdev))
+
+        def use_tables():
+            for image, image_windows in zip(images, windows):
+                integral_image = IntegralImage(image)
+                min(image_windows, key=lambda window: avg(integral_image.statistics(window.box).stdev))
+
+        direct = min(timeit.repeat(read_windows, number=1, repeat=args.repeat))
+        tables = min(timeit.repeat(use_tables, number=1, repeat=args.repeat))
+        print(f'{len(windows[0]):>4} windows: read one by one {direct / len(images) * 1000:8.2f} ms/photo, '
+              f'summed-area tables {tables / len(images) * 1000:8.2f} ms/photo')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Benchmark of the watermarking pipeline
+
+Generates synthetic JPEG photos of given sizes and times each stage of processing a photo separately:
+decoding, cutting a corner, computing statistics, picking the corner and the watermark,
+adding the watermark, encoding and writing the result.
+Results are saved to a JSON file, which can be used as a baseline for detecting regressions.
+
+Run from the project directory:
+    python -m benchmarks.pipeline -o results.json
+    python -m benchmarks.pipeline -o results.json --compare baseline.json --threshold 0.15
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import PIL  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from core.corner_pickers import RgbStdevCornerPicker  # noqa: E402
+from core.watermark_pickers import AvgRgbWatermarkPicker  # noqa: E402
+from core.watermarking import Corner, add_watermark, average_colors, colors_stdev, cut_corner  # noqa: E402
+from resources.watermarks import DEFAULT_DARK_WATERMARK  # noqa: E402
+
+DEFAULT_MEGAPIXELS = [1, 6, 12, 24, 50]
+PROPORTION = 0.15
+CORNERS = [Corner.UPPER_LEFT, Corner.UPPER_RIGHT, Corner.LOWER_LEFT, Corner.LOWER_RIGHT]
+
+
+def synthetic_photo(megapixels: float) -> bytes:
+    """
+    JPEG with a 3:2 aspect ratio, a gradient and noise, so corners differ and compression is realistic
+
+    :param megapixels: size of the photo in millions of pixels
+    :return: encoded JPEG
+    """
+    height = int((megapixels * 1_000_000 / 1.5) ** 0.5)
+    width = int(height * 1.5)
+
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def measure(function: Callable, repeats: int) -> float:
+    """
+    Median wall-clock time of a function
+
+    :param function: function to call without arguments
+    :param repeats: number of calls
+    :return: median time in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark_photo(data: bytes, watermark: Image.Image, output_dir: str, repeats: int) -> dict[str, float]:
+    """
+    Times every stage of processing a photo
+
+    :param data: encoded photo
+    :param watermark: watermark to add
+    :param output_dir: directory where the result is written
+    :param repeats: number of measurements of every stage
+    :return: median time of every stage in seconds
+    """
+
+    def decode() -> Image.Image:
+        decoded = Image.open(io.BytesIO(data))
+        decoded.load()
+        return decoded
+
+    image = decode()
+    corner_picker = RgbStdevCornerPicker(CORNERS, PROPORTION, PROPORTION)
+    watermark_picker = AvgRgbWatermarkPicker(PROPORTION, PROPORTION)
+    corner_img = cut_corner(image, Corner.LOWER_RIGHT, PROPORTION, PROPORTION)
+    corner = corner_picker.pick_best_corner(image)
+    watermarked = add_watermark(image, corner, watermark, PROPORTION, PROPORTION, 0.5)
+
+    def encode() -> bytes:
+        output = io.BytesIO()
+        watermarked.save(output, format='JPEG', quality=100)
+        return output.getvalue()
+
+    encoded = encode()
+    output_path = os.path.join(output_dir, 'watermarked.jpg')
+
+    def write() -> None:
+        with open(output_path, 'wb') as file:
+            file.write(encoded)
+            file.flush()
+            os.fsync(file.fileno())
+
+    stages = {
+        'decode': decode,
+        'cut_corner': lambda: cut_corner(image, Corner.LOWER_RIGHT, PROPORTION, PROPORTION),
+        'average_colors': lambda: average_colors(corner_img),
+        'colors_stdev': lambda: colors_stdev(corner_img),
+        'corner_picker': lambda: corner_picker.pick_best_corner(image),
+        'watermark_picker': lambda: watermark_picker.pick_best_watermark(image, corner),
+        'add_watermark': lambda: add_watermark(image, corner, watermark, PROPORTION, PROPORTION, 0.5),
+        'encode': encode,
+        'write': write,
+    }
+    return {stage: measure(function, repeats) for stage, function in stages.items()}
+
+
+def run(megapixels: list[float], repeats: int) -> dict:
+    """
+    Benchmarks photos of all sizes
+
+    :param megapixels: sizes of the synthetic photos
+    :param repeats: number of measurements of every stage
+    :return: JSON serializable results
+    """
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'machine': platform.machine(),
+        },
+        'repeats': repeats,
+        'results': {},
+    }
+
+    with Image.open(DEFAULT_DARK_WATERMARK) as watermark, tempfile.TemporaryDirectory() as output_dir:
+        watermark.load()
+        for size in megapixels:
+            data = synthetic_photo(size)
+            timings = benchmark_photo(data, watermark, output_dir, repeats)
+            results['results'][f'{size:g}MP'] = timings
+            print(f'{size:g}MP: '
+                  + ', '.join(f'{stage} {seconds * 1000:.1f} ms' for stage, seconds in timings.items()))
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Finds stages that became slower than in the baseline by more than threshold
+
+    :param results: results of the current run
+    :param baseline: results of a previous run
+    :param threshold: allowed relative slowdown, eg. 0.1 for 10%
+    :return: descriptions of regressions
+    """
+    regressions = []
+    for size, timings in results['results'].items():
+        for stage, seconds in timings.items():
+            baseline_seconds = baseline['results'].get(size, {}).get(stage)
+            if baseline_seconds and seconds > baseline_seconds * (1 + threshold):
+                regressions.append(f'{size} {stage}: {baseline_seconds * 1000:.1f} ms -> {seconds * 1000:.1f} ms '
+                                   f'(+{seconds / baseline_seconds - 1:.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', dest='output', default='benchmark-results.json', type=str,
+                        help='Path to the JSON file with results')
+    parser.add_argument('--megapixels', dest='megapixels', default=DEFAULT_MEGAPIXELS, nargs='+', type=float,
+                        help='Sizes of the synthetic photos')
+    parser.add_argument('--repeats', dest='repeats', default=3, type=int,
+                        help='Number of measurements of every stage, the median is reported')
+    parser.add_argument('--compare', dest='baseline', default=None, type=str,
+                        help='Path to results of a previous run to compare with')
+    parser.add_argument('--threshold', dest='threshold', default=0.15, type=float,
+                        help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    results = run(args.megapixels, args.repeats)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f'Saved results to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 """CLI application for adding watermarks
 
-Adds watermark to each photo in a folder. Supports .jpg files.
+Adds watermark to each photo in a folder. Supports JPEG, PNG, TIFF and WebP photos.
 It does not modify source files, all watermarked photos are placed in a subdirectory.
+With --stdin a single photo is read from standard input and the watermarked photo is written to standard output.
+With --stdin --framed a stream of photos is processed, each prefixed with its length as a 4-byte big-endian integer.
+With --plan the corner and watermark picked for each photo are only written to a JSON lines plan,
+which can be reviewed or edited and then watermarked with --apply.
+With --shard INDEX/COUNT several machines sharing the folder each process a disjoint part of the photos,
+--merge-shards combines summaries of their runs into one report.
 Watermark files are located in src/resources/watermarks/
 
 A more user-friendly graphical application is also available.
@@ -9,21 +15,87 @@ See README.md or the documentation for more information.
 """
 
 import argparse
+import json
 import os
 import sys
+from typing import Optional
+
+from PIL import Image
 
 from core.directory_processors import DirectoryProcessor
-from core.watermarking import Corner
+from core.encoding import OUTPUT_FORMATS, available_output_formats
+from core.exceptions import FramingException, NotSupportedFileFormatException, PlanException, ShardException
+from core.memory import parse_memory_size
+from core.sharding import Shard, merge_shard_summaries
+from core.streams import process_framed_stream, process_stream
+from core.watermarking import CORNER_PRESETS
+
+
+RUN_REPORT_FILENAME = 'watermark-run-report.json'
 
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
 
-    parser.add_argument('-f', '--folder',
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-f', '--folder',
                         dest='folder',
                         help='Path to a folder with photos',
-                        required=True,
                         type=str)
+    source.add_argument('--stdin',
+                        dest='stdin',
+                        action='store_true',
+                        help='Read a photo from standard input and write the watermarked photo to standard output')
+    source.add_argument('--apply',
+                        dest='apply',
+                        help='Add watermarks as decided in a plan written with --plan',
+                        type=str)
+    source.add_argument('--merge-shards',
+                        dest='merge_shards',
+                        metavar='OUTPUT_FOLDER',
+                        help='Combine summaries of shards saved in the output folder into one report, '
+                             'saved to the --profile path or to the output folder',
+                        type=str)
+    parser.add_argument('--plan',
+                        dest='plan',
+                        help='Only pick the corner and watermark of photos in the folder and save them to a plan',
+                        type=str)
+    parser.add_argument('--shard',
+                        dest='shard',
+                        metavar='INDEX/COUNT',
+                        help='Only process photos of shard INDEX (counted from 0) out of COUNT, '
+                             'to split the folder between machines',
+                        type=str)
+    parser.add_argument('--framed',
+                        dest='framed',
+                        action='store_true',
+                        help='With --stdin, read and write a stream of length-prefixed photos')
+    parser.add_argument('-r', '--recursive',
+                        dest='recursive',
+                        action='store_true',
+                        help='Also process photos in nested folders, mirroring the folder tree in the output folder')
+    parser.add_argument('-i', '--incremental',
+                        dest='incremental',
+                        action='store_true',
+                        help='Skip photos already watermarked with the same settings, resumes interrupted runs')
+    parser.add_argument('-w', '--watch',
+                        dest='watch',
+                        action='store_true',
+                        help='Keep running and watermark new photos as soon as they are fully written to the folder')
+    parser.add_argument('--watch-interval',
+                        dest='watch_interval',
+                        default=0.5,
+                        help='With --watch, seconds between checks for new photos',
+                        type=float)
+    parser.add_argument('--content-hash',
+                        dest='content_hash',
+                        action='store_true',
+                        help='In incremental mode detect changed photos by content instead of modification time')
+    parser.add_argument('--cache-analysis',
+                        dest='cache_analysis',
+                        action='store_true',
+                        help='Reuse corners and watermarks picked for the same photos in previous runs, '
+                             'stored in the output folder')
     parser.add_argument('--width',
                         dest='width',
                         default=0.15,
@@ -43,48 +115,279 @@ def main():
                         dest='corners',
                         default='top',
                         type=str,
-                        choices=['all', 'top', 'bottom', 'left', 'right',
-                                 'upper-left', 'upper-right', 'bottom-left', 'bottom-right'])
+                        choices=list(CORNER_PRESETS))
+    parser.add_argument('--analysis-scale',
+                        dest='analysis_scale',
+                        default=1.0,
+                        help='(0.0, 1.0] Size ratio of the downscaled image used to pick the corner and watermark, '
+                             'saves time with --plan, which only decodes photos at this size',
+                        type=float)
+    parser.add_argument('--luma',
+                        dest='luma_analysis',
+                        action='store_true',
+                        help='Pick the corner and watermark from perceived brightness (Rec. 709 luma) '
+                             'instead of RGB colors')
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        default=1,
+                        help='Number of photos processed in parallel, 0 uses all CPUs',
+                        type=int)
+    parser.add_argument('--threads',
+                        dest='threads',
+                        default=0,
+                        help='Process photos in a pipeline overlapping disk access with computation, '
+                             'using this many processing threads. Can not be combined with --jobs',
+                        type=int)
+    parser.add_argument('--io-threads',
+                        dest='io_threads',
+                        default=2,
+                        help='With --threads, number of threads reading and number of threads writing files',
+                        type=int)
+    parser.add_argument('--queue-size',
+                        dest='queue_size',
+                        default=4,
+                        help='With --threads, maximum number of photos waiting in front of each pipeline stage',
+                        type=int)
+    parser.add_argument('--max-memory',
+                        dest='max_memory',
+                        default=None,
+                        help='Approximate limit of memory used by photos processed at once, eg. 512M or 4G. '
+                             'Photos larger than the limit are processed one by one with a low-memory path',
+                        type=str)
+    parser.add_argument('--format',
+                        dest='output_format',
+                        default='jpeg',
+                        help='Format of watermarked photos, webp and avif keep transparency and give smaller files',
+                        choices=list(OUTPUT_FORMATS))
+    parser.add_argument('-q', '--quality',
+                        dest='quality',
+                        default='100',
+                        help="[1, 100] quality or 'keep' to reuse JPEG quantization tables of the original photo",
+                        type=str)
+    parser.add_argument('--subsampling',
+                        dest='subsampling',
+                        default=None,
+                        help='JPEG chroma subsampling, by default 4:2:0 or the same as the original with quality keep',
+                        choices=['4:4:4', '4:2:2', '4:2:0', 'keep'])
+    parser.add_argument('--progressive',
+                        dest='progressive',
+                        action='store_true',
+                        help='Save progressive JPEGs')
+    parser.add_argument('--optimize',
+                        dest='optimize',
+                        action='store_true',
+                        help='Optimize Huffman tables, slower encoding for smaller files')
+    parser.add_argument('--profile',
+                        dest='profile',
+                        default=None,
+                        help='Save timings of processing stages to a JSON report',
+                        type=str)
+    parser.add_argument('--cprofile-sample',
+                        dest='cprofile_sample',
+                        default=0,
+                        help='With --profile, capture cProfile statistics of every n-th photo',
+                        type=int)
+    parser.add_argument('--use-watermark-alpha',
+                        dest='use_watermark_alpha',
+                        action='store_true',
+                        help="Use watermark's own alpha channel instead of treating black pixels as transparent")
 
     args = parser.parse_args()
 
-    if not os.path.exists(args.folder):
+    if args.framed and not args.stdin:
+        print('--framed can only be used with --stdin')
+        sys.exit()
+
+    if args.watch and args.stdin:
+        print('--watch can not be used with --stdin')
+        sys.exit()
+
+    if args.plan is not None and (args.folder is None or args.watch):
+        print('--plan can only be used with --folder and without --watch')
+        sys.exit()
+
+    if args.apply is not None and args.watch:
+        print('--apply can not be used with --watch')
+        sys.exit()
+
+    if args.apply is not None and not os.path.isfile(args.apply):
+        print(f'{args.apply} does not exist')
+        sys.exit()
+
+    shard = None
+    if args.shard is not None:
+        if args.folder is None or args.watch or args.plan is not None:
+            print('--shard can only be used with --folder and without --watch or --plan')
+            sys.exit()
+        try:
+            shard = Shard.parse(args.shard)
+        except ValueError as err:
+            print(err)
+            sys.exit()
+
+    if args.merge_shards is not None:
+        if not os.path.isdir(args.merge_shards):
+            print(f'{args.merge_shards} is not a directory')
+            sys.exit()
+        merge_shards(args.merge_shards, args.profile)
+        return
+
+    if args.watch and (args.jobs != 1 or args.threads > 0):
+        print('--watch processes photos one by one, it can not be combined with --jobs or --threads')
+        sys.exit()
+
+    if args.watch_interval <= 0:
+        print('Watch interval must be positive')
+        sys.exit()
+
+    if args.folder is not None and not os.path.exists(args.folder):
         print(f'{args.folder} does not exist')
         sys.exit()
 
-    if not os.path.isdir(args.folder):
+    if args.folder is not None and not os.path.isdir(args.folder):
         print(f'{args.folder} is not a directory')
         sys.exit()
 
-    corners = None
-    match args.corners:
-        case 'all':
-            corners = [Corner.UPPER_LEFT, Corner.UPPER_RIGHT, Corner.LOWER_LEFT, Corner.LOWER_RIGHT]
-        case 'top':
-            corners = [Corner.UPPER_LEFT, Corner.UPPER_RIGHT]
-        case 'bottom':
-            corners = [Corner.LOWER_LEFT, Corner.LOWER_RIGHT]
-        case 'left':
-            corners = [Corner.UPPER_LEFT, Corner.LOWER_LEFT]
-        case 'right':
-            corners = [Corner.UPPER_RIGHT, Corner.LOWER_RIGHT]
-        case 'upper-left':
-            corners = [Corner.UPPER_LEFT]
-        case 'upper-right':
-            corners = [Corner.UPPER_RIGHT]
-        case 'bottom-left':
-            corners = [Corner.LOWER_LEFT]
-        case 'bottom-right':
-            corners = [Corner.LOWER_RIGHT]
+    if args.jobs < 0:
+        print('Number of jobs can not be negative')
+        sys.exit()
+
+    if args.threads < 0 or args.io_threads < 1 or args.queue_size < 1:
+        print('Number of threads can not be negative, number of I/O threads and queue size must be positive')
+        sys.exit()
+
+    if args.threads > 0 and args.jobs != 1:
+        print('--threads can not be combined with --jobs')
+        sys.exit()
+
+    if not 0 < args.analysis_scale <= 1:
+        print('Analysis scale must be greater than 0 and at most 1')
+        sys.exit()
+
+    if args.quality != 'keep' and not (args.quality.isdigit() and 1 <= int(args.quality) <= 100):
+        print("Quality must be an integer between 1 and 100 or 'keep'")
+        sys.exit()
+    quality = args.quality if args.quality == 'keep' else int(args.quality)
+
+    if args.output_format not in available_output_formats():
+        print(f'{args.output_format} is not supported by the installed Pillow')
+        sys.exit()
+
+    max_memory = None
+    if args.max_memory is not None:
+        try:
+            max_memory = parse_memory_size(args.max_memory)
+        except ValueError as err:
+            print(err)
+            sys.exit()
+        if max_memory <= 0:
+            print('Memory limit must be positive')
+            sys.exit()
 
     directory_processor = DirectoryProcessor(
         max_width_proportion=args.width,
         max_height_proportion=args.height,
         opacity=args.opacity,
-        corners=corners,
+        corners=CORNER_PRESETS[args.corners],
+        use_watermark_alpha=args.use_watermark_alpha,
+        analysis_scale=args.analysis_scale,
+        luma_analysis=args.luma_analysis,
+        cprofile_sample=args.cprofile_sample if args.profile is not None else 0,
+        quality=quality,
+        subsampling=args.subsampling,
+        progressive=args.progressive,
+        optimize=args.optimize,
+        max_memory=max_memory,
+        output_format=args.output_format,
     )
 
-    directory_processor.process_directory(args.folder)
+    if args.stdin:
+        process_standard_streams(directory_processor, args.framed)
+        return
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    if args.plan is not None:
+        directory_processor.plan_directory(args.folder, args.plan, recursive=args.recursive,
+                                           cache_analysis=args.cache_analysis)
+    elif args.apply is not None:
+        try:
+            directory_processor.apply_plan(args.apply,
+                                           jobs=jobs,
+                                           threads=args.threads,
+                                           io_threads=args.io_threads,
+                                           queue_size=args.queue_size)
+        except PlanException as err:
+            print(err)
+            sys.exit()
+    elif args.watch:
+        try:
+            directory_processor.watch_directory(args.folder,
+                                                recursive=args.recursive,
+                                                interval=args.watch_interval,
+                                                use_content_hash=args.content_hash,
+                                                cache_analysis=args.cache_analysis)
+        except KeyboardInterrupt:
+            print('Stopped watching')
+    else:
+        directory_processor.process_directory(args.folder,
+                                              jobs=jobs,
+                                              recursive=args.recursive,
+                                              incremental=args.incremental,
+                                              use_content_hash=args.content_hash,
+                                              threads=args.threads,
+                                              io_threads=args.io_threads,
+                                              queue_size=args.queue_size,
+                                              cache_analysis=args.cache_analysis,
+                                              shard=shard)
+
+    if args.profile is not None:
+        directory_processor.profile.save(args.profile)
+        print(f'Saved profile report to {args.profile}')
+
+
+def merge_shards(output_folder: str, report_path: Optional[str]) -> None:
+    """
+    Combines summaries of shards into one run report, printing an overview
+
+    :param output_folder: output folder shared by the shards
+    :param report_path: path to the JSON report, saved in the output folder if None
+    """
+
+    try:
+        report = merge_shard_summaries(output_folder)
+    except ShardException as err:
+        print(err)
+        sys.exit()
+
+    report_path = report_path if report_path is not None else os.path.join(output_folder, RUN_REPORT_FILENAME)
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Merged {len(report['shards'])} of {report['shard_count']} shards: "
+          f"{report['files_processed']} photos watermarked, {int(report['counters'].get('failed_files', 0))} failed, "
+          f"wall time {report['wall_time']:.1f} s")
+    if report['missing_shards']:
+        print(f"Shards without a summary: {', '.join(map(str, report['missing_shards']))}")
+    print(f'Saved run report to {report_path}')
+
+
+def process_standard_streams(directory_processor: DirectoryProcessor, framed: bool) -> None:
+    """
+    Processes photos read from standard input, writing the results to standard output.
+    Messages are printed to standard error, so they do not mix with the images
+
+    :param directory_processor: processor with watermarking options
+    :param framed: whether the streams hold length-prefixed frames instead of a single photo
+    """
+
+    try:
+        if framed:
+            process_framed_stream(directory_processor, sys.stdin.buffer, sys.stdout.buffer)
+        else:
+            process_stream(directory_processor, sys.stdin.buffer, sys.stdout.buffer)
+    except (OSError, FramingException, NotSupportedFileFormatException, Image.DecompressionBombError) as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
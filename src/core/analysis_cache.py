@@ -0,0 +1,124 @@
+"""
+Persistent cache of the corner and watermark type picked for photos
+
+Decisions do not depend on opacity, watermark artwork or encoder settings, so a photo rendered again
+with other settings skips the analysis. Records are keyed by the SHA-256 of the photo's contents
+and the analysis parameters, so renamed or moved photos still hit the cache
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import NamedTuple, Optional
+
+from core.corner_analysis import statistics_from_json, statistics_to_json
+from core.watermark_pickers import WatermarkType
+from core.watermarking import ColorStatistics, Corner
+
+
+class AnalysisRecord(NamedTuple):
+    """
+    Decision made for a photo and the statistics it was based on
+    """
+    corner: Corner
+    watermark_type: WatermarkType
+    statistics: dict[Corner, ColorStatistics]
+
+
+class AnalysisCache:
+    """
+    SQLite database of analysis records, safe to use from multiple threads and processes.
+
+    Every process opens its own connection when the cache is first used, so the cache can be sent
+    to worker processes. Records are committed immediately
+    """
+
+    FILENAME = '.watermark-analysis.sqlite'
+
+    def __init__(self, filepath: str, parameters: dict):
+        """
+        :param filepath: path to the database, created if it does not exist
+        :param parameters: JSON serializable analysis parameters, records of other parameters are not used
+        """
+        self.filepath = filepath
+        self.parameters_key = json.dumps(parameters, sort_keys=True)
+        self.hits = 0
+        self.misses = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        """
+        Connections and locks are not sent to worker processes
+        """
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Autocommit, concurrent writers wait for each other instead of failing
+            self._connection = sqlite3.connect(self.filepath, timeout=30, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS analysis ('
+                                     'content_hash TEXT NOT NULL, parameters TEXT NOT NULL, '
+                                     'corner TEXT NOT NULL, watermark_type TEXT NOT NULL, statistics TEXT NOT NULL, '
+                                     'PRIMARY KEY (content_hash, parameters))')
+        return self._connection
+
+    def get(self, content_hash: str) -> Optional[AnalysisRecord]:
+        """
+        Looks up the decision made for a photo with current parameters
+
+        :param content_hash: SHA-256 of the photo's contents, see :func:`content_sha256`
+        :return: cached record, None if the photo was not analysed with current parameters
+        """
+        with self._lock:
+            row = self._connect().execute('SELECT corner, watermark_type, statistics FROM analysis '
+                                          'WHERE content_hash = ? AND parameters = ?',
+                                          (content_hash, self.parameters_key)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        corner, watermark_type, statistics = row
+        return AnalysisRecord(Corner(corner), WatermarkType[watermark_type],
+                              statistics_from_json(json.loads(statistics)))
+
+    def put(self, content_hash: str, record: AnalysisRecord) -> None:
+        """
+        Stores the decision made for a photo with current parameters
+
+        :param content_hash: SHA-256 of the photo's contents
+        :param record: decision and statistics of the analysed corners
+        """
+        statistics = json.dumps(statistics_to_json(record.statistics))
+        with self._lock:
+            self._connect().execute('INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?)',
+                                    (content_hash, self.parameters_key, record.corner.value,
+                                     record.watermark_type.name, statistics))
+
+    def close(self) -> None:
+        """
+        Closes the connection of the current process, the cache is reopened if used again
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def content_sha256(data: bytes) -> str:
+    """
+    SHA-256 hash of a photo's contents, the same as :func:`core.manifest.file_sha256` of its file
+
+    :param data: contents of the photo's file
+    :return: hexadecimal digest
+    """
+    return hashlib.sha256(data).hexdigest()
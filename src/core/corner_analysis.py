@@ -0,0 +1,190 @@
+from PIL import Image
+
+from core.watermarking import Corner, ColorStatistics, StatisticsBackend, avg, color_statistics, corner_box, \
+    cut_corner, normalize_mode, to_luma
+
+
+class CornerAnalysis:
+    """
+    Color statistics of the corners of an image
+
+    Every requested corner is cropped and read exactly once,
+    the result is shared between the corner picker and the watermark picker
+    """
+
+    def __init__(self,
+                 image: Image.Image,
+                 corners: list[Corner],
+                 width_proportion: float,
+                 height_proportion: float,
+                 statistics_backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT):
+        """
+        Computes statistics of all corners
+
+        :param image: image to analyse, corners of images in other modes than RGB are analysed as RGB
+        :param corners: corners to compute statistics for
+        :param width_proportion: [0.0, 1.0] corner / image width ratio
+        :param height_proportion: [0.0, 1.0] corner / image height ratio
+        :param statistics_backend: implementation used to compute color statistics
+        """
+        self.width_proportion = width_proportion
+        self.height_proportion = height_proportion
+        self.statistics: dict[Corner, ColorStatistics] = {}
+
+        for corner in corners:
+            if corner in self.statistics:
+                continue
+            corner_img = cut_corner(image, corner, width_proportion, height_proportion)
+            self.statistics[corner] = self._region_statistics(corner_img, statistics_backend)
+
+    def _region_statistics(self, region: Image.Image, statistics_backend: StatisticsBackend) -> ColorStatistics:
+        """
+        :param region: corner cut out of the image
+        :param statistics_backend: implementation used to compute color statistics
+        :return: statistics of RGB channels of the region
+        """
+        if region.mode != 'RGB':
+            # Statistics of other bands, such as alpha or palette indices, do not describe the colors
+            region = normalize_mode(region)
+        return color_statistics(region, statistics_backend)
+
+    @property
+    def corners(self) -> list[Corner]:
+        return list(self.statistics.keys())
+
+    def get(self, corner: Corner, width_proportion: float, height_proportion: float) -> ColorStatistics:
+        """
+        Statistics of a corner, checking that it was analysed with the expected proportions
+
+        :param corner: analysed corner
+        :param width_proportion: expected corner / image width ratio
+        :param height_proportion: expected corner / image height ratio
+        :return: statistics of the corner
+        :raises ValueError: if the corner was not analysed or proportions do not match
+        """
+        if (width_proportion, height_proportion) != (self.width_proportion, self.height_proportion):
+            raise ValueError("Analysis was computed with different proportions")
+        if corner not in self.statistics:
+            raise ValueError(f"Corner {corner.value} was not analysed")
+
+        return self.statistics[corner]
+
+
+def statistics_to_json(statistics: dict[Corner, ColorStatistics]) -> dict:
+    """
+    :param statistics: statistics of analysed corners
+    :return: JSON serializable statistics keyed by corner names
+    """
+    return {corner.value: corner_statistics._asdict() for corner, corner_statistics in statistics.items()}
+
+
+def statistics_from_json(statistics: dict) -> dict[Corner, ColorStatistics]:
+    """
+    :param statistics: statistics as returned by :func:`statistics_to_json`
+    :return: statistics of analysed corners
+    :raises ValueError: if a corner name is not valid
+    """
+    return {Corner(name): ColorStatistics(tuple(values['mean']), tuple(values['variance']), tuple(values['stdev']))
+            for name, values in statistics.items()}
+
+
+class LumaAnalysis(CornerAnalysis):
+    """
+    Brightness statistics of the corners of an image
+
+    Every corner is converted once to a single Rec. 709 luma channel,
+    statistics have a single value instead of one value for each RGB channel
+    """
+
+    def _region_statistics(self, region: Image.Image, statistics_backend: StatisticsBackend) -> ColorStatistics:
+        return color_statistics(to_luma(region), statistics_backend)
+
+
+class PyramidAnalysis(CornerAnalysis):
+    """
+    Color statistics of the corners of an image, refined from coarse to fine resolution
+
+    Corners are first compared on regions subsampled by coarse_factor, which only reads every coarse_factor-th pixel
+    of every coarse_factor-th row. Only corners whose average standard deviation of RGB color values is close
+    to the lowest one are analysed again at twice the resolution, until a single corner is clearly ahead
+    or full resolution is reached. Subsampled regions can not tell corners that score practically the same apart,
+    fine texture may alias into a flat region, so such corners are analysed again at full resolution right away,
+    in order, stopping at the first uniform one. Statistics of every corner come from the finest resolution
+    it was analysed at
+    """
+
+    def __init__(self,
+                 image: Image.Image,
+                 corners: list[Corner],
+                 width_proportion: float,
+                 height_proportion: float,
+                 statistics_backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT,
+                 coarse_factor: int = 16,
+                 tolerance: float = 0.25,
+                 min_difference: float = 1.0,
+                 min_region_size: int = 8):
+        """
+        Computes statistics of all corners
+
+        :param image: image to analyse, corners of images in other modes than RGB are analysed as RGB
+        :param corners: corners to compute statistics for
+        :param width_proportion: [0.0, 1.0] corner / image width ratio
+        :param height_proportion: [0.0, 1.0] corner / image height ratio
+        :param statistics_backend: implementation used to compute color statistics
+        :param coarse_factor: subsampling factor of the coarsest resolution, halved at every level
+        :param tolerance: corners whose score is at most (1 + tolerance) times the lowest score are re-evaluated
+        :param min_difference: corners whose score is at most this much above the lowest score are also re-evaluated.
+            If the scores of all re-evaluated corners are this close, they are re-evaluated at full resolution
+        :param min_region_size: minimum size in pixels of a subsampled corner region, limits the coarsest resolution
+        :raises ValueError: if coarse_factor is smaller than 1 or tolerance is negative
+        """
+        if coarse_factor < 1:
+            raise ValueError("coarse_factor must be a positive integer")
+        if tolerance < 0:
+            raise ValueError("tolerance can not be negative")
+
+        self.width_proportion = width_proportion
+        self.height_proportion = height_proportion
+        self.statistics: dict[Corner, ColorStatistics] = {}
+        # Subsampling factor of the statistics of each corner, 1 is full resolution
+        self.factors: dict[Corner, int] = {}
+
+        boxes = {corner: corner_box(image.size, corner, width_proportion, height_proportion) for corner in corners}
+        smallest_side = min(min(right - left, lower - upper) for left, upper, right, lower in boxes.values())
+        factor = coarse_factor
+        while factor > 1 and smallest_side // factor < min_region_size:
+            factor //= 2
+
+        self.contenders = list(boxes)
+        while True:
+            for corner in self.contenders:
+                self.statistics[corner] = self._region_statistics(image, boxes[corner], factor, statistics_backend)
+                self.factors[corner] = factor
+                if factor == 1 and avg(self.statistics[corner].stdev) == 0:
+                    # No corner scores lower than a uniform one, later contenders would only lose the tie
+                    self.contenders = [corner]
+                    break
+
+            scores = {corner: avg(self.statistics[corner].stdev) for corner in self.contenders}
+            lowest = min(scores.values())
+            threshold = max(lowest * (1 + tolerance), lowest + min_difference)
+            self.contenders = [corner for corner, score in scores.items() if score <= threshold]
+            if factor == 1 or len(self.contenders) == 1:
+                break
+            if max(scores[corner] for corner in self.contenders) - lowest <= min_difference:
+                factor = 1
+            else:
+                factor = max(1, factor // 2)
+
+    @staticmethod
+    def _region_statistics(image: Image.Image, box: tuple[int, int, int, int], factor: int,
+                           statistics_backend: StatisticsBackend) -> ColorStatistics:
+        if factor == 1:
+            region = image.crop(box)
+        else:
+            # Nearest neighbour subsampling only reads every factor-th pixel, unlike reduce() which averages them all
+            left, upper, right, lower = box
+            region = image.resize((max(1, (right - left) // factor), max(1, (lower - upper) // factor)),
+                                  Image.Resampling.NEAREST, box=box)
+        # Statistics of other bands, such as alpha or palette indices, do not describe the colors
+        return color_statistics(normalize_mode(region), statistics_backend)
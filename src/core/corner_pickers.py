@@ -2,7 +2,8 @@ from abc import ABC, abstractmethod
 
 from PIL import Image
 
-from core.watermarking import cut_corner, colors_stdev, avg, Corner
+from core.corner_analysis import CornerAnalysis, LumaAnalysis, PyramidAnalysis
+from core.watermarking import avg, Corner, StatisticsBackend
 
 
 class CornerPicker(ABC):
@@ -14,13 +15,15 @@ class CornerPicker(ABC):
     def __init__(self,
                  corners: list[Corner],
                  max_width_proportion: float,
-                 max_height_proportion: float):
+                 max_height_proportion: float,
+                 statistics_backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT):
         """
         Validates inputs
 
         :param corners: list of corners for the picker to choose from
         :param max_width_proportion: [0.0, 1.0] maximum watermark / image width ratio
         :param max_height_proportion: [0.0, 1.0] maximum watermark / image height ratio
+        :param statistics_backend: implementation used to compute color statistics
         """
         if not 0 <= max_width_proportion <= 1:
             raise ValueError("width_proportion must be between 0 and 1")
@@ -32,8 +35,18 @@ class CornerPicker(ABC):
         self.height_proportion = max_height_proportion
         self.width_proportion = max_width_proportion
         self.corners = corners
+        self.statistics_backend = statistics_backend
+
+    def analyze(self, image: Image) -> CornerAnalysis:
+        """
+        Computes statistics of all corners the picker chooses from
+
+        :param image: image to analyse
+        :return: analysis that can be shared with a :class:`core.watermark_pickers.WatermarkPicker`
+        """
+        return CornerAnalysis(image, self.corners, self.width_proportion, self.height_proportion,
+                              self.statistics_backend)
 
-    @abstractmethod
     def pick_best_corner(self, image: Image) -> Corner:
         """
         Picks the best corner of an image to place a watermark
@@ -42,6 +55,16 @@ class CornerPicker(ABC):
         :return: best corner chosen according to implementation's spec,
                 (UPPER_LEFT, UPPER_RIGHT, LOWER_LEFT, LOWER_RIGHT)
         """
+        return self.pick_best_corner_from_analysis(self.analyze(image))
+
+    @abstractmethod
+    def pick_best_corner_from_analysis(self, analysis: CornerAnalysis) -> Corner:
+        """
+        Picks the best corner based on already computed statistics
+
+        :param analysis: statistics of the corners, see :meth:`CornerPicker.analyze`
+        :return: best corner chosen according to implementation's spec
+        """
 
 
 class RgbStdevCornerPicker(CornerPicker):
@@ -49,12 +72,82 @@ class RgbStdevCornerPicker(CornerPicker):
     Picks corner with the smallest average standard deviation of RGB color values
     """
 
-    def pick_best_corner(self, image: Image) -> Corner:
+    def pick_best_corner_from_analysis(self, analysis: CornerAnalysis) -> Corner:
+        standard_deviations = {}
+        for corner in self.corners:
+            statistics = analysis.get(corner, self.width_proportion, self.height_proportion)
+            standard_deviations[corner] = avg(statistics.stdev)
+
+        best_corner, min_std = min(standard_deviations.items(), key=lambda it: it[1])
+        return best_corner
+
+
+class LumaStdevCornerPicker(CornerPicker):
+    """
+    Picks corner with the smallest standard deviation of Rec. 709 luma, see :class:`core.corner_analysis.LumaAnalysis`
+    """
+
+    def analyze(self, image: Image) -> LumaAnalysis:
+        return LumaAnalysis(image, self.corners, self.width_proportion, self.height_proportion,
+                            self.statistics_backend)
+
+    def pick_best_corner_from_analysis(self, analysis: CornerAnalysis) -> Corner:
         standard_deviations = {}
         for corner in self.corners:
-            corner_img = cut_corner(image, corner, self.width_proportion, self.height_proportion)
-            avg_std = avg(colors_stdev(corner_img))
-            standard_deviations[corner] = avg_std
+            statistics = analysis.get(corner, self.width_proportion, self.height_proportion)
+            standard_deviations[corner] = statistics.stdev[0]
 
         best_corner, min_std = min(standard_deviations.items(), key=lambda it: it[1])
         return best_corner
+
+
+class PyramidCornerPicker(RgbStdevCornerPicker):
+    """
+    Picks corner with the smallest average standard deviation of RGB color values,
+    ranking corners on heavily subsampled regions first and re-evaluating only close contenders
+    at progressively higher resolution, see :class:`core.corner_analysis.PyramidAnalysis`.
+
+    Usually agrees with :class:`RgbStdevCornerPicker` while reading far fewer pixels of large images,
+    near-ties are always resolved at full resolution
+    """
+
+    def __init__(self,
+                 corners: list[Corner],
+                 max_width_proportion: float,
+                 max_height_proportion: float,
+                 statistics_backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT,
+                 coarse_factor: int = 16,
+                 tolerance: float = 0.25,
+                 min_difference: float = 1.0):
+        """
+        :param corners: list of corners for the picker to choose from
+        :param max_width_proportion: [0.0, 1.0] maximum watermark / image width ratio
+        :param max_height_proportion: [0.0, 1.0] maximum watermark / image height ratio
+        :param statistics_backend: implementation used to compute color statistics
+        :param coarse_factor: subsampling factor of the coarsest resolution, halved at every level
+        :param tolerance: corners whose score is at most (1 + tolerance) times the lowest score are re-evaluated
+        :param min_difference: corners scoring at most this much above the lowest score are re-evaluated,
+            at full resolution if all re-evaluated corners score this close
+        :raises ValueError: if coarse_factor is smaller than 1 or tolerance is negative
+        """
+        if coarse_factor < 1:
+            raise ValueError("coarse_factor must be a positive integer")
+        if tolerance < 0:
+            raise ValueError("tolerance can not be negative")
+
+        super().__init__(corners, max_width_proportion, max_height_proportion, statistics_backend)
+        self.coarse_factor = coarse_factor
+        self.tolerance = tolerance
+        self.min_difference = min_difference
+
+    def analyze(self, image: Image) -> PyramidAnalysis:
+        return PyramidAnalysis(image, self.corners, self.width_proportion, self.height_proportion,
+                               self.statistics_backend, self.coarse_factor, self.tolerance, self.min_difference)
+
+    def pick_best_corner_from_analysis(self, analysis: CornerAnalysis) -> Corner:
+        if not isinstance(analysis, PyramidAnalysis):
+            return super().pick_best_corner_from_analysis(analysis)
+
+        # Only the remaining contenders were compared at the same resolution, ties are resolved in order of corners
+        return min(analysis.contenders,
+                   key=lambda corner: avg(analysis.get(corner, self.width_proportion, self.height_proportion).stdev))
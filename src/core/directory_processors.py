@@ -1,19 +1,121 @@
+import cProfile
+import io
 import os.path
-from typing import Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional, Union
 
 import PIL.Image
 from PIL import Image
 
-from core.corner_pickers import RgbStdevCornerPicker
-from core.exceptions import NotSupportedFileFormatException
-from core.watermark_pickers import WatermarkType, AvgRgbWatermarkPicker
-from core.watermarking import add_watermark, Corner
+from core.analysis_cache import AnalysisCache, AnalysisRecord, content_sha256
+from core.corner_analysis import CornerAnalysis
+from core.corner_pickers import CornerPicker, LumaStdevCornerPicker, RgbStdevCornerPicker
+from core.encoding import ALPHA_OUTPUT_FORMATS, OUTPUT_FORMATS, save_options, validate_jpeg_options, \
+    validate_output_format
+from core.exceptions import NotSupportedFileFormatException, PlanException
+from core.manifest import ProcessingManifest, file_sha256
+from core.memory import MemoryBudget, estimate_footprint
+from core.pipeline import Stage, StageFailure, run_pipeline
+from core.plan import PlanEntry, read_plan, write_plan_entries
+from core.profiling import RunProfile, StageTimer
+from core.sharding import Shard, write_shard_summary
+from core.watermark_pickers import WatermarkType, AvgRgbWatermarkPicker, LumaWatermarkPicker
+from core.watermark_cache import PreparedWatermarkCache
+from core.watching import FolderWatcher
+from core.watermarking import Corner, StatisticsBackend, normalize_mode, paste_watermark, watermark_size, \
+    reduce_for_analysis
 from resources.watermarks import DEFAULT_LIGHT_WATERMARK, DEFAULT_DARK_WATERMARK
 
 
+def scan_files(dir_path: str,
+               recursive: bool = False,
+               extensions: Optional[list[str]] = None,
+               excluded_directories: Iterable[str] = ()) -> Iterator[str]:
+    """
+    Lazily lists files in a directory, paths are yielded while the directory is still being read.
+    Extensions are checked on names only, before any other file system access.
+    Symbolic links to directories are not followed
+
+    :param dir_path: directory to scan
+    :param recursive: also scan nested directories
+    :param extensions: only yield files with one of these lowercase extensions, compared ignoring case,
+        all files if None
+    :param excluded_directories: directories that are never scanned, along with their contents
+    :return: iterator over paths to files
+    """
+
+    excluded = {os.path.abspath(directory) for directory in excluded_directories}
+    pending_directories = [os.path.abspath(dir_path)]
+
+    while pending_directories:
+        with os.scandir(pending_directories.pop()) as entries:
+            for entry in entries:
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    if entry.name != DirectoryProcessor.OUTPUT_SUBDIRECTORY and entry.path not in excluded:
+                        pending_directories.append(entry.path)
+                elif extensions is None or os.path.splitext(entry.name)[1].lower() in extensions:
+                    if entry.is_file():
+                        yield entry.path
+
+
+class FileResult(NamedTuple):
+    """
+    Outcome of processing a single photo
+    """
+    filepath: str
+    watermarked_filepath: Optional[str]  # None if the photo was not processed
+    timings: dict[str, float]
+    cprofile_stats: Optional[dict]
+    input_size: int = 0
+    output_size: int = 0
+    counters: Optional[dict[str, int]] = None  # cache lookups made by a worker process while processing the photo
+
+
+class WatermarkedImage(NamedTuple):
+    """
+    Result of adding watermark to a photo held in memory
+    """
+    corner: Corner
+    watermark_type: WatermarkType
+    data: bytes  # encoded file in the output format
+
+
+class _PipelineTask:
+    """
+    State of a photo passed between stages of :meth:`DirectoryProcessor._process_files_in_pipeline`
+    """
+
+    def __init__(self, filepath: str, output_directory: str, capture_cprofile: bool,
+                 budget: Optional[MemoryBudget] = None):
+        self.filepath = filepath
+        self.output_directory = output_directory
+        self.capture_cprofile = capture_cprofile
+        self.timer = StageTimer()
+        self.watermarked_filepath: Optional[str] = None
+        self.data = b''
+        self.encoded = b''
+        self.cprofile_stats: Optional[dict] = None
+        # Memory admitted by the budget, returned once the photo was written or failed
+        self.budget = budget
+        self.memory = 0
+        self.low_memory = False
+
+    def release_memory(self) -> None:
+        if self.budget is not None:
+            self.budget.release(self.memory)
+            self.budget = None
+
+
 class DirectoryProcessor:
-    SUPPORTED_PHOTO_FILE_FORMATS = ['.jpg', '.jpeg']
+    SUPPORTED_PHOTO_FILE_FORMATS = ['.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp']
+    # Formats detected from file headers, cameras often write JPEGs with multiple pictures as MPO
+    SUPPORTED_PHOTO_IMAGE_FORMATS = ['JPEG', 'MPO', 'PNG', 'TIFF', 'WEBP']
     SUPPORTED_WATERMARK_FILE_FORMATS = ['.png']
+    OUTPUT_SUBDIRECTORY = 'with-watermark'
 
     def __init__(self,
                  max_width_proportion: float,
@@ -22,7 +124,21 @@ class DirectoryProcessor:
                  dark_watermark_filepath: str = DEFAULT_DARK_WATERMARK,
                  light_watermark_filepath: str = DEFAULT_LIGHT_WATERMARK,
                  cutoff_color=150,  # TODO: fine tune the cutoff color
-                 corners: list[Corner] = None):
+                 corners: list[Corner] = None,
+                 statistics_backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT,
+                 resample: Image.Resampling = Image.Resampling.NEAREST,
+                 watermark_cache_size: int = 16,
+                 use_watermark_alpha: bool = False,
+                 analysis_scale: float = 1.0,
+                 cprofile_sample: int = 0,
+                 quality: Union[int, str] = 100,
+                 subsampling: Optional[str] = None,
+                 progressive: bool = False,
+                 optimize: bool = False,
+                 max_memory: Optional[int] = None,
+                 output_format: str = 'jpeg',
+                 corner_picker: Optional[CornerPicker] = None,
+                 luma_analysis: bool = False):
         """
         Checks if watermark files exists and have a valid format
         TODO: May raise Exception
@@ -32,6 +148,32 @@ class DirectoryProcessor:
         :param max_width_proportion: [0, 1] maximum watermark / image width ratio
         :param max_height_proportion: [0, 1] maximum watermark / image height ratio
         :param opacity: opacity of the watermark
+        :param statistics_backend: implementation used by the pickers to compute color statistics
+        :param resample: resampling filter used for scaling watermarks
+        :param watermark_cache_size: maximum number of prepared watermarks kept in memory
+        :param use_watermark_alpha: use the watermarks' own alpha channel instead of treating black as transparent
+        :param analysis_scale: (0, 1] size ratio of the image used to pick the corner and watermark type,
+            values below 1 analyse downscaled copies of the corners of the decoded photo, which is only faster
+            than analysing them at full resolution from about 0.25. Only :meth:`DirectoryProcessor.plan_directory`,
+            which does not watermark photos, decodes JPEGs at reduced size
+        :param cprofile_sample: capture cProfile statistics of every n-th photo processed by
+            :meth:`DirectoryProcessor.process_directory`, disabled if 0
+        :param quality: [1, 100] JPEG quality or 'keep' to reuse quantization tables of the photo
+        :param subsampling: JPEG chroma subsampling ('4:4:4', '4:2:2', '4:2:0' or 'keep'), encoder default if None
+        :param progressive: save progressive JPEGs
+        :param optimize: compute optimal Huffman tables, slower encoding for smaller files
+        :param max_memory: approximate limit in bytes of memory used by photos processed at once,
+            photos are admitted based on the size estimated from their headers, see :mod:`core.memory`.
+            Larger photos are processed alone with a low-memory path. Not limited if None
+        :param output_format: format of watermarked photos, one of :data:`core.encoding.OUTPUT_FORMATS`.
+            WebP and AVIF keep transparency of the photos, transparent photos are flattened onto white in JPEG
+        :param corner_picker: picker used instead of the default :class:`core.corner_pickers.RgbStdevCornerPicker`,
+            must use the same proportions as the processor, its corners replace the corners argument
+        :param luma_analysis: pick the corner and watermark type from a single Rec. 709 luma channel
+            instead of three RGB channels, see :class:`core.corner_analysis.LumaAnalysis`
+        :raises ValueError: if analysis_scale is not in (0, 1], encoder options are invalid,
+            the output format is not supported, max_memory is not positive
+            or corner_picker uses other proportions
         :raises FileNotFoundError: if provided watermark could not be found
         :raises NotSupportedFileFormatException: if provided watermark's type is not supported
         """
@@ -50,6 +192,43 @@ class DirectoryProcessor:
         self.max_height_proportion = max_height_proportion
         self.max_width_proportion = max_width_proportion
         self.cutoff_color = cutoff_color
+        self.statistics_backend = statistics_backend
+        self.resample = resample
+        self.use_watermark_alpha = use_watermark_alpha
+
+        if not 0 < analysis_scale <= 1:
+            raise ValueError("analysis_scale must be greater than 0 and at most 1")
+        self.analysis_scale = analysis_scale
+
+        validate_jpeg_options(quality, subsampling)
+        validate_output_format(output_format)
+        self.output_format = output_format
+        self.quality = quality
+        self.subsampling = subsampling
+        self.progressive = progressive
+        self.optimize = optimize
+
+        if max_memory is not None and max_memory <= 0:
+            raise ValueError("max_memory must be positive")
+        self.max_memory = max_memory
+
+        # Timings of the last run of process_directory
+        self.cprofile_sample = cprofile_sample
+        self.profile = RunProfile()
+
+        # Scaled and masked watermarks, reused between photos of the same size
+        self.watermark_cache = PreparedWatermarkCache(watermark_cache_size)
+        # Decisions of previous runs, set while process_directory or watch_directory run with cache_analysis,
+        # can also be assigned to reuse decisions in process_bytes and process_images
+        self.analysis_cache: Optional[AnalysisCache] = None
+        # Decisions of the plan being applied by apply_plan, keyed by absolute paths of photos
+        self._plan: dict[str, PlanEntry] = {}
+
+        if corner_picker is not None:
+            if (corner_picker.width_proportion, corner_picker.height_proportion) != \
+                    (max_width_proportion, max_height_proportion):
+                raise ValueError("corner_picker must use the same proportions as the processor")
+            corners = corner_picker.corners
 
         if corners is None:
             self.corners = [
@@ -62,15 +241,20 @@ class DirectoryProcessor:
             self.corners = corners
 
         # Default implementations
-        self.watermark_picker = AvgRgbWatermarkPicker(
+        self.luma_analysis = luma_analysis
+        watermark_picker_class = LumaWatermarkPicker if luma_analysis else AvgRgbWatermarkPicker
+        self.watermark_picker = watermark_picker_class(
             max_width_proportion=self.max_width_proportion,
             max_height_proportion=self.max_height_proportion,
-            cutoff_color=self.cutoff_color
+            cutoff_color=self.cutoff_color,
+            statistics_backend=self.statistics_backend
         )
-        self.corner_picker = RgbStdevCornerPicker(
+        corner_picker_class = LumaStdevCornerPicker if luma_analysis else RgbStdevCornerPicker
+        self.corner_picker = corner_picker or corner_picker_class(
             corners=self.corners,
             max_width_proportion=self.max_width_proportion,
-            max_height_proportion=self.max_height_proportion
+            max_height_proportion=self.max_height_proportion,
+            statistics_backend=self.statistics_backend
         )
 
     @staticmethod
@@ -88,23 +272,343 @@ class DirectoryProcessor:
             raise NotSupportedFileFormatException(f"Supported file formats for watermarks are: "
                                                   + f"{', '.join(DirectoryProcessor.SUPPORTED_WATERMARK_FILE_FORMATS)}")
 
-    def process_directory(self, dir_path: str, output_dir: Optional[str] = None) -> None:
+    def process_directory(self, dir_path: str, output_dir: Optional[str] = None, jobs: int = 1,
+                          recursive: bool = False, incremental: bool = False,
+                          use_content_hash: bool = False, threads: int = 0, io_threads: int = 2,
+                          queue_size: int = 4, cache_analysis: bool = False, shard: Optional[Shard] = None) -> None:
         """
         Adds watermarks to photos in dir_path and saves them in the output_dir.
         By default, files will be saved in a subdirectory of dir_path
 
         :param dir_path: path to the directory containing photos to process
         :param output_dir:
+        :param jobs: number of worker processes, photos are processed in the current process if 1
+        :param recursive: also process photos in nested folders, mirroring the folder tree in output_dir.
+            Only files with supported extensions are considered, other files are ignored without a message
+        :param incremental: skip photos already processed with the same parameters,
+            see :class:`core.manifest.ProcessingManifest`
+        :param use_content_hash: in incremental mode detect changed photos by content instead of modification time
+        :param threads: number of threads watermarking photos in a pipeline that overlaps reading, processing
+            and writing files, see :mod:`core.pipeline`. Pipeline is not used if 0
+        :param io_threads: number of threads reading and number of threads writing files in the pipeline
+        :param queue_size: maximum number of files waiting in front of each stage of the pipeline
+        :param cache_analysis: reuse corners and watermark types picked for the same photos in previous runs,
+            see :class:`core.analysis_cache.AnalysisCache`. The cache is stored in the output directory
+        :param shard: only process photos of this shard, see :mod:`core.sharding`. A summary of the run
+            is saved in the output directory
+        :raises ValueError: if jobs is not positive or is combined with threads
         """
 
-        # Loading watermarks
-        if self.dark_watermark is None:
-            self.dark_watermark = Image.open(self.dark_watermark_filepath)
-        if self.light_watermark is None:
-            self.light_watermark = Image.open(self.light_watermark_filepath)
+        if jobs < 1:
+            raise ValueError("jobs must be a positive integer")
+        if jobs > 1 and threads > 0:
+            raise ValueError("Worker processes and pipeline threads can not be combined")
+
+        self.profile = RunProfile()
+        start = time.perf_counter()
 
         dir_path = os.path.abspath(dir_path)
-        watermarked_dir = os.path.join(dir_path, 'with-watermark') if output_dir is None else output_dir
+        watermarked_dir = self._prepare_output_directory(dir_path, output_dir)
+        files = self._list_files(dir_path, watermarked_dir, recursive)
+        if shard is not None:
+            files = self._shard_files(files, dir_path, shard)
+
+        manifest = None
+        if incremental:
+            manifest = ProcessingManifest(watermarked_dir, self._processing_parameters(), use_content_hash,
+                                          ProcessingManifest.FILENAME if shard is None else shard.manifest_filename)
+            files = (filepath for filepath in files if not self._is_up_to_date(manifest, filepath, dir_path))
+
+        tasks = ((filepath,
+                  os.path.join(watermarked_dir, os.path.relpath(os.path.dirname(filepath), dir_path)),
+                  self.cprofile_sample > 0 and index % self.cprofile_sample == 0)
+                 for index, filepath in enumerate(files))
+
+        analysis_cache = self._open_analysis_cache(watermarked_dir) if cache_analysis else None
+        if analysis_cache is not None:
+            self.analysis_cache = analysis_cache
+        counters = self._cache_counters()
+
+        try:
+            for result in self._process_tasks(tasks, jobs, threads, io_threads, queue_size):
+                self._record_result(result, manifest, dir_path)
+        finally:
+            self._add_counters(self._cache_counters_since(counters))
+            if manifest is not None:
+                manifest.close()
+            if analysis_cache is not None:
+                analysis_cache.close()
+                self.analysis_cache = None
+
+        self.profile.wall_time = time.perf_counter() - start
+
+        print(f"Saved all watermarked photos to {watermarked_dir}")
+        if shard is not None:
+            summary_path = os.path.join(watermarked_dir, shard.summary_filename)
+            write_shard_summary(summary_path, shard, dir_path, self.profile)
+            print(f"Saved summary of shard {shard} to {summary_path}")
+
+    def watch_directory(self, dir_path: str, output_dir: Optional[str] = None, recursive: bool = False,
+                        interval: float = 0.5, stable_polls: int = 1, use_content_hash: bool = False,
+                        stop: Optional[threading.Event] = None, cache_analysis: bool = False) -> None:
+        """
+        Keeps watching a directory and adds watermarks to photos as soon as they are fully written.
+        Photos are detected by polling, see :class:`core.watching.FolderWatcher`,
+        a photo is processed about (stable_polls + 1) * interval seconds after it was written.
+        Watermarks stay loaded while watching. Processed photos are recorded in the manifest,
+        so photos processed before a restart are skipped, the same as in incremental mode
+
+        :param dir_path: path to the directory to watch
+        :param output_dir: directory where processed photos are saved, a subdirectory of dir_path by default
+        :param recursive: also watch nested folders, mirroring the folder tree in output_dir
+        :param interval: seconds between polls
+        :param stable_polls: number of polls a photo must stay unchanged for before it is processed
+        :param use_content_hash: detect changed photos by content instead of modification time
+        :param stop: event stopping the watch when set, watches until interrupted if None
+        :param cache_analysis: reuse corners and watermark types picked for the same photos before,
+            see :meth:`DirectoryProcessor.process_directory`
+        :raises ValueError: if interval is not positive or stable_polls is negative
+        """
+
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+
+        self.profile = RunProfile()
+        start = time.perf_counter()
+        stop = threading.Event() if stop is None else stop
+
+        dir_path = os.path.abspath(dir_path)
+        watermarked_dir = self._prepare_output_directory(dir_path, output_dir)
+        watcher = FolderWatcher(lambda: scan_files(dir_path, recursive,
+                                                   extensions=DirectoryProcessor.SUPPORTED_PHOTO_FILE_FORMATS,
+                                                   excluded_directories=[watermarked_dir]),
+                                stable_polls)
+        manifest = ProcessingManifest(watermarked_dir, self._processing_parameters(), use_content_hash)
+        if cache_analysis:
+            self.analysis_cache = self._open_analysis_cache(watermarked_dir)
+        counters = self._cache_counters()
+
+        print(f"Watching {dir_path} for new photos")
+        self.load_watermarks()
+        try:
+            while not stop.is_set():
+                for filepath in watcher.poll():
+                    if self._is_up_to_date(manifest, filepath, dir_path):
+                        continue
+                    output_directory = os.path.join(watermarked_dir,
+                                                    os.path.relpath(os.path.dirname(filepath), dir_path))
+                    self._record_result(self._process_file_reporting_errors(filepath, output_directory),
+                                        manifest, dir_path)
+                stop.wait(interval)
+        finally:
+            self.close_watermarks()
+            manifest.close()
+            self.profile.wall_time = time.perf_counter() - start
+            self._add_counters(self._cache_counters_since(counters))
+            if cache_analysis:
+                self.analysis_cache.close()
+                self.analysis_cache = None
+
+        print(f"Stopped watching {dir_path}")
+
+    def plan_directory(self, dir_path: str, plan_path: str, output_dir: Optional[str] = None,
+                       recursive: bool = False, cache_analysis: bool = False) -> None:
+        """
+        Picks the corner and watermark type of photos in dir_path without watermarking them,
+        and writes the decisions to a plan, see :mod:`core.plan`. Photos are not encoded nor written,
+        with analysis_scale below 1 they are only decoded at reduced resolution
+
+        :param dir_path: path to the directory containing photos to plan
+        :param plan_path: path to the JSON lines plan, overwritten if it exists
+        :param output_dir: directory where :meth:`DirectoryProcessor.apply_plan` will save the photos,
+            a subdirectory of dir_path by default
+        :param recursive: also plan photos in nested folders, see :meth:`DirectoryProcessor.process_directory`
+        :param cache_analysis: reuse and store decisions in the analysis cache of the output directory
+        """
+
+        self.profile = RunProfile()
+        start = time.perf_counter()
+
+        dir_path = os.path.abspath(dir_path)
+        watermarked_dir = self._prepare_output_directory(dir_path, output_dir)
+        files = self._list_files(dir_path, watermarked_dir, recursive)
+
+        analysis_cache = self._open_analysis_cache(watermarked_dir) if cache_analysis else None
+        if analysis_cache is not None:
+            self.analysis_cache = analysis_cache
+
+        entries = (self._plan_file_reporting_errors(
+            filepath,
+            os.path.normpath(os.path.join(watermarked_dir, os.path.relpath(os.path.dirname(filepath), dir_path))))
+            for filepath in files)
+
+        # Only sizes of the watermarks are needed, they are not decoded
+        self._open_watermarks()
+        try:
+            with open(plan_path, 'w', encoding='utf-8') as plan:
+                count = write_plan_entries(plan, (entry for entry in entries if entry is not None))
+        finally:
+            self._close_watermarks()
+            if analysis_cache is not None:
+                analysis_cache.close()
+                self.analysis_cache = None
+
+        self.profile.wall_time = time.perf_counter() - start
+        print(f"Saved plan of {count} photos to {plan_path}")
+
+    def apply_plan(self, plan_path: str, jobs: int = 1, threads: int = 0, io_threads: int = 2,
+                   queue_size: int = 4) -> None:
+        """
+        Adds watermarks to photos as decided in a plan written by :meth:`DirectoryProcessor.plan_directory`,
+        possibly filtered or edited. Photos are not analysed, the plan's corner and watermark type are used
+        with the processor's watermarks, opacity and encoder settings. Photos are saved to the plan's output paths,
+        so the processor must use the output format the plan was written for
+
+        :param plan_path: path to the JSON lines plan
+        :param jobs: number of worker processes, see :meth:`DirectoryProcessor.process_directory`
+        :param threads: number of threads of the pipeline, see :meth:`DirectoryProcessor.process_directory`
+        :param io_threads: number of threads reading and number of threads writing files in the pipeline
+        :param queue_size: maximum number of files waiting in front of each stage of the pipeline
+        :raises PlanException: if the plan is not valid or was written for another output format,
+            nothing is processed then
+        :raises ValueError: if jobs is not positive or is combined with threads
+        """
+
+        if jobs < 1:
+            raise ValueError("jobs must be a positive integer")
+        if jobs > 1 and threads > 0:
+            raise ValueError("Worker processes and pipeline threads can not be combined")
+
+        entries = read_plan(plan_path)
+        for entry in entries:
+            self._check_planned_output(entry)
+        self.profile = RunProfile()
+        start = time.perf_counter()
+
+        self._plan = {os.path.abspath(entry.source): entry._replace(output=os.path.abspath(entry.output))
+                      for entry in entries}
+        tasks = ((os.path.abspath(entry.source),
+                  os.path.dirname(os.path.abspath(entry.output)),
+                  self.cprofile_sample > 0 and index % self.cprofile_sample == 0)
+                 for index, entry in enumerate(entries))
+        counters = self._cache_counters()
+        try:
+            for result in self._process_tasks(tasks, jobs, threads, io_threads, queue_size):
+                self._record_result(result, None, '')
+        finally:
+            self._add_counters(self._cache_counters_since(counters))
+            self._plan = {}
+
+        self.profile.wall_time = time.perf_counter() - start
+        print(f"Applied plan {plan_path}")
+
+    def _plan_file_reporting_errors(self, filepath: str, output_directory: str) -> Optional[PlanEntry]:
+        """
+        Plans a file, printing a message instead of raising if it can not be processed
+
+        :param filepath: path to the photo to plan
+        :param output_directory: directory where the processed photo will be saved
+        :return: decision for the photo, None if it can not be processed
+        """
+
+        timer = StageTimer()
+        try:
+            entry = self._plan_file(filepath, output_directory, timer)
+        except (NotSupportedFileFormatException, OSError, Image.DecompressionBombError) as err:
+            self._report_error(filepath, err)
+            return None
+
+        self.profile.add_file(filepath, timer.durations)
+        print(f"Planned {os.path.basename(filepath)}")
+        return entry
+
+    def _plan_file(self, filepath: str, output_directory: str, timer: StageTimer) -> PlanEntry:
+        """
+        Picks the corner and watermark type of a photo
+
+        Requires self.dark_watermark and self.light_watermark to be open.
+
+        :param filepath: path to the photo to plan
+        :param output_directory: directory where the processed photo will be saved
+        :param timer: timer measuring stages of processing
+        :return: decision for the photo
+        :raises NotSupportedFileFormatException: if the file format is not supported
+        :raises OSError: if the photo could not be decoded
+        """
+
+        output_filepath = self._output_filepath(filepath, output_directory)
+        with Image.open(filepath) as image:
+            self._check_image_format(image)
+            # The photo is not decoded yet, with analysis_scale below 1 it is decoded at reduced resolution
+            image_size = image.size
+            with timer.stage('analysis'):
+                record = self._pick_corner_and_watermark(image, filepath)
+
+        watermark = self.dark_watermark if record.watermark_type == WatermarkType.DARK else self.light_watermark
+        size = watermark_size(image_size, watermark.size, self.max_width_proportion, self.max_height_proportion)
+        return PlanEntry(filepath, output_filepath, record.corner, record.watermark_type, image_size, size,
+                         record.statistics, self.output_format)
+
+    def _check_planned_output(self, entry: PlanEntry) -> None:
+        """
+        Checks that a planned photo can be saved to its output path in the processor's output format
+
+        :param entry: decision of a plan
+        :raises PlanException: if the plan was written for another output format or the output's extension
+            does not match the output format
+        """
+
+        if entry.output_format is not None and entry.output_format != self.output_format:
+            raise PlanException(f"{entry.source} was planned for {entry.output_format} output, "
+                                f"not {self.output_format}")
+
+        extensions = ('.jpg', '.jpeg') if self.output_format == 'jpeg' else (OUTPUT_FORMATS[self.output_format][1],)
+        if os.path.splitext(entry.output)[1].lower() not in extensions:
+            raise PlanException(f"{entry.output} can not be saved as {self.output_format}")
+
+    def _shard_files(self, files: Iterable[str], dir_path: str, shard: Shard) -> Iterator[str]:
+        """
+        Filters files of a shard, counting them in the run profile
+
+        :param files: paths to the files in dir_path
+        :param dir_path: processed directory
+        :param shard: shard to keep
+        :return: iterator over paths to the files of the shard
+        """
+
+        self.profile.counters['shard_files'] = 0
+        for filepath in files:
+            if shard.contains(os.path.relpath(filepath, dir_path)):
+                self.profile.counters['shard_files'] += 1
+                yield filepath
+
+    @staticmethod
+    def _list_files(dir_path: str, watermarked_dir: str, recursive: bool) -> Iterator[str]:
+        """
+        :param dir_path: absolute path to the processed directory
+        :param watermarked_dir: output directory, not listed
+        :param recursive: also list photos in nested folders
+        :return: iterator over paths to the files to process
+        """
+
+        if recursive:
+            return scan_files(dir_path, recursive=True,
+                              extensions=DirectoryProcessor.SUPPORTED_PHOTO_FILE_FORMATS,
+                              excluded_directories=[watermarked_dir])
+        return scan_files(dir_path)
+
+    @staticmethod
+    def _prepare_output_directory(dir_path: str, output_dir: Optional[str]) -> str:
+        """
+        Creates the directory for watermarked photos if needed
+
+        :param dir_path: absolute path to the processed directory
+        :param output_dir: requested output directory, a subdirectory of dir_path if None
+        :return: path to the output directory
+        """
+
+        watermarked_dir = os.path.join(dir_path, DirectoryProcessor.OUTPUT_SUBDIRECTORY) \
+            if output_dir is None else output_dir
         try:
             os.mkdir(watermarked_dir)
             print(f"Creating {watermarked_dir}")
@@ -112,26 +616,370 @@ class DirectoryProcessor:
             print(f"{watermarked_dir} already exists")
 
         print(f"Watermarked photos will be saved to {watermarked_dir}")
+        return watermarked_dir
 
-        directory_contents = [os.path.join(dir_path, file) for file in os.listdir(dir_path)]
-        files = [file for file in directory_contents if os.path.isfile(file)]
-        for filepath in files:
+    def _record_result(self, result: 'FileResult', manifest: Optional[ProcessingManifest], dir_path: str) -> None:
+        """
+        Adds a processed file to the run profile and the manifest, files that could not be processed are counted
+
+        :param result: outcome of processing the file
+        :param manifest: manifest of the output directory, None if not used
+        :param dir_path: processed directory
+        """
+
+        if result.counters is not None:
+            self._add_counters(result.counters)
+        if result.watermarked_filepath is None:
+            self.profile.counters['failed_files'] = self.profile.counters.get('failed_files', 0) + 1
+            return
+
+        self.profile.add_file(result.filepath, result.timings, result.input_size, result.output_size)
+        if result.cprofile_stats is not None:
+            self.profile.add_cprofile_stats(result.cprofile_stats)
+        if manifest is not None:
+            manifest.record(os.path.relpath(result.filepath, dir_path), result.filepath, result.watermarked_filepath)
+
+    def _cache_counters(self) -> dict[str, int]:
+        """
+        :return: hits and misses of the watermark cache and of the analysis cache, if open, so far
+        """
+
+        counters = {'watermark_cache_hits': self.watermark_cache.hits,
+                    'watermark_cache_misses': self.watermark_cache.misses}
+        if self.analysis_cache is not None:
+            counters['analysis_cache_hits'] = self.analysis_cache.hits
+            counters['analysis_cache_misses'] = self.analysis_cache.misses
+        return counters
+
+    def _cache_counters_since(self, before: dict[str, int]) -> dict[str, int]:
+        """
+        :param before: counters returned by :meth:`DirectoryProcessor._cache_counters` earlier
+        :return: hits and misses of the caches since then
+        """
+
+        return {name: value - before.get(name, 0) for name, value in self._cache_counters().items()}
+
+    def _add_counters(self, counters: dict[str, int]) -> None:
+        """
+        :param counters: counts added to the counters of the run profile
+        """
+
+        for name, value in counters.items():
+            self.profile.counters[name] = self.profile.counters.get(name, 0) + value
+
+    @staticmethod
+    def _is_up_to_date(manifest: ProcessingManifest, filepath: str, dir_path: str) -> bool:
+        """
+        Checks the manifest, printing a message if the photo is skipped
+
+        :param manifest: manifest of the output directory
+        :param filepath: path to the photo
+        :param dir_path: processed directory
+        :return: True if the photo does not need to be processed again
+        """
+
+        relative_path = os.path.relpath(filepath, dir_path)
+        if manifest.is_up_to_date(relative_path, filepath):
+            print(f"{relative_path} is up to date, skipping")
+            return True
+        return False
+
+    def _processing_parameters(self) -> dict:
+        """
+        Parameters that affect the watermarked photos, used to detect outdated outputs
+
+        :return: JSON serializable parameters
+        """
+
+        watermarks = {}
+        for name, filepath in [('dark', self.dark_watermark_filepath), ('light', self.light_watermark_filepath)]:
+            stat = os.stat(filepath)
+            watermarks[name] = {'path': os.path.abspath(filepath), 'size': stat.st_size,
+                                'mtime_ns': stat.st_mtime_ns}
+
+        return {
+            'max_width_proportion': self.max_width_proportion,
+            'max_height_proportion': self.max_height_proportion,
+            'opacity': self.opacity,
+            'cutoff_color': self.cutoff_color,
+            'corners': [corner.value for corner in self.corners],
+            'corner_picker': type(self.corner_picker).__name__,
+            'watermark_picker': type(self.watermark_picker).__name__,
+            'resample': self.resample.name,
+            'use_watermark_alpha': self.use_watermark_alpha,
+            'analysis_scale': self.analysis_scale,
+            'quality': self.quality,
+            'subsampling': self.subsampling,
+            'progressive': self.progressive,
+            'optimize': self.optimize,
+            'output_format': self.output_format,
+            'watermarks': watermarks,
+        }
+
+    def _analysis_parameters(self) -> dict:
+        """
+        Parameters that affect the picked corner and watermark type, used to key the analysis cache
+
+        :return: JSON serializable parameters
+        """
+
+        return {
+            'max_width_proportion': self.max_width_proportion,
+            'max_height_proportion': self.max_height_proportion,
+            'cutoff_color': self.cutoff_color,
+            'corners': [corner.value for corner in self.corners],
+            'corner_picker': type(self.corner_picker).__name__,
+            'watermark_picker': type(self.watermark_picker).__name__,
+            'analysis_scale': self.analysis_scale,
+        }
+
+    def _open_analysis_cache(self, watermarked_dir: str) -> AnalysisCache:
+        """
+        :param watermarked_dir: output directory of the run
+        :return: analysis cache stored in the output directory, keyed by current analysis parameters
+        """
+
+        return AnalysisCache(os.path.join(watermarked_dir, AnalysisCache.FILENAME), self._analysis_parameters())
+
+    def _process_tasks(self, tasks: Iterable[tuple[str, str, bool]], jobs: int, threads: int, io_threads: int,
+                       queue_size: int) -> Iterator['FileResult']:
+        """
+        Processes files in the mode selected by jobs and threads, see :meth:`DirectoryProcessor.process_directory`
+
+        :param tasks: paths to the photo to process, the directory where it will be saved
+            and whether to capture cProfile statistics
+        :return: iterator over outcomes of processing the files
+        """
+
+        if threads > 0:
+            return self._process_files_in_pipeline(tasks, threads, io_threads, queue_size)
+        if jobs == 1:
+            return self._process_files_sequentially(tasks)
+        return self._process_files_in_pool(tasks, jobs)
+
+    def _process_files_sequentially(self, tasks: Iterable[tuple[str, str, bool]]) -> Iterator['FileResult']:
+        """
+        Processes files in the current process
+
+        :param tasks: paths to the photo to process, the directory where it will be saved
+            and whether to capture cProfile statistics
+        :return: iterator over outcomes of processing the files
+        """
+
+        self._open_watermarks()
+        try:
+            for filepath, output_directory, capture_cprofile in tasks:
+                yield self._process_file_reporting_errors(filepath, output_directory, capture_cprofile)
+        finally:
+            self._close_watermarks()
+
+    def _process_files_in_pool(self, tasks: Iterable[tuple[str, str, bool]], jobs: int) -> Iterator['FileResult']:
+        """
+        Processes files in worker processes, each worker loads the watermarks once.
+        Messages are printed in the order of files, so the output does not depend on the number of workers
+
+        :param tasks: paths to the photo to process, the directory where it will be saved
+            and whether to capture cProfile statistics
+        :param jobs: number of worker processes
+        :return: iterator over outcomes of processing the files
+        """
+
+        budget = MemoryBudget(self.max_memory) if self.max_memory is not None else None
+
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(self,)) as executor:
+            # Only a few files per worker are submitted ahead, so listing and processing overlap
+            pending: deque[tuple[Future, int]] = deque()
+            for task in tasks:
+                memory = estimate_footprint(task[0]) if budget is not None else 0
+                # Waits for the oldest files until the next one fits, the budget is empty once nothing is pending
+                while budget is not None and not budget.try_acquire(memory):
+                    yield self._collect_pending(pending, budget)
+
+                pending.append((executor.submit(_process_file_in_worker, *task), memory))
+                if len(pending) >= 2 * jobs:
+                    yield self._collect_pending(pending, budget)
+
+            while pending:
+                yield self._collect_pending(pending, budget)
+
+    def _process_files_in_pipeline(self, tasks: Iterable[tuple[str, str, bool]], threads: int, io_threads: int,
+                                   queue_size: int) -> Iterator['FileResult']:
+        """
+        Processes files in a pipeline of threads reading files, watermarking photos and writing results.
+        Messages are printed in the order of files, as in sequential processing
+
+        :param tasks: paths to the photo to process, the directory where it will be saved
+            and whether to capture cProfile statistics
+        :param threads: number of threads watermarking photos
+        :param io_threads: number of threads reading and number of threads writing files
+        :param queue_size: maximum number of files waiting in front of each stage
+        :return: iterator over outcomes of processing the files
+        """
+
+        # Watermarks are shared between threads, they must be loaded before
+        self.load_watermarks()
+        budget = MemoryBudget(self.max_memory) if self.max_memory is not None else None
+
+        stages = [
+            Stage('read', self._read_pipeline_task, io_threads),
+            Stage('render', self._render_pipeline_task, threads),
+            Stage('write', self._write_pipeline_task, io_threads),
+        ]
+        results = run_pipeline((_PipelineTask(*task, budget=budget) for task in tasks), stages, queue_size)
+        try:
+            for task in results:
+                if isinstance(task, StageFailure):
+                    self._report_error(task.item.filepath, task.exception)
+                    yield FileResult(task.item.filepath, None, task.item.timer.durations, None)
+                else:
+                    print(f"Added watermark to {os.path.basename(task.filepath)}")
+                    yield FileResult(task.filepath, task.watermarked_filepath, task.timer.durations,
+                                     task.cprofile_stats, len(task.data), len(task.encoded))
+        finally:
+            # Files abandoned in the pipeline never return their memory, waiting threads must not block forever
+            if budget is not None:
+                budget.close()
+            results.close()
+            self._close_watermarks()
+
+    def _read_pipeline_task(self, task: '_PipelineTask') -> '_PipelineTask':
+        os.makedirs(task.output_directory, exist_ok=True)
+        planned = self._plan.get(task.filepath)
+        task.watermarked_filepath = planned.output if planned is not None \
+            else self._output_filepath(task.filepath, task.output_directory)
+        with task.timer.stage('read'):
+            with open(task.filepath, 'rb') as file:
+                task.data = file.read()
+
+        if task.budget is not None:
+            task.memory = estimate_footprint(io.BytesIO(task.data))
+            task.low_memory = task.memory > task.budget.limit
+            task.budget.acquire(task.memory)
+        return task
+
+    def _render_pipeline_task(self, task: '_PipelineTask') -> '_PipelineTask':
+        profiler = cProfile.Profile() if task.capture_cprofile else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            task.encoded = self._render(task.data, task.timer, task.low_memory, self._plan.get(task.filepath)).data
+        except BaseException:
+            task.release_memory()
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.create_stats()
+                task.cprofile_stats = profiler.stats
+        return task
+
+    @staticmethod
+    def _write_pipeline_task(task: '_PipelineTask') -> '_PipelineTask':
+        try:
+            with task.timer.stage('write'):
+                with open(task.watermarked_filepath, 'wb') as file:
+                    file.write(task.encoded)
+        finally:
+            task.release_memory()
+        return task
+
+    @staticmethod
+    def _report_error(filepath: str, error: BaseException) -> None:
+        """
+        Prints a message about a file that could not be processed, the same as in sequential processing
+
+        :param filepath: path to the photo
+        :param error: exception raised while processing the photo
+        :raises BaseException: the error if it is not expected while processing a photo
+        """
+
+        if isinstance(error, (NotSupportedFileFormatException, Image.DecompressionBombError)):
+            print(f"{error}, skipping {filepath}")
+        elif isinstance(error, OSError):
+            print(error)
+        else:
+            raise error
+
+    def _collect_pending(self, pending: deque[tuple[Future, int]], budget: Optional[MemoryBudget]) -> 'FileResult':
+        """
+        Waits for the oldest submitted file and returns its memory to the budget
+
+        :param pending: submitted files and their estimated memory
+        :param budget: memory budget of the run, None if not limited
+        :return: outcome of processing the file
+        """
+
+        future, memory = pending.popleft()
+        try:
+            return self._collect_result(future)
+        finally:
+            if budget is not None:
+                budget.release(memory)
+
+    @staticmethod
+    def _collect_result(future: Future) -> 'FileResult':
+        """
+        Waits for a file processed in a worker and prints its messages
+
+        :param future: result of :func:`_process_file_in_worker`
+        :return: outcome of processing the file
+        """
+
+        output, result = future.result()
+        print(output, end='')
+        return result
+
+    def _process_file_reporting_errors(self, filepath: str, output_directory: str,
+                                       capture_cprofile: bool = False) -> 'FileResult':
+        """
+        Processes a file, printing a message instead of raising if it can not be processed
+
+        :param filepath: path to the photo to process
+        :param output_directory: directory where the processed photo will be saved
+        :param capture_cprofile: collect cProfile statistics while processing the file
+        :return: outcome of processing the file
+        """
+
+        timer = StageTimer()
+        profiler = cProfile.Profile() if capture_cprofile else None
+        watermarked_filepath = None
+
+        try:
+            os.makedirs(output_directory, exist_ok=True)
+            if profiler is not None:
+                profiler.enable()
             try:
-                self._process_file(filepath, watermarked_dir)
-            except NotSupportedFileFormatException as exc:
-                print(f"{exc}, skipping {filepath}")
-            except OSError as err:
-                print(err)
+                watermarked_filepath = self._process_file(filepath, output_directory, timer=timer)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        except (NotSupportedFileFormatException, OSError, Image.DecompressionBombError) as err:
+            self._report_error(filepath, err)
 
-        print(f"Saved all watermarked photos to {watermarked_dir}")
+        cprofile_stats = None
+        if profiler is not None:
+            profiler.create_stats()
+            cprofile_stats = profiler.stats
+
+        if watermarked_filepath is None:
+            return FileResult(filepath, None, timer.durations, cprofile_stats)
+        return FileResult(filepath, watermarked_filepath, timer.durations, cprofile_stats,
+                          input_size=os.path.getsize(filepath), output_size=os.path.getsize(watermarked_filepath))
+
+    def __getstate__(self) -> dict:
+        """
+        Open watermarks, prepared watermarks and the run profile are not sent to worker processes
+        """
 
-        # Closing watermarks
-        self.dark_watermark.close()
-        self.dark_watermark = None
-        self.light_watermark.close()
-        self.light_watermark = None
+        state = self.__dict__.copy()
+        state['profile'] = RunProfile()
+        state['dark_watermark'] = None
+        state['light_watermark'] = None
+        state['watermark_cache'] = PreparedWatermarkCache(self.watermark_cache.max_size)
+        return state
 
-    def _process_file(self, filepath: str, output_directory: str, suffix: str = "_watermark") -> None:
+    def _process_file(self, filepath: str, output_directory: str, suffix: str = "_watermark",
+                      timer: Optional[StageTimer] = None) -> str:
         """
         Add watermark to a photo and save it in the specified directory.
         Does not modify the original file.
@@ -142,38 +990,213 @@ class DirectoryProcessor:
         :param filepath: path to the photo to process
         :param output_directory: directory where the processed photo will be saved
         :param suffix: suffix added to the processed photo's filename
+        :param timer: timer measuring stages of processing, stages are not measured if None
+        :return: path to the watermarked photo
         :raises NotSupportedFileFormatException: if the file format is not supported
         :raises OSError: if the file could not be written
         """
 
-        assert self.dark_watermark is not None
-        assert self.light_watermark is not None
+        planned = self._plan.get(filepath)
+        if planned is not None:
+            watermarked_filepath = planned.output
+        else:
+            watermarked_filepath = self._output_filepath(filepath, output_directory, suffix)
+        timer = StageTimer() if timer is None else timer
 
-        base_filename = os.path.basename(filepath)
-        filename, extension = os.path.splitext(base_filename)
+        if self._needs_low_memory(filepath):
+            # Decoding from the file avoids keeping its contents in memory next to the decoded photo
+            encoded = self._render(filepath, timer, low_memory=True, planned=planned).data
+        else:
+            with timer.stage('read'):
+                with open(filepath, 'rb') as file:
+                    data = file.read()
+            encoded = self._render(data, timer, planned=planned).data
+
+        with timer.stage('write'):
+            with open(watermarked_filepath, 'wb') as file:
+                file.write(encoded)
+        print(f"Added watermark to {os.path.basename(filepath)}")
+
+        return watermarked_filepath
+
+    def _output_filepath(self, filepath: str, output_directory: str, suffix: str = "_watermark") -> str:
+        """
+        Path where the watermarked photo will be saved.
+        JPEG photos saved as JPEG keep their extension, other photos get the extension of the output format
 
-        if extension not in DirectoryProcessor.SUPPORTED_PHOTO_FILE_FORMATS:
+        :param filepath: path to the photo to process
+        :param output_directory: directory where the processed photo will be saved
+        :param suffix: suffix added to the processed photo's filename
+        :return: path to the watermarked photo
+        :raises NotSupportedFileFormatException: if the file format is not supported
+        """
+
+        filename, extension = os.path.splitext(os.path.basename(filepath))
+
+        if extension.lower() not in DirectoryProcessor.SUPPORTED_PHOTO_FILE_FORMATS:
             raise NotSupportedFileFormatException(
                 f"Supported file formats are: {', '.join(DirectoryProcessor.SUPPORTED_PHOTO_FILE_FORMATS)}"
             )
 
-        image = Image.open(filepath)
-        corner = self.corner_picker.pick_best_corner(image)
-        watermark_type = self.watermark_picker.pick_best_watermark(image, corner)
-        watermark = self.dark_watermark if watermark_type == WatermarkType.DARK else self.light_watermark
+        if self.output_format != 'jpeg' or extension.lower() not in ('.jpg', '.jpeg'):
+            extension = OUTPUT_FORMATS[self.output_format][1]
+        return os.path.join(output_directory, f"{filename}{suffix}{extension}")
+
+    def _needs_low_memory(self, source: Union[str, BinaryIO]) -> bool:
+        """
+        Checks whether a photo is too large to be processed within max_memory the usual way
+
+        :param source: path to the photo or a binary file-like object with its contents
+        :return: True if the photo should be processed with the low-memory path
+        """
+
+        return self.max_memory is not None and estimate_footprint(source) > self.max_memory
+
+    def _render(self, data: Union[bytes, str], timer: StageTimer, low_memory: bool = False,
+                planned: Optional[PlanEntry] = None) -> 'WatermarkedImage':
+        """
+        Decodes a photo, adds watermark and encodes the result.
+        Safe to call from multiple threads
+
+        Requires self.dark_watermark and self.light_watermark to be open.
+
+        :param data: contents of the photo's file or path to it
+        :param timer: timer measuring stages of processing
+        :param low_memory: keep at most one full size copy of the photo in memory at any time
+        :param planned: decision of a plan, the photo is not analysed if set
+        :return: watermarked photo
+        :raises NotSupportedFileFormatException: if the photo's format detected from its header is not supported
+        :raises OSError: if the photo could not be decoded
+        """
+
+        with timer.stage('decode'):
+            image = Image.open(io.BytesIO(data) if isinstance(data, bytes) else data)
+            try:
+                self._check_image_format(image)
+            except NotSupportedFileFormatException:
+                image.close()
+                raise
+            image.load()
+
+        try:
+            # The decoded photo is not used afterwards, so it is watermarked without a copy
+            return self._watermark_image(image, data, timer, in_place=True, low_memory=low_memory, planned=planned)
+        finally:
+            image.close()
+
+    @staticmethod
+    def _check_image_format(image: Image.Image) -> None:
+        """
+        :param image: opened photo
+        :raises NotSupportedFileFormatException: if the photo's format detected from its header is not supported
+        """
+
+        if image.format not in DirectoryProcessor.SUPPORTED_PHOTO_IMAGE_FORMATS:
+            raise NotSupportedFileFormatException(
+                f"{image.format} images are not supported, supported formats are: "
+                f"{', '.join(DirectoryProcessor.SUPPORTED_PHOTO_IMAGE_FORMATS)}"
+            )
+
+    def _watermark_image(self, image: Image.Image, data: Optional[Union[bytes, str]], timer: StageTimer,
+                         in_place: bool, low_memory: bool = False,
+                         planned: Optional[PlanEntry] = None) -> 'WatermarkedImage':
+        """
+        Picks the corner and the watermark, adds it to a decoded photo and encodes the result.
+        Safe to call from multiple threads
+
+        Requires self.dark_watermark and self.light_watermark to be open.
+
+        :param image: loaded photo
+        :param data: contents of the photo's file or path to it, None if the photo was not read from a file
+        :param timer: timer measuring stages of processing
+        :param in_place: whether the watermark can be pasted into the passed image instead of a copy
+        :param low_memory: close the passed image as soon as it was converted, if it is not in the output mode
+        :param planned: decision of a plan, the photo is not analysed if set
+        :return: watermarked photo
+        """
+
+        assert self.dark_watermark is not None
+        assert self.light_watermark is not None
+
+        keep_alpha = self.output_format in ALPHA_OUTPUT_FORMATS
+        # Options depend on the original, eg. its JPEG quantization tables
+        options = save_options(image, self.output_format, self.quality, self.subsampling,
+                               self.progressive, self.optimize)
+
+        with timer.stage('decode'):
+            photo = normalize_mode(image, keep_alpha)
+            if photo is not image:
+                # The converted copy is not shared with the caller
+                in_place = True
+                if low_memory:
+                    image.close()
+
+        if planned is not None:
+            corner, watermark_type = planned.corner, planned.watermark_type
+        else:
+            with timer.stage('analysis'):
+                corner, watermark_type, _ = self._pick_corner_and_watermark(photo, data)
+
+        with timer.stage('composite'):
+            if watermark_type == WatermarkType.DARK:
+                watermark, watermark_filepath = self.dark_watermark, self.dark_watermark_filepath
+            else:
+                watermark, watermark_filepath = self.light_watermark, self.light_watermark_filepath
+
+            size = watermark_size(photo.size, watermark.size, self.max_width_proportion, self.max_height_proportion)
+            prepared_watermark = self.watermark_cache.get(watermark_filepath, watermark, size, self.opacity,
+                                                          self.resample, self.use_watermark_alpha)
+            watermarked_image = paste_watermark(photo, corner, prepared_watermark, in_place, keep_alpha)
+
+        with timer.stage('encode'):
+            encoded = io.BytesIO()
+            watermarked_image.save(encoded, **options)
+
+        if watermarked_image is not image:
+            watermarked_image.close()
+
+        return WatermarkedImage(corner, watermark_type, encoded.getvalue())
+
+    def _pick_corner_and_watermark(self, image: Image.Image, data: Optional[Union[bytes, str]]) -> AnalysisRecord:
+        """
+        Picks the corner and the watermark type of a photo, reusing the decision stored in the analysis cache
+
+        :param image: full resolution photo, see :meth:`DirectoryProcessor._analyze_image`
+        :param data: contents of the photo's file or path to it, photos not read from a file are not cached
+        :return: decision and statistics of the analysed corners
+        """
+
+        cache = self.analysis_cache
+        content_hash = None
+        if cache is not None and data is not None:
+            content_hash = content_sha256(data) if isinstance(data, bytes) else file_sha256(data)
+            record = cache.get(content_hash)
+            if record is not None:
+                return record
+
+        analysis = self._analyze_image(image)
+        corner = self.corner_picker.pick_best_corner_from_analysis(analysis)
+        watermark_type = self.watermark_picker.pick_best_watermark_from_analysis(analysis, corner)
 
-        watermarked_image = add_watermark(image=image,
-                                          corner=corner,
-                                          watermark=watermark,
-                                          max_width_proportion=self.max_width_proportion,
-                                          max_height_proportion=self.max_height_proportion,
-                                          opacity=self.opacity)
-        watermarked_filepath = os.path.join(output_directory, f"{filename}{suffix}{extension}")
-        watermarked_image.save(watermarked_filepath, quality=100)
-        print(f"Added watermark to {base_filename}")
+        record = AnalysisRecord(corner, watermark_type, analysis.statistics)
+        if content_hash is not None:
+            cache.put(content_hash, record)
+        return record
 
-        watermarked_image.close()
-        image.close()
+    def _analyze_image(self, image: Image.Image) -> CornerAnalysis:
+        """
+        Computes corner statistics of a photo, downscaled if analysis_scale is below 1.
+        Only the corners of a decoded photo are reduced, without modifying it. A JPEG that was only opened
+        is decoded at reduced resolution, which changes the passed image, so it is only done when planning
+
+        :param image: full resolution photo
+        :return: statistics of the corners the corner picker chooses from
+        """
+
+        if self.analysis_scale == 1:
+            return self.corner_picker.analyze(image)
+        return self.corner_picker.analyze(reduce_for_analysis(image, self.analysis_scale, self.corners,
+                                                              self.max_width_proportion, self.max_height_proportion))
 
     def process_single_file(self, filepath: str, output_directory: str, suffix: str = "_watermark") -> None:
         """
@@ -191,6 +1214,74 @@ class DirectoryProcessor:
         self._process_file(filepath, output_directory, suffix)
         self._close_watermarks()
 
+    def process_bytes(self, data: bytes, timer: Optional[StageTimer] = None) -> bytes:
+        """
+        Adds watermark to a photo held in memory, without touching the filesystem
+
+        :param data: contents of the photo's file
+        :param timer: timer measuring stages of processing, stages are not measured if None
+        :return: contents of the watermarked photo's file in the output format
+        :raises NotSupportedFileFormatException: if the photo's format is not supported
+        :raises OSError: if the photo could not be decoded
+        """
+
+        opened = self.dark_watermark is None or self.light_watermark is None
+        self._open_watermarks()
+        try:
+            return self._render(data, StageTimer() if timer is None else timer).data
+        finally:
+            if opened:
+                self._close_watermarks()
+
+    def process_images(self, images: Iterable[Union[bytes, BinaryIO, Image.Image]]) -> Iterator['WatermarkedImage']:
+        """
+        Lazily adds watermark to photos held in memory, without touching the filesystem.
+        Each photo is read from the iterable only when the previous result was consumed,
+        so photos can be processed as they arrive. Passed images are not modified
+
+        :param images: contents of photos' files, binary file-like objects or :class:`PIL.Image.Image` objects
+        :return: iterator over watermarked photos, in the order of images
+        :raises NotSupportedFileFormatException: if a photo's format is not supported
+        :raises OSError: if a photo could not be decoded
+        :raises TypeError: if an item is not one of the supported types
+        """
+
+        opened = self.dark_watermark is None or self.light_watermark is None
+        self._open_watermarks()
+        try:
+            for source in images:
+                timer = StageTimer()
+                if isinstance(source, Image.Image):
+                    source.load()
+                    yield self._watermark_image(source, None, timer, in_place=False)
+                elif isinstance(source, (bytes, bytearray, memoryview)):
+                    yield self._render(bytes(source), timer)
+                elif hasattr(source, 'read'):
+                    yield self._render(source.read(), timer)
+                else:
+                    raise TypeError(f"Can not process {type(source).__name__}, expected bytes, a file or an image")
+        finally:
+            if opened:
+                self._close_watermarks()
+
+    def load_watermarks(self) -> None:
+        """
+        Opens and decodes both watermarks and keeps them until :meth:`DirectoryProcessor.close_watermarks`.
+        While loaded, :meth:`DirectoryProcessor.process_bytes` and :meth:`DirectoryProcessor.process_images`
+        do not reopen them and can be called from multiple threads
+        """
+
+        self._open_watermarks()
+        self.dark_watermark.load()
+        self.light_watermark.load()
+
+    def close_watermarks(self) -> None:
+        """
+        Closes watermarks loaded with :meth:`DirectoryProcessor.load_watermarks`
+        """
+
+        self._close_watermarks()
+
     def _open_watermarks(self) -> None:
         """
         Safely open watermark files. For internal use with :method:`core.DirectoryProcessor.process_single_file`
@@ -213,5 +1304,41 @@ class DirectoryProcessor:
             self.light_watermark.close()
             self.light_watermark = None
 
-# TODO: Handling of folders and nested folders
-# TODO: Optimize by concurrent processing
+
+# Processor of the current worker process, see DirectoryProcessor._process_files_in_pool
+_worker_processor: Optional[DirectoryProcessor] = None
+
+
+def _init_worker(processor: DirectoryProcessor) -> None:
+    """
+    Loads the watermarks once per worker process
+
+    :param processor: processor configured by the parent process
+    """
+
+    global _worker_processor
+    _worker_processor = processor
+
+    # Forked workers inherit the parent's file handles, watermarks are always reopened
+    _worker_processor.dark_watermark = None
+    _worker_processor.light_watermark = None
+    _worker_processor.load_watermarks()
+
+
+def _process_file_in_worker(filepath: str, output_directory: str,
+                            capture_cprofile: bool) -> tuple[str, FileResult]:
+    """
+    Processes a file in a worker process
+
+    :param filepath: path to the photo to process
+    :param output_directory: directory where the processed photo will be saved
+    :param capture_cprofile: collect cProfile statistics while processing the file
+    :return: messages printed while processing the file and the outcome of processing it
+    """
+
+    output = io.StringIO()
+    counters = _worker_processor._cache_counters()
+    with redirect_stdout(output):
+        result = _worker_processor._process_file_reporting_errors(filepath, output_directory, capture_cprofile)
+    return output.getvalue(), result._replace(counters=_worker_processor._cache_counters_since(counters))
+
@@ -0,0 +1,140 @@
+"""
+Options for encoding watermarked images
+
+"""
+from typing import Optional, Union
+
+from PIL import Image, JpegImagePlugin, features
+
+KEEP = 'keep'
+JPEG_SUBSAMPLING = ['4:4:4', '4:2:2', '4:2:0']
+
+# Output format -> Pillow format and file extension
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+    'avif': ('AVIF', '.avif'),
+}
+# Output formats that keep transparency of the photos
+ALPHA_OUTPUT_FORMATS = ['webp', 'avif']
+
+
+def validate_jpeg_options(quality: Union[int, str], subsampling: Optional[str]) -> None:
+    """
+    Raises value error if JPEG encoder options are invalid
+
+    :param quality: [1, 100] quality or 'keep' to reuse quantization tables of the source
+    :param subsampling: chroma subsampling, 'keep' to reuse subsampling of the source or None for the default
+    """
+    if quality != KEEP and (not isinstance(quality, int) or not 1 <= quality <= 100):
+        raise ValueError("quality must be an integer between 1 and 100 or 'keep'")
+    if subsampling is not None and subsampling != KEEP and subsampling not in JPEG_SUBSAMPLING:
+        raise ValueError(f"subsampling must be one of: {', '.join(JPEG_SUBSAMPLING + [KEEP])}")
+
+
+def jpeg_save_options(source: Image.Image,
+                      quality: Union[int, str] = 100,
+                      subsampling: Optional[str] = None,
+                      progressive: bool = False,
+                      optimize: bool = False) -> dict:
+    """
+    Keyword arguments for saving a watermarked image as JPEG with :meth:`PIL.Image.Image.save`
+
+    With quality 'keep' the quantization tables and subsampling of a JPEG source are reused,
+    which keeps the output close to the original in both quality and size.
+    Sources that are not JPEG images have no tables to reuse and are saved with quality 100
+
+    :param source: decoded original image
+    :param quality: [1, 100] quality or 'keep'
+    :param subsampling: chroma subsampling, 'keep' to reuse subsampling of the source or None for the default
+    :param progressive: save a progressive JPEG
+    :param optimize: compute optimal Huffman tables, slower encoding for smaller files
+    :return: options for :meth:`PIL.Image.Image.save`
+    """
+    validate_jpeg_options(quality, subsampling)
+
+    is_jpeg = source.format in ('JPEG', 'MPO') and hasattr(source, 'quantization')
+    options = {'format': 'JPEG', 'progressive': progressive, 'optimize': optimize}
+
+    if quality == KEEP and is_jpeg:
+        options['qtables'] = source.quantization
+        if subsampling is None:
+            subsampling = KEEP
+    else:
+        options['quality'] = 100 if quality == KEEP else quality
+
+    if subsampling == KEEP:
+        if is_jpeg and JpegImagePlugin.get_sampling(source) != -1:
+            options['subsampling'] = JpegImagePlugin.get_sampling(source)
+    elif subsampling is not None:
+        options['subsampling'] = subsampling
+
+    return options
+
+
+def available_output_formats() -> list[str]:
+    """
+    Output formats supported by the installed Pillow build
+
+    :return: names of output formats, jpeg is always available
+    """
+    return [output_format for output_format in OUTPUT_FORMATS
+            if output_format == 'jpeg' or features.check(output_format)]
+
+
+def validate_output_format(output_format: str) -> None:
+    """
+    Raises value error if images can not be saved in the output format
+
+    :param output_format: name of the output format, one of OUTPUT_FORMATS
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output format must be one of: {', '.join(OUTPUT_FORMATS)}")
+    if output_format not in available_output_formats():
+        raise ValueError(f"{output_format} is not supported by the installed Pillow")
+
+
+def save_options(source: Image.Image,
+                 output_format: str = 'jpeg',
+                 quality: Union[int, str] = 100,
+                 subsampling: Optional[str] = None,
+                 progressive: bool = False,
+                 optimize: bool = False) -> dict:
+    """
+    Keyword arguments for saving a watermarked image in the output format with :meth:`PIL.Image.Image.save`
+
+    JPEG options are described in :func:`jpeg_save_options`. WebP and AVIF have no tables to reuse,
+    with quality 'keep' they are saved with the encoder's default quality.
+    Progressive encoding only applies to JPEG, subsampling to JPEG and AVIF.
+    Optimize selects the slowest and most efficient compression method for WebP and AVIF
+
+    :param source: decoded original image
+    :param output_format: name of the output format, one of OUTPUT_FORMATS
+    :param quality: [1, 100] quality or 'keep'
+    :param subsampling: chroma subsampling, 'keep' to reuse subsampling of the source or None for the default
+    :param progressive: save a progressive JPEG
+    :param optimize: compress better at the cost of slower encoding
+    :return: options for :meth:`PIL.Image.Image.save`
+    """
+    validate_output_format(output_format)
+    if output_format == 'jpeg':
+        return jpeg_save_options(source, quality, subsampling, progressive, optimize)
+
+    validate_jpeg_options(quality, subsampling)
+    options: dict = {'format': OUTPUT_FORMATS[output_format][0]}
+    if quality != KEEP:
+        options['quality'] = quality
+
+    match output_format:
+        case 'webp':
+            options['method'] = 6 if optimize else 4
+        case 'avif':
+            options['speed'] = 0 if optimize else 6
+            if subsampling == KEEP:
+                is_jpeg = source.format in ('JPEG', 'MPO') and hasattr(source, 'quantization')
+                if is_jpeg and JpegImagePlugin.get_sampling(source) != -1:
+                    options['subsampling'] = JPEG_SUBSAMPLING[JpegImagePlugin.get_sampling(source)]
+            elif subsampling is not None:
+                options['subsampling'] = subsampling
+
+    return options
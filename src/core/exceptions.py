@@ -4,3 +4,15 @@ class NotSupportedFileFormatException(Exception):
 
 class NoneSelectedException(Exception):
     pass
+
+
+class FramingException(Exception):
+    pass
+
+
+class PlanException(Exception):
+    pass
+
+
+class ShardException(Exception):
+    pass
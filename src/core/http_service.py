@@ -0,0 +1,313 @@
+"""
+Long-running HTTP service adding watermarks to photos sent in requests
+
+Watermarks and prepared watermarks stay loaded between requests, so a request only pays for processing the photo.
+
+Endpoints:
+    POST /watermark  body is the photo's file, the response is the watermarked photo.
+                     Optional query parameters: corners (the same names as in the command line interface),
+                     width, height and opacity. The chosen corner and watermark type are returned
+                     in X-Watermark-Corner and X-Watermark-Type headers
+    GET /health      JSON with request counters, latencies and watermark cache statistics
+"""
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from core.directory_processors import DirectoryProcessor, WatermarkedImage
+from core.encoding import OUTPUT_FORMATS, validate_output_format
+from core.exceptions import NotSupportedFileFormatException
+from core.profiling import percentile
+from core.watermarking import CORNER_PRESETS
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+
+class WatermarkService:
+    """
+    Warm processors and metrics shared by all requests.
+    Every distinct set of request parameters gets its own processor with loaded watermarks,
+    the least recently used processors are dropped when there are more than max_processors
+    """
+
+    LATENCY_WINDOW = 1000
+
+    def __init__(self, corners: str = 'all', width: float = 0.15, height: float = 0.15, opacity: float = 0.5,
+                 max_processors: int = 8, max_body_size: int = 64 * 1024 * 1024, **processor_options):
+        """
+        :param corners: default name of the set of corners, see :data:`core.watermarking.CORNER_PRESETS`
+        :param width: default [0, 1] maximum watermark / image width ratio
+        :param height: default [0, 1] maximum watermark / image height ratio
+        :param opacity: default opacity of the watermark
+        :param max_processors: maximum number of processors with different parameters kept loaded
+        :param max_body_size: maximum size of a photo in bytes
+        :param processor_options: other keyword arguments of :class:`core.directory_processors.DirectoryProcessor`
+        :raises ValueError: if default parameters are invalid
+        """
+        self.defaults = self.parse_parameters({}, {'corners': corners, 'width': width,
+                                                   'height': height, 'opacity': opacity})
+        self.max_processors = max_processors
+        self.max_body_size = max_body_size
+        self.processor_options = processor_options
+        output_format = processor_options.get('output_format', 'jpeg')
+        validate_output_format(output_format)
+        self.content_type = Image.MIME[OUTPUT_FORMATS[output_format][0]]
+
+        self._processors: OrderedDict[tuple, DirectoryProcessor] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._latencies: deque[float] = deque(maxlen=self.LATENCY_WINDOW)
+
+        # Load the default processor before the first request
+        self.processor(self.defaults)
+
+    @staticmethod
+    def parse_parameters(query: dict[str, list[str]], defaults: dict) -> dict:
+        """
+        Watermarking parameters from query parameters of a request
+
+        :param query: parsed query string
+        :param defaults: values of parameters missing in the query
+        :return: validated parameters
+        :raises ValueError: if a parameter is unknown or has an invalid value
+        """
+        unknown = set(query) - set(defaults)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        parameters = dict(defaults)
+        for name, values in query.items():
+            parameters[name] = values[-1]
+
+        if parameters['corners'] not in CORNER_PRESETS:
+            raise ValueError(f"corners must be one of: {', '.join(CORNER_PRESETS)}")
+        for name in ('width', 'height', 'opacity'):
+            try:
+                parameters[name] = float(parameters[name])
+            except ValueError:
+                raise ValueError(f"{name} must be a number") from None
+            if not 0 <= parameters[name] <= 1:
+                raise ValueError(f"{name} must be between 0 and 1")
+        if parameters['width'] == 0 or parameters['height'] == 0:
+            raise ValueError("width and height must be greater than 0")
+
+        return parameters
+
+    def processor(self, parameters: dict) -> DirectoryProcessor:
+        """
+        Processor with loaded watermarks for the parameters
+
+        :param parameters: validated parameters
+        :return: processor, safe to use from multiple threads
+        """
+        key = tuple(sorted(parameters.items()))
+        with self._lock:
+            processor = self._processors.get(key)
+            if processor is not None:
+                self._processors.move_to_end(key)
+                return processor
+
+            processor = DirectoryProcessor(max_width_proportion=parameters['width'],
+                                           max_height_proportion=parameters['height'],
+                                           opacity=parameters['opacity'],
+                                           corners=CORNER_PRESETS[parameters['corners']],
+                                           **self.processor_options)
+            processor.load_watermarks()
+            self._processors[key] = processor
+            # Processors may still be used by other requests, dropped ones are closed by the garbage collector
+            while len(self._processors) > self.max_processors:
+                self._processors.popitem(last=False)
+            return processor
+
+    def watermark(self, data: bytes, query: dict[str, list[str]]) -> WatermarkedImage:
+        """
+        Adds watermark to a photo
+
+        :param data: contents of the photo's file
+        :param query: parsed query string of the request
+        :return: watermarked photo
+        :raises ValueError: if query parameters are invalid
+        :raises NotSupportedFileFormatException: if the photo's format is not supported
+        :raises OSError: if the photo could not be decoded
+        """
+        processor = self.processor(self.parse_parameters(query, self.defaults))
+        result, = processor.process_images([data])
+        return result
+
+    def request_started(self, body_size: int) -> float:
+        """
+        Counts a request that started processing
+
+        :param body_size: size of the photo in bytes
+        :return: start time to pass to :meth:`WatermarkService.request_finished`
+        """
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.bytes_in += body_size
+        return time.perf_counter()
+
+    def request_finished(self, start: float, response_size: int, failed: bool) -> None:
+        """
+        Counts a request that finished processing
+
+        :param start: value returned by :meth:`WatermarkService.request_started`
+        :param response_size: size of the watermarked photo in bytes
+        :param failed: whether the photo could not be processed
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.bytes_out += response_size
+            self.errors += failed
+            self._latencies.append(time.perf_counter() - start)
+
+    def metrics(self) -> dict:
+        """
+        Health and load metrics of the service
+
+        :return: JSON serializable metrics, latencies are computed over the most recent requests
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            processors = list(self._processors.values())
+            metrics = {
+                'status': 'ok',
+                'uptime': time.time() - self.started,
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'processors': len(processors),
+            }
+
+        metrics['latency'] = {
+            'count': len(latencies),
+            'p50': percentile(latencies, 50) if latencies else 0.0,
+            'p95': percentile(latencies, 95) if latencies else 0.0,
+            'max': max(latencies, default=0.0),
+        }
+        metrics['watermark_cache'] = {
+            'hits': sum(processor.watermark_cache.hits for processor in processors),
+            'misses': sum(processor.watermark_cache.misses for processor in processors),
+        }
+        return metrics
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles requests of :class:`WatermarkServer`
+    """
+
+    server: 'WatermarkServer'
+
+    def do_GET(self) -> None:
+        if urlparse(self.path).path != '/health':
+            self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+            return
+        self._send(HTTPStatus.OK, json.dumps(self.server.service.metrics()).encode(), 'application/json')
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != '/watermark':
+            self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+            return
+
+        service = self.server.service
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self._send_error(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required")
+            return
+        if int(length) > service.max_body_size:
+            self._send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                             f"Photo can not be larger than {service.max_body_size} bytes")
+            return
+
+        data = self.rfile.read(int(length))
+        start = service.request_started(len(data))
+        try:
+            result = service.watermark(data, parse_qs(url.query))
+        except Image.DecompressionBombError as err:
+            service.request_finished(start, 0, failed=True)
+            self._send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, str(err))
+        except (ValueError, NotSupportedFileFormatException, OSError) as err:
+            service.request_finished(start, 0, failed=True)
+            self._send_error(HTTPStatus.BAD_REQUEST, str(err))
+        except Exception:
+            service.request_finished(start, 0, failed=True)
+            raise
+        else:
+            service.request_finished(start, len(result.data), failed=False)
+            self._send(HTTPStatus.OK, result.data, service.content_type, {
+                'X-Watermark-Corner': result.corner.value,
+                'X-Watermark-Type': result.watermark_type.name.lower(),
+            })
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        self._send(status, json.dumps({'error': message}).encode(), 'application/json')
+
+    def _send(self, status: HTTPStatus, body: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class WatermarkServer(HTTPServer):
+    """
+    HTTP server handling connections in a fixed pool of worker threads
+    """
+
+    def __init__(self, service: WatermarkService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 workers: int = 4, quiet: bool = False):
+        """
+        :param service: state shared by requests
+        :param host: address to bind, localhost by default
+        :param port: port to bind, 0 picks a free port
+        :param workers: number of requests processed concurrently
+        :param quiet: do not log requests to standard error
+        :raises ValueError: if workers is not positive
+        """
+        if workers < 1:
+            raise ValueError("workers must be a positive integer")
+        super().__init__((host, port), WatermarkRequestHandler)
+        self.service = service
+        self.quiet = quiet
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='watermark-worker')
+
+    def process_request(self, request, client_address) -> None:
+        self._executor.submit(self._process_request_in_worker, request, client_address)
+
+    def _process_request_in_worker(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,211 @@
+"""
+Summed-area tables of an image, giving color statistics of any rectangular window in constant time
+
+Tables of values and of squared values are built once per image, after which statistics of a window
+take four lookups per table regardless of the window's size, so many candidate windows can be compared
+for the cost of reading the image once. Windows are only scored, watermarks are always placed in corners
+picked by :mod:`core.corner_pickers`.
+"""
+from itertools import accumulate
+from math import ceil
+from operator import add, mul
+from typing import NamedTuple
+
+from PIL import Image
+
+from core.watermarking import ColorStatistics, Corner, avg, color_statistics, corner_box, normalize_mode, \
+    statistics_from_sums
+
+# Lookup table squaring 8-bit values into a floating point band
+_SQUARES = [float(value * value) for value in range(256)]
+
+# Approximate number of pixels of a strip converted to floating point at once
+_STRIP_PIXELS = 1 << 20
+
+# Building the tables costs about as much as reading three times the image window by window,
+# so windows covering less than this many times the image are read directly
+_TABLES_MIN_AREA = 2
+
+
+class Window(NamedTuple):
+    """
+    Candidate placement of a watermark
+    """
+    name: str
+    box: tuple[int, int, int, int]
+
+
+class IntegralImage:
+    """
+    Summed-area tables of values and squared values of each RGB channel of an image.
+
+    Large images are summed over square cells of cell_size pixels, the sums of each cell are exact,
+    windows are aligned to the nearest cell boundaries. With cell_size 1 statistics are exactly
+    the same as :func:`core.watermarking.color_statistics` of the cropped window
+    """
+
+    def __init__(self, image: Image.Image, max_cells: int = 256):
+        """
+        Builds the tables, reading the image once
+
+        :param image: image to analyse, images in other modes than RGB are analysed as RGB
+        :param max_cells: maximum number of cells along the longer side of the image
+        :raises ValueError: if max_cells is not positive
+        """
+        if max_cells < 1:
+            raise ValueError("max_cells must be a positive integer")
+        if image.mode != 'RGB':
+            image = normalize_mode(image)
+
+        self.size = image.size
+        self.cell_size = max(1, ceil(max(image.size) / max_cells))
+        self.columns = ceil(image.width / self.cell_size)
+        self.rows = ceil(image.height / self.cell_size)
+
+        # Cells are averaged in strips of whole rows of cells, only strips are converted to floating point
+        means = [[] for _ in image.getbands()]
+        squared_means = [[] for _ in image.getbands()]
+        strip_height = self.cell_size * max(1, _STRIP_PIXELS // (image.width * self.cell_size))
+        for upper in range(0, image.height, strip_height):
+            strip = image.crop((0, upper, image.width, min(image.height, upper + strip_height)))
+            for band, band_means, band_squared_means in zip(strip.split(), means, squared_means):
+                band_means.extend(self._cell_means(band.convert('F')))
+                band_squared_means.extend(self._cell_means(band.point(_SQUARES, 'F')))
+
+        self._sums = [self._table(values) for values in means]
+        self._squared_sums = [self._table(values) for values in squared_means]
+
+    def _cell_means(self, band: Image.Image) -> list[float]:
+        """
+        :param band: 'F' strip of whole rows of cells, the last strip may end with a partial row
+        :return: averages of the cells' values row by row, the last row and column average only the pixels
+            inside the image
+        """
+        if self.cell_size > 1:
+            band = band.reduce(self.cell_size)
+        return list(band.getdata())
+
+    def _table(self, means: list[float]) -> list[list[float]]:
+        """
+        Summed-area table of cell averages, with a leading row and column of zeros
+
+        :param means: averages of all cells row by row
+        :return: table[row][column] is the sum of all cells above and to the left of it
+        """
+        cell = self.cell_size
+        last_width = self.size[0] - (self.columns - 1) * cell
+        last_height = self.size[1] - (self.rows - 1) * cell
+        widths = [cell] * (self.columns - 1) + [last_width]
+
+        table = [[0.0] * (self.columns + 1)]
+        for row in range(self.rows):
+            row_values = means[row * self.columns:(row + 1) * self.columns]
+            if cell > 1:
+                height = cell if row < self.rows - 1 else last_height
+                row_values = map(mul, row_values, [width * height for width in widths])
+            row_sums = accumulate(row_values, initial=0.0)
+            table.append(list(map(add, table[-1], row_sums)))
+        return table
+
+    def _cell_index(self, position: int, size: int, count: int) -> int:
+        if position >= size:
+            return count
+        return min(count, max(0, round(position / self.cell_size)))
+
+    def cell_box(self, box: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        """
+        Window actually measured for a box, aligned to cell boundaries and clipped to the image
+
+        :param box: (left, upper, right, lower) box in pixels
+        :return: (left, upper, right, lower) box in cells
+        """
+        left, upper, right, lower = box
+        width, height = self.size
+        return (self._cell_index(left, width, self.columns), self._cell_index(upper, height, self.rows),
+                self._cell_index(right, width, self.columns), self._cell_index(lower, height, self.rows))
+
+    def statistics(self, box: tuple[int, int, int, int]) -> ColorStatistics:
+        """
+        Color statistics of a window of the image, in constant time
+
+        :param box: (left, upper, right, lower) box in pixels
+        :return: statistics of RGB channels of the window
+        :raises ValueError: if the window is empty
+        """
+        left, upper, right, lower = self.cell_box(box)
+        if left >= right or upper >= lower:
+            raise ValueError(f"Window {box} is empty")
+
+        cell = self.cell_size
+        pixel_count = ((min(right * cell, self.size[0]) - left * cell) *
+                       (min(lower * cell, self.size[1]) - upper * cell))
+
+        def window_sum(table: list[list[float]]) -> float:
+            return table[lower][right] - table[upper][right] - table[lower][left] + table[upper][left]
+
+        return statistics_from_sums([window_sum(table) for table in self._sums],
+                                    [window_sum(table) for table in self._squared_sums],
+                                    pixel_count)
+
+
+def candidate_windows(image_size: tuple[int, int], window_size: tuple[int, int],
+                      margin: float = 0.02, grid_steps: int = 4) -> list[Window]:
+    """
+    Candidate placements of a window in an image: the four corners, the corners moved inwards by a margin,
+    the middles of the edges and a regular grid sliding over the whole image
+
+    :param image_size: (width, height) of the image
+    :param window_size: (width, height) of the window, at most the size of the image
+    :param margin: [0, 1] distance of the inner corners from the edges, as a fraction of the image size
+    :param grid_steps: number of steps of the grid along each axis, 0 for no grid
+    :return: distinct windows, each inside the image
+    :raises ValueError: if the window does not fit in the image
+    """
+    image_width, image_height = image_size
+    width, height = window_size
+    if not (0 < width <= image_width and 0 < height <= image_height):
+        raise ValueError("Window must fit in the image")
+    if not 0 <= margin <= 1:
+        raise ValueError("margin must be between 0 and 1")
+
+    free_x, free_y = image_width - width, image_height - height
+    positions = {}
+    for corner in Corner:
+        left, upper, _, _ = corner_box(image_size, corner, width / image_width, height / image_height)
+        positions.setdefault((left, upper), corner.value)
+
+        inner_left = min(max(left, round(image_width * margin)), free_x - round(image_width * margin))
+        inner_upper = min(max(upper, round(image_height * margin)), free_y - round(image_height * margin))
+        positions.setdefault((max(0, inner_left), max(0, inner_upper)), f'{corner.value} inner')
+
+    for name, position in (('top middle', (free_x // 2, 0)), ('bottom middle', (free_x // 2, free_y)),
+                           ('left middle', (0, free_y // 2)), ('right middle', (free_x, free_y // 2))):
+        positions.setdefault(position, name)
+
+    for row in range(grid_steps + 1 if grid_steps else 0):
+        for column in range(grid_steps + 1):
+            position = (free_x * column // grid_steps, free_y * row // grid_steps)
+            positions.setdefault(position, f'grid {column},{row}')
+
+    return [Window(name, (left, upper, left + width, upper + height)) for (left, upper), name in positions.items()]
+
+
+def pick_best_window(image: Image.Image, windows: list[Window], max_cells: int = 256) -> Window:
+    """
+    Picks the window with the smallest average standard deviation of RGB color values.
+    Windows covering together less than a few times the image are read directly with exact statistics,
+    summed-area tables are only built for more windows
+
+    :param image: image to choose a window from
+    :param windows: candidate windows, eg. from :func:`candidate_windows`
+    :param max_cells: maximum number of cells of the tables, see :class:`IntegralImage`
+    :return: best window
+    """
+    windows_area = sum((right - left) * (lower - upper) for left, upper, right, lower in (w.box for w in windows))
+    if windows_area >= _TABLES_MIN_AREA * image.width * image.height:
+        integral_image = IntegralImage(image, max_cells)
+        return min(windows, key=lambda window: avg(integral_image.statistics(window.box).stdev))
+
+    if image.mode != 'RGB':
+        image = normalize_mode(image)
+    return min(windows, key=lambda window: avg(color_statistics(image.crop(window.box)).stdev))
@@ -0,0 +1,157 @@
+import glob
+import hashlib
+import json
+import os.path
+import time
+from typing import Optional
+
+
+class ProcessingManifest:
+    """
+    Record of photos already watermarked into an output directory
+
+    Every processed photo is appended to a JSON lines file as soon as its output is written,
+    so an interrupted run can be resumed. A photo is up-to-date if its size and modification time
+    (or content hash) and the processing parameters match the record, and its output still exists.
+
+    Runs writing to the same output directory at the same time, eg. shards on several machines, must use
+    different filenames. Records of all manifests in the directory are loaded, but only the run's own manifest
+    is written, so records of other runs are never lost
+    """
+
+    FILENAME = '.watermark-manifest.jsonl'
+    PATTERN = '.watermark-manifest*.jsonl'
+
+    def __init__(self, output_directory: str, parameters: dict, use_content_hash: bool = False,
+                 filename: str = FILENAME):
+        """
+        Loads records of previous runs from all manifests in output_directory,
+        the latest record of each photo is used
+
+        :param output_directory: directory where the manifest is stored
+        :param parameters: JSON serializable processing parameters, records with different parameters are outdated
+        :param use_content_hash: compare SHA-256 of the contents instead of the modification time
+        :param filename: name of the run's own manifest, must match PATTERN
+        """
+        self.filepath = os.path.join(output_directory, filename)
+        self.parameters = parameters
+        self.use_content_hash = use_content_hash
+        self.records: dict[str, dict] = {}
+
+        self._own_records: dict[str, dict] = {}
+
+        for filepath in sorted(glob.glob(os.path.join(glob.escape(output_directory), ProcessingManifest.PATTERN))):
+            records = self._read(filepath)
+            if filepath == self.filepath:
+                self._own_records = records
+            for source, record in records.items():
+                # Records written before they were timestamped are the oldest
+                if record.get('time', 0) >= self.records.get(source, {}).get('time', 0):
+                    self.records[source] = record
+
+        self._file = None
+
+    def is_up_to_date(self, relative_path: str, source_path: str) -> bool:
+        """
+        Checks if a photo was already processed with current parameters and did not change since
+
+        :param relative_path: path of the photo relative to the processed directory, identifies the record
+        :param source_path: path to the photo
+        :return: True if the photo does not need to be processed again
+        """
+        record = self.records.get(relative_path)
+        if record is None or record['parameters'] != self.parameters:
+            return False
+        if not os.path.exists(os.path.join(os.path.dirname(self.filepath), record['output'])):
+            return False
+
+        return record['fingerprint'] == self._fingerprint(source_path, record['fingerprint'])
+
+    def record(self, relative_path: str, source_path: str, output_path: str) -> None:
+        """
+        Records a processed photo, the record is written to disk immediately
+
+        :param relative_path: path of the photo relative to the processed directory
+        :param source_path: path to the photo
+        :param output_path: path to the watermarked photo
+        """
+        record = {
+            'source': relative_path,
+            'output': os.path.relpath(output_path, os.path.dirname(self.filepath)),
+            'fingerprint': self._fingerprint(source_path),
+            'parameters': self.parameters,
+            'time': time.time(),
+        }
+        self.records[relative_path] = record
+        self._own_records[relative_path] = record
+
+        if self._file is None:
+            self._file = open(self.filepath, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self) -> None:
+        """
+        Rewrites the run's own manifest keeping only the latest record of each photo
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        if not self._own_records:
+            return
+
+        temporary_filepath = self.filepath + '.tmp'
+        with open(temporary_filepath, 'w', encoding='utf-8') as file:
+            for record in self._own_records.values():
+                file.write(json.dumps(record) + '\n')
+        os.replace(temporary_filepath, self.filepath)
+
+    @staticmethod
+    def _read(filepath: str) -> dict[str, dict]:
+        """
+        :param filepath: path to a manifest
+        :return: latest record of each photo by its relative path, empty if the manifest does not exist
+        """
+        records = {}
+        if os.path.exists(filepath):
+            with open(filepath, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line may be incomplete if the previous run was interrupted
+                        continue
+                    records[record['source']] = record
+        return records
+
+    def _fingerprint(self, source_path: str, previous: Optional[dict] = None) -> dict:
+        """
+        Size and modification time or content hash of a file
+
+        :param source_path: path to the file
+        :param previous: recorded fingerprint, the content is not hashed if the size already differs
+        :return: JSON serializable fingerprint
+        """
+        stat = os.stat(source_path)
+        if not self.use_content_hash:
+            return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        if previous is not None and previous.get('size') != stat.st_size:
+            return {'size': stat.st_size}
+
+        return {'size': stat.st_size, 'sha256': file_sha256(source_path)}
+
+
+def file_sha256(filepath: str) -> str:
+    """
+    SHA-256 hash of a file's contents
+
+    :param filepath: path to the file
+    :return: hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,142 @@
+"""
+Estimating memory needed to process photos and limiting how much of it is used at once
+
+Footprints are estimated from image headers, before any pixel data is decoded.
+"""
+import re
+import threading
+from typing import BinaryIO, Union
+
+from PIL import Image
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+_SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+
+# Bytes per pixel of modes that do not store one byte per band
+_MODE_PIXEL_SIZES = {'1': 1, 'I': 4, 'F': 4, 'I;16': 2, 'I;16B': 2, 'I;16L': 2, 'I;16N': 2}
+
+# Encoded JPEG kept in memory before it is written, generous for quality 100
+_ENCODED_SIZE_RATIO = 0.5
+
+
+def parse_memory_size(text: str) -> int:
+    """
+    Parses a human readable amount of memory, eg. '512M', '4G' or '1.5GiB'. Units are powers of 1024
+
+    :param text: number of bytes with an optional K, M, G or T suffix
+    :return: number of bytes
+    :raises ValueError: if the text is not a valid amount of memory
+    """
+    match = _SIZE_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"Invalid amount of memory: {text}")
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS[unit.upper()])
+
+
+def decoded_size(size: tuple[int, int], mode: str) -> int:
+    """
+    Memory taken by a decoded image
+
+    :param size: (width, height) of the image
+    :param mode: mode of the image
+    :return: size of the pixel data in bytes
+    """
+    width, height = size
+    return width * height * _MODE_PIXEL_SIZES.get(mode, Image.getmodebands(mode))
+
+
+def estimate_footprint(source: Union[str, BinaryIO]) -> int:
+    """
+    Peak memory needed to add watermark to a photo, read from its header without decoding it.
+    Includes the decoded photo, its RGB copy if the photo is not an RGB image and the encoded result
+
+    :param source: path to the photo or a binary file-like object with its contents
+    :return: estimated number of bytes, 0 if the header could not be read
+    """
+    try:
+        with Image.open(source) as image:
+            size, mode = image.size, image.mode
+    except (OSError, Image.DecompressionBombError):
+        # Photos that can not be read or exceed Pillow's pixel limit fail before allocating anything
+        return 0
+
+    decoded = decoded_size(size, mode)
+    rgb = decoded if mode == 'RGB' else decoded_size(size, 'RGB')
+    peak = decoded + (0 if mode == 'RGB' else rgb)
+    return peak + int(rgb * _ENCODED_SIZE_RATIO)
+
+
+class MemoryBudget:
+    """
+    Admits work only while the total estimated memory of work in progress stays within a limit.
+    Work larger than the whole budget is admitted only when nothing else is in progress.
+    Waiting work is admitted in order, so large work is not starved by smaller work. Thread-safe
+    """
+
+    def __init__(self, limit: int):
+        """
+        :param limit: maximum number of bytes in use at once
+        :raises ValueError: if limit is not positive
+        """
+        if limit <= 0:
+            raise ValueError("Memory limit must be positive")
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+        # Tickets of waiting work, the ticket being served is admitted next
+        self._next_ticket = 0
+        self._serving = 0
+        self._closed = False
+
+    def fits(self, amount: int) -> bool:
+        """
+        :param amount: number of bytes
+        :return: whether the work could be admitted right now
+        """
+        return self._closed or self.used == 0 or self.used + amount <= self.limit
+
+    def try_acquire(self, amount: int) -> bool:
+        """
+        Admits work if it fits in the budget
+
+        :param amount: estimated number of bytes
+        :return: True if the work was admitted and must be released later
+        """
+        with self._condition:
+            if self._serving != self._next_ticket or not self.fits(amount):
+                return False
+            self.used += amount
+            return True
+
+    def acquire(self, amount: int) -> None:
+        """
+        Waits until work fits in the budget and admits it
+
+        :param amount: estimated number of bytes
+        """
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._condition.wait_for(lambda: self._closed or self._serving == ticket and self.fits(amount))
+            self.used += amount
+            self._serving += 1
+            self._condition.notify_all()
+
+    def release(self, amount: int) -> None:
+        """
+        Returns memory of finished work to the budget
+
+        :param amount: number of bytes passed when the work was admitted
+        """
+        with self._condition:
+            self.used -= amount
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """
+        Admits all waiting and future work, used when work in progress is abandoned and will never be released
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
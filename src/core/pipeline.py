@@ -0,0 +1,143 @@
+"""
+Staged producer/consumer pipeline running each stage in its own pool of threads
+
+Items flow between stages through bounded queues, so a slow stage applies backpressure
+to the stages before it and memory use stays bounded.
+Pillow releases the GIL while decoding and encoding, so threads overlap disk access with computation.
+"""
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+
+class Stage(NamedTuple):
+    """
+    A step of the pipeline, function is called with the result of the previous stage
+    """
+    name: str
+    function: Callable[[Any], Any]
+    threads: int = 1
+
+
+class StageFailure(NamedTuple):
+    """
+    Result of an item for which a stage raised an exception, later stages are skipped
+    """
+    stage: str
+    exception: BaseException
+    item: Any  # input of the stage that failed
+
+
+_DONE = object()
+_POLL_INTERVAL = 0.1
+
+
+def run_pipeline(items: Iterable[Any], stages: list[Stage], queue_size: int = 4) -> Iterator[Any]:
+    """
+    Passes items through all stages and lazily yields the results in the order of items.
+    Items are read from the iterable in a background thread, only when there is room in the first queue
+
+    If a stage raises an exception, the item's result is a :class:`StageFailure`.
+    If iterating over items raises an exception, it is raised after yielding results of the preceding items
+
+    :param items: inputs of the first stage
+    :param stages: stages of the pipeline, in order
+    :param queue_size: maximum number of items waiting in front of each stage
+    :return: iterator over results of the last stage or StageFailures
+    :raises ValueError: if there are no stages, a stage has no threads or queue_size is not positive
+    """
+    if not stages:
+        raise ValueError("Pipeline must have at least one stage")
+    if any(stage.threads < 1 for stage in stages):
+        raise ValueError("Each stage must have at least one thread")
+    if queue_size < 1:
+        raise ValueError("queue_size must be a positive integer")
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    stopped = threading.Event()
+    feeder_errors: list[BaseException] = []
+
+    def put(target: queue.Queue, item: Any) -> bool:
+        while not stopped.is_set():
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(source: queue.Queue) -> Any:
+        while not stopped.is_set():
+            try:
+                return source.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def feed() -> None:
+        try:
+            for index, item in enumerate(items):
+                if not put(queues[0], (index, item)):
+                    return
+        except BaseException as exc:
+            feeder_errors.append(exc)
+        for _ in range(stages[0].threads):
+            put(queues[0], _DONE)
+
+    def work(stage_index: int, remaining: list[int], lock: threading.Lock) -> None:
+        stage = stages[stage_index]
+        source, target = queues[stage_index], queues[stage_index + 1]
+
+        while True:
+            entry = get(source)
+            if entry is _DONE:
+                break
+
+            index, item = entry
+            if not isinstance(item, StageFailure):
+                try:
+                    item = stage.function(item)
+                except Exception as exc:
+                    item = StageFailure(stage.name, exc, item)
+            if not put(target, (index, item)):
+                return
+
+        # The last thread of a stage tells the next stage that no more items will come
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            next_threads = stages[stage_index + 1].threads if stage_index + 1 < len(stages) else 1
+            for _ in range(next_threads):
+                put(target, _DONE)
+
+    threads = [threading.Thread(target=feed, name='pipeline-feeder', daemon=True)]
+    for stage_index, stage in enumerate(stages):
+        remaining, lock = [stage.threads], threading.Lock()
+        threads += [threading.Thread(target=work, args=(stage_index, remaining, lock),
+                                     name=f'pipeline-{stage.name}-{number}', daemon=True)
+                    for number in range(stage.threads)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        # Results arrive out of order, they are held back until all preceding results were yielded
+        waiting: dict[int, Any] = {}
+        next_index = 0
+        while True:
+            entry = get(queues[-1])
+            if entry is _DONE:
+                break
+            index, result = entry
+            waiting[index] = result
+            while next_index in waiting:
+                yield waiting.pop(next_index)
+                next_index += 1
+
+        if feeder_errors:
+            raise feeder_errors[0]
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
+
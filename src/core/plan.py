@@ -0,0 +1,110 @@
+"""
+Decision plans: corners and watermark types picked for photos, reviewed before they are applied
+
+A plan is a JSON lines file with one photo per line, so it can be filtered with standard tools or edited by hand.
+Only source, output, corner and watermark_type are needed to apply a plan. The output format is checked
+when the plan is applied, sizes and statistics are written for review, for example::
+
+    {"source": "/photos/a.jpg", "output": "/photos/with-watermark/a_watermark.jpg", "corner": "lower left",
+     "watermark_type": "dark", "output_format": "jpeg", "image_size": [4000, 3000], "watermark_size": [600, 180],
+     "statistics": {"lower left": {"mean": [210, 208, 200], "variance": [...], "stdev": [...]}}}
+"""
+import json
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO
+
+from core.corner_analysis import statistics_from_json, statistics_to_json
+from core.exceptions import PlanException
+from core.watermark_pickers import WatermarkType
+from core.watermarking import ColorStatistics, Corner
+
+
+class PlanEntry(NamedTuple):
+    """
+    Decision made for a single photo
+    """
+    source: str
+    output: str
+    corner: Corner
+    watermark_type: WatermarkType
+    image_size: tuple[int, int] = (0, 0)
+    watermark_size: tuple[int, int] = (0, 0)
+    statistics: dict[Corner, ColorStatistics] = {}
+    output_format: Optional[str] = None  # format the output path was chosen for, not checked if None
+
+    def to_json(self) -> str:
+        """
+        :return: line of the plan, without the newline
+        """
+        return json.dumps({
+            'source': self.source,
+            'output': self.output,
+            'corner': self.corner.value,
+            'watermark_type': self.watermark_type.name.lower(),
+            'output_format': self.output_format,
+            'image_size': list(self.image_size),
+            'watermark_size': list(self.watermark_size),
+            'statistics': statistics_to_json(self.statistics),
+        })
+
+    @staticmethod
+    def from_json(line: str) -> 'PlanEntry':
+        """
+        :param line: line of a plan
+        :return: parsed entry
+        :raises PlanException: if the line is not a valid entry
+        """
+        try:
+            record = json.loads(line)
+            return PlanEntry(source=record['source'],
+                             output=record['output'],
+                             corner=Corner(record['corner']),
+                             watermark_type=WatermarkType[record['watermark_type'].upper()],
+                             image_size=tuple(record.get('image_size', (0, 0))),
+                             watermark_size=tuple(record.get('watermark_size', (0, 0))),
+                             statistics=statistics_from_json(record.get('statistics', {})),
+                             output_format=record.get('output_format'))
+        except json.JSONDecodeError as err:
+            raise PlanException(f"Invalid JSON: {err}") from None
+        except (KeyError, TypeError, AttributeError) as err:
+            raise PlanException(f"Missing or invalid field: {err}") from None
+        except ValueError as err:
+            raise PlanException(str(err)) from None
+
+
+def write_plan_entries(file: TextIO, entries: Iterable[PlanEntry]) -> int:
+    """
+    Writes entries as they are produced, each line is flushed so an interrupted plan is still usable
+
+    :param file: text file opened for writing
+    :param entries: decisions to write
+    :return: number of written entries
+    """
+    count = 0
+    for entry in entries:
+        file.write(entry.to_json() + '\n')
+        file.flush()
+        count += 1
+    return count
+
+
+def read_plan(filepath: str) -> list[PlanEntry]:
+    """
+    Reads and validates a whole plan, empty lines are ignored
+
+    :param filepath: path to the plan
+    :return: entries in the order of the plan
+    :raises PlanException: if a line is not a valid entry, the message contains the line number
+    """
+    with open(filepath, encoding='utf-8') as file:
+        return list(_parse_lines(file, filepath))
+
+
+def _parse_lines(lines: Iterable[str], filepath: str) -> Iterator[PlanEntry]:
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield PlanEntry.from_json(line)
+        except PlanException as err:
+            raise PlanException(f"{filepath}:{number}: {err}") from None
+
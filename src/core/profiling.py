@@ -0,0 +1,161 @@
+import io
+import json
+import os.path
+import pstats
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class StageTimer:
+    """
+    Measures wall-clock time of stages of processing a single file
+    """
+
+    def __init__(self):
+        self.durations: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measures the time spent in the with block, repeated stages are summed
+
+        :param name: name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+
+class _StatsSnapshot:
+    """
+    Raw cProfile statistics in the form accepted by :class:`pstats.Stats`
+    """
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class RunProfile:
+    """
+    Per-file and aggregate timings of stages of a processing run,
+    optionally with cProfile statistics of a sample of files
+    """
+
+    def __init__(self):
+        self.files: list[dict] = []
+        self.wall_time = 0.0
+        self.counters: dict[str, float] = {}
+        self._stage_durations: dict[str, list[float]] = defaultdict(list)
+        self._cprofile_stats: Optional[pstats.Stats] = None
+
+    def add_file(self, filepath: str, durations: dict[str, float],
+                 input_size: int = 0, output_size: int = 0) -> None:
+        """
+        Records timings of a processed file
+
+        :param filepath: path to the file
+        :param durations: time spent in every stage in seconds
+        :param input_size: size of the original file in bytes
+        :param output_size: size of the processed file in bytes
+        """
+        self.files.append({'file': filepath, 'stages': durations, 'total': sum(durations.values()),
+                           'input_size': input_size, 'output_size': output_size})
+        for stage, duration in durations.items():
+            self._stage_durations[stage].append(duration)
+        self._stage_durations['total'].append(sum(durations.values()))
+
+    def add_cprofile_stats(self, stats: dict) -> None:
+        """
+        Adds cProfile statistics of a sampled file
+
+        :param stats: raw statistics, the stats attribute of :class:`cProfile.Profile` after create_stats
+        """
+        if self._cprofile_stats is None:
+            self._cprofile_stats = pstats.Stats(_StatsSnapshot(stats))
+        else:
+            self._cprofile_stats.add(_StatsSnapshot(stats))
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Aggregate timings of every stage
+
+        :return: count, total, p50, p95 and max in seconds for every stage
+        """
+        return {stage: {
+            'count': len(durations),
+            'total': sum(durations),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'max': max(durations),
+        } for stage, durations in self._stage_durations.items()}
+
+    def sizes(self) -> dict[str, float]:
+        """
+        Total sizes of original and processed files
+
+        :return: total input and output size in bytes and output / input ratio
+        """
+        input_size = sum(file['input_size'] for file in self.files)
+        output_size = sum(file['output_size'] for file in self.files)
+        return {
+            'input_size': input_size,
+            'output_size': output_size,
+            'ratio': output_size / input_size if input_size else 0.0,
+        }
+
+    def report(self, top_functions: int = 30) -> dict:
+        """
+        Complete profile of the run
+
+        :param top_functions: number of functions with the highest cumulative time included from cProfile
+        :return: JSON serializable report
+        """
+        report = {
+            'wall_time': self.wall_time,
+            'files_processed': len(self.files),
+            'stages': self.summary(),
+            'sizes': self.sizes(),
+            'counters': self.counters,
+            'files': self.files,
+        }
+
+        if self._cprofile_stats is not None:
+            output = io.StringIO()
+            self._cprofile_stats.stream = output
+            self._cprofile_stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_functions)
+            report['cprofile'] = output.getvalue().splitlines()
+
+        return report
+
+    def save(self, filepath: str) -> None:
+        """
+        Saves the report as JSON. If cProfile statistics were collected,
+        they are also saved next to it with .prof extension, for use with pstats or other viewers
+
+        :param filepath: path to the JSON report
+        """
+        with open(filepath, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+        if self._cprofile_stats is not None:
+            self._cprofile_stats.dump_stats(os.path.splitext(filepath)[0] + '.prof')
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Percentile of values using the nearest-rank method
+
+    :param values: non-empty list of values
+    :param percent: [0, 100] percentile to compute
+    :return: smallest value such that at least percent of values are less or equal
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
@@ -0,0 +1,146 @@
+"""
+Deterministic partitioning of a folder between machines processing it at the same time
+
+Every photo belongs to exactly one of COUNT shards, picked by the SHA-256 of its path relative to the processed
+folder, so machines sharing the folder over a network mount take disjoint subsets without a coordinator.
+Each shard saves a summary of its run in the output folder, :func:`merge_shard_summaries` combines them
+into a single report once all machines are done
+"""
+import glob
+import hashlib
+import json
+import os.path
+import socket
+import time
+from typing import NamedTuple
+
+from core.exceptions import ShardException
+from core.profiling import RunProfile
+
+
+class Shard(NamedTuple):
+    """
+    Part of the photos processed by one machine, index is counted from 0
+    """
+    index: int
+    count: int
+
+    @staticmethod
+    def parse(spec: str) -> 'Shard':
+        """
+        :param spec: shard as INDEX/COUNT, eg. 0/4
+        :return: parsed shard
+        :raises ValueError: if the spec is not valid
+        """
+        index, separator, count = spec.partition('/')
+        if not (separator and index.strip().isdigit() and count.strip().isdigit()
+                and 0 <= int(index) < int(count)):
+            raise ValueError(f"Invalid shard {spec}, expected INDEX/COUNT with 0 <= INDEX < COUNT, eg. 0/4")
+        return Shard(int(index), int(count))
+
+    def contains(self, relative_path: str) -> bool:
+        """
+        :param relative_path: path of a photo relative to the processed folder
+        :return: whether the photo belongs to this shard
+        """
+        return shard_index(relative_path, self.count) == self.index
+
+    @property
+    def summary_filename(self) -> str:
+        """
+        Name of the shard's summary file in the output folder
+        """
+        return f'.watermark-shard-{self.index}-of-{self.count}.json'
+
+    @property
+    def manifest_filename(self) -> str:
+        """
+        Name of the shard's manifest in the output folder, see :class:`core.manifest.ProcessingManifest`
+        """
+        return f'.watermark-manifest-{self.index}-of-{self.count}.jsonl'
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.count}'
+
+
+def shard_index(relative_path: str, count: int) -> int:
+    """
+    Shard of a photo, the same on every machine and operating system
+
+    :param relative_path: path of the photo relative to the processed folder
+    :param count: number of shards
+    :return: [0, count) index of the shard
+    """
+    digest = hashlib.sha256(relative_path.replace(os.sep, '/').encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def write_shard_summary(filepath: str, shard: Shard, dir_path: str, profile: RunProfile) -> None:
+    """
+    Saves the summary of a shard's run, with timings of every processed photo so reports can be merged exactly
+
+    :param filepath: path to the summary, overwritten if it exists
+    :param shard: processed shard
+    :param dir_path: processed folder
+    :param profile: profile of the shard's run
+    """
+    report = profile.report()
+    report.pop('cprofile', None)
+    summary = {
+        'shard': {'index': shard.index, 'count': shard.count},
+        'host': socket.gethostname(),
+        'directory': dir_path,
+        'finished': time.time(),
+        'profile': report,
+    }
+    with open(filepath, 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2)
+
+
+def merge_shard_summaries(directory: str) -> dict:
+    """
+    Combines summaries of all shards saved in an output folder into a single run report.
+    Stage timings are aggregated over photos of all shards, wall time is the time of the slowest shard
+
+    :param directory: output folder shared by the shards
+    :return: JSON serializable report in the format of :meth:`core.profiling.RunProfile.report`,
+        with the summary of every shard and the indices of shards that did not save a summary
+    :raises ShardException: if there are no summaries, or they are not valid or come from different partitions
+    """
+    filepaths = sorted(glob.glob(os.path.join(glob.escape(directory), '.watermark-shard-*-of-*.json')))
+    if not filepaths:
+        raise ShardException(f"No shard summaries found in {directory}")
+
+    summaries = {}
+    for filepath in filepaths:
+        try:
+            with open(filepath, encoding='utf-8') as file:
+                summary = json.load(file)
+            shard = Shard(summary['shard']['index'], summary['shard']['count'])
+        except (OSError, json.JSONDecodeError, KeyError, TypeError) as err:
+            raise ShardException(f"Invalid shard summary {filepath}: {err}") from None
+        summaries[shard] = summary
+
+    counts = {shard.count for shard in summaries}
+    if len(counts) > 1:
+        raise ShardException(f"Summaries of different partitions found in {directory}, "
+                             f"shard counts: {', '.join(map(str, sorted(counts)))}")
+    count = counts.pop()
+
+    profile = RunProfile()
+    shards = []
+    for shard, summary in sorted(summaries.items()):
+        report = summary['profile']
+        for file in report['files']:
+            profile.add_file(file['file'], file['stages'], file['input_size'], file['output_size'])
+        for name, value in report['counters'].items():
+            profile.counters[name] = profile.counters.get(name, 0) + value
+        profile.wall_time = max(profile.wall_time, report['wall_time'])
+        shards.append({'index': shard.index, 'host': summary['host'], 'wall_time': report['wall_time'],
+                       'files_processed': report['files_processed'], 'finished': summary['finished']})
+
+    report = profile.report()
+    report['shard_count'] = count
+    report['shards'] = shards
+    report['missing_shards'] = sorted(set(range(count)) - {shard.index for shard in summaries})
+    return report
@@ -0,0 +1,109 @@
+"""
+Processing photos read from and written to byte streams, such as stdin and stdout
+
+A stream holds either a single photo or a sequence of length-prefixed frames.
+Each frame is a 4-byte big-endian unsigned length followed by that many bytes of an image file.
+A framed stream ends at the end of input after a complete frame.
+In the output, an empty frame means that the corresponding input frame could not be processed.
+"""
+import struct
+import sys
+from typing import BinaryIO, Optional, TextIO
+
+from PIL import Image
+
+from core.directory_processors import DirectoryProcessor
+from core.exceptions import FramingException, NotSupportedFileFormatException
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = FRAME_HEADER.unpack(b'\xff' * FRAME_HEADER.size)[0]
+
+
+def read_frame(stream: BinaryIO) -> Optional[bytes]:
+    """
+    Reads a single length-prefixed frame
+
+    :param stream: binary stream positioned at the start of a frame
+    :return: contents of the frame or None at the end of the stream
+    :raises FramingException: if the stream ends in the middle of a frame
+    """
+    header = _read_exactly(stream, FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise FramingException("Stream ended in the middle of a frame header")
+
+    (length,) = FRAME_HEADER.unpack(header)
+    data = _read_exactly(stream, length)
+    if len(data) < length:
+        raise FramingException(f"Stream ended after {len(data)} of {length} bytes of a frame")
+    return data
+
+
+def write_frame(stream: BinaryIO, data: bytes) -> None:
+    """
+    Writes a single length-prefixed frame and flushes the stream
+
+    :param stream: binary stream
+    :param data: contents of the frame
+    :raises FramingException: if data is too long for a single frame
+    """
+    if len(data) > MAX_FRAME_SIZE:
+        raise FramingException(f"Frame can not be longer than {MAX_FRAME_SIZE} bytes")
+    stream.write(FRAME_HEADER.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    # Pipes may return fewer bytes than requested before the end of the stream
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def process_stream(processor: DirectoryProcessor, source: BinaryIO, target: BinaryIO) -> None:
+    """
+    Adds watermark to a single photo, reading the whole source stream
+
+    :param processor: processor with watermarking options
+    :param source: binary stream with the photo's file
+    :param target: binary stream where the watermarked photo is written
+    :raises NotSupportedFileFormatException: if the photo's format is not supported
+    :raises OSError: if the photo could not be decoded
+    """
+    target.write(processor.process_bytes(source.read()))
+    target.flush()
+
+
+def process_framed_stream(processor: DirectoryProcessor, source: BinaryIO, target: BinaryIO,
+                          errors: TextIO = sys.stderr) -> int:
+    """
+    Adds watermark to every photo in a stream of frames, writing one output frame per input frame.
+    Every result is written as soon as it is ready, so the streams can be pipes to a long-lived process
+
+    :param processor: processor with watermarking options
+    :param source: binary stream of frames with photos' files
+    :param target: binary stream where frames with watermarked photos are written
+    :param errors: text stream where photos that could not be processed are reported
+    :return: number of photos that could not be processed
+    :raises FramingException: if the source stream is not a valid sequence of frames
+    """
+    failed = 0
+    index = 0
+    while (data := read_frame(source)) is not None:
+        try:
+            result = processor.process_bytes(data)
+        except (NotSupportedFileFormatException, OSError, Image.DecompressionBombError) as err:
+            print(f"Frame {index}: {err}", file=errors)
+            result = b''
+            failed += 1
+        write_frame(target, result)
+        index += 1
+    return failed
@@ -0,0 +1,68 @@
+"""
+Detecting photos added to a directory while it is being watched
+
+Files are detected by polling, which only needs the standard library and works on every file system,
+including network shares where change notifications are not delivered.
+A file is reported only after its size and modification time stayed the same between polls,
+so photos still being copied are not processed before they are complete.
+"""
+import os.path
+from typing import Callable, Iterable
+
+
+class FolderWatcher:
+    """
+    Reports new and changed files in a directory, once each version of a file is fully written
+    """
+
+    def __init__(self, list_files: Callable[[], Iterable[str]], stable_polls: int = 1):
+        """
+        :param list_files: lists paths to the watched files, eg. :func:`core.directory_processors.scan_files`
+        :param stable_polls: number of consecutive polls a file must stay unchanged for before it is reported
+        :raises ValueError: if stable_polls is negative
+        """
+        if stable_polls < 0:
+            raise ValueError("stable_polls can not be negative")
+
+        self.list_files = list_files
+        self.stable_polls = stable_polls
+
+        # Path -> (size, modification time) and number of polls it stayed unchanged for
+        self._pending: dict[str, tuple[tuple[int, int], int]] = {}
+        # Path -> (size, modification time) of the reported version
+        self._reported: dict[str, tuple[int, int]] = {}
+
+    def poll(self) -> list[str]:
+        """
+        Lists the files once
+
+        :return: sorted paths to files that became ready since the previous poll
+        """
+        seen = {}
+        for filepath in self.list_files():
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+            seen[filepath] = (stat.st_size, stat.st_mtime_ns)
+
+        ready = []
+        for filepath, signature in seen.items():
+            if self._reported.get(filepath) == signature:
+                continue
+
+            previous_signature, unchanged_polls = self._pending.get(filepath, (None, -1))
+            unchanged_polls = unchanged_polls + 1 if previous_signature == signature else 0
+            # Empty files are usually just created, the contents follow
+            if unchanged_polls >= self.stable_polls and signature[0] > 0:
+                ready.append(filepath)
+                self._reported[filepath] = signature
+                self._pending.pop(filepath, None)
+            else:
+                self._pending[filepath] = (signature, unchanged_polls)
+
+        # Forget removed files, so they are reported again if they reappear
+        self._pending = {filepath: state for filepath, state in self._pending.items() if filepath in seen}
+        self._reported = {filepath: state for filepath, state in self._reported.items() if filepath in seen}
+
+        return sorted(ready)
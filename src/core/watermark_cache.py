@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from core.watermarking import prepare_watermark
+
+
+class PreparedWatermarkCache:
+    """
+    Bounded least recently used cache of watermarks prepared with :func:`core.watermarking.prepare_watermark`
+
+    Photos from the same camera share the output size, so scaling and masking
+    the watermark only has to be done once per distinct size.
+    The cache can be shared between threads
+    """
+
+    def __init__(self, max_size: int = 16):
+        """
+        :param max_size: maximum number of prepared watermarks kept in memory
+        :raises ValueError: if max_size is not positive
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be a positive integer")
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._watermarks: OrderedDict[tuple, Image.Image] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self,
+            watermark_filepath: str,
+            watermark: Image.Image,
+            size: tuple[int, int],
+            opacity: float,
+            resample: Image.Resampling = Image.Resampling.NEAREST,
+            use_alpha_channel: bool = False) -> Image.Image:
+        """
+        Returns a prepared watermark, preparing it on a cache miss.
+        Returned image is shared, it must not be modified
+
+        :param watermark_filepath: path identifying the original watermark
+        :param watermark: original watermark, loaded from watermark_filepath
+        :param size: (width, height) of the prepared watermark
+        :param opacity: opacity of the watermark
+        :param resample: resampling filter used for scaling
+        :param use_alpha_channel: use the watermark's alpha channel instead of treating black as transparent
+        :return: prepared RGBA watermark
+        """
+        key = (watermark_filepath, size, opacity, resample, use_alpha_channel)
+
+        with self._lock:
+            prepared = self._watermarks.get(key)
+            if prepared is not None:
+                self.hits += 1
+                self._watermarks.move_to_end(key)
+                return prepared
+
+            self.misses += 1
+            prepared = prepare_watermark(watermark, size, opacity, resample, use_alpha_channel)
+            self._watermarks[key] = prepared
+            if len(self._watermarks) > self.max_size:
+                self._watermarks.popitem(last=False)
+
+            return prepared
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups served from the cache, 0 if there were no lookups
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self) -> None:
+        """
+        Removes all prepared watermarks, counters are preserved
+        """
+        with self._lock:
+            self._watermarks.clear()
+
+    def __getstate__(self) -> dict:
+        """
+        Prepared watermarks and the lock are not copied
+        """
+        state = self.__dict__.copy()
+        state['_watermarks'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._watermarks)
@@ -3,7 +3,8 @@ from enum import Enum
 
 from PIL import Image
 
-from core.watermarking import Corner, cut_corner, avg, average_colors
+from core.corner_analysis import CornerAnalysis, LumaAnalysis
+from core.watermarking import Corner, avg, luma, StatisticsBackend
 
 
 class WatermarkType(Enum):
@@ -19,7 +20,8 @@ class WatermarkPicker(ABC):
 
     """
 
-    def __init__(self, max_width_proportion: float, max_height_proportion: float):
+    def __init__(self, max_width_proportion: float, max_height_proportion: float,
+                 statistics_backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT):
         if not 0 <= max_width_proportion <= 1:
             raise ValueError("width_proportion must be between 0 and 1")
         if not 0 <= max_height_proportion <= 1:
@@ -27,8 +29,8 @@ class WatermarkPicker(ABC):
 
         self.max_height_proportion = max_height_proportion
         self.max_width_proportion = max_width_proportion
+        self.statistics_backend = statistics_backend
 
-    @abstractmethod
     def pick_best_watermark(self, image: Image, corner: Corner) -> WatermarkType:
         """
         Picks the best watermark type to add to an image in a given corner
@@ -37,6 +39,28 @@ class WatermarkPicker(ABC):
         :param corner: corner where watermark will be placed
         :return: best watermark type to add in a given corner to the given image
         """
+        return self.pick_best_watermark_from_analysis(self.analyze(image, corner), corner)
+
+    def analyze(self, image: Image, corner: Corner) -> CornerAnalysis:
+        """
+        Computes statistics of the corner where watermark will be placed
+
+        :param image: image to be watermarked
+        :param corner: corner where watermark will be placed
+        :return: statistics of the corner
+        """
+        return CornerAnalysis(image, [corner], self.max_width_proportion, self.max_height_proportion,
+                              self.statistics_backend)
+
+    @abstractmethod
+    def pick_best_watermark_from_analysis(self, analysis: CornerAnalysis, corner: Corner) -> WatermarkType:
+        """
+        Picks the best watermark type based on already computed statistics
+
+        :param analysis: statistics of the corners, computed with the picker's proportions
+        :param corner: corner where watermark will be placed
+        :return: best watermark type to add in a given corner
+        """
 
 
 class AvgRgbWatermarkPicker(WatermarkPicker):
@@ -44,16 +68,36 @@ class AvgRgbWatermarkPicker(WatermarkPicker):
     Picks the best watermark type based on the average RGB colors value in a given corner
     """
 
-    def __init__(self, max_width_proportion: float, max_height_proportion: float, cutoff_color: int = 150):
+    def __init__(self, max_width_proportion: float, max_height_proportion: float, cutoff_color: int = 150,
+                 statistics_backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT):
         if not 0 <= cutoff_color <= 255:
             raise ValueError("cutoff_color must be a valid RGB color value - integer [0, 255]")
 
-        super().__init__(max_width_proportion, max_height_proportion)
+        super().__init__(max_width_proportion, max_height_proportion, statistics_backend)
         self.cutoff_color = cutoff_color
 
-    def pick_best_watermark(self, image: Image, corner: Corner) -> WatermarkType:
-        corner_img = cut_corner(image, corner, self.max_width_proportion, self.max_height_proportion)
-        avg_color = avg(average_colors(corner_img))
+    def pick_best_watermark_from_analysis(self, analysis: CornerAnalysis, corner: Corner) -> WatermarkType:
+        statistics = analysis.get(corner, self.max_width_proportion, self.max_height_proportion)
+        avg_color = avg(statistics.mean)
 
         best_watermark_type = WatermarkType.DARK if avg_color > self.cutoff_color else WatermarkType.LIGHT
         return best_watermark_type
+
+
+class LumaWatermarkPicker(AvgRgbWatermarkPicker):
+    """
+    Picks the best watermark type based on the average Rec. 709 luma in a given corner,
+    perceived brightness weighs green more than red and blue
+    """
+
+    def analyze(self, image: Image, corner: Corner) -> LumaAnalysis:
+        return LumaAnalysis(image, [corner], self.max_width_proportion, self.max_height_proportion,
+                            self.statistics_backend)
+
+    def pick_best_watermark_from_analysis(self, analysis: CornerAnalysis, corner: Corner) -> WatermarkType:
+        statistics = analysis.get(corner, self.max_width_proportion, self.max_height_proportion)
+        # Luma is linear, so the average luma can also be read from statistics of RGB channels
+        avg_luma = luma(statistics.mean)
+
+        best_watermark_type = WatermarkType.DARK if avg_luma > self.cutoff_color else WatermarkType.LIGHT
+        return best_watermark_type
@@ -3,9 +3,10 @@ Utilities for processing and adding watermarks to images
 
 """
 from enum import Enum
-from math import sqrt
+from math import ceil, sqrt
+from typing import NamedTuple, Optional
 
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
 
 
 class Corner(Enum):
@@ -15,49 +16,127 @@ class Corner(Enum):
     LOWER_RIGHT = 'lower right'
 
 
-def average_colors(image: Image) -> tuple[int, int, int]:
+# Named sets of corners to choose from, as accepted by the command line interface
+CORNER_PRESETS = {
+    'all': [Corner.UPPER_LEFT, Corner.UPPER_RIGHT, Corner.LOWER_LEFT, Corner.LOWER_RIGHT],
+    'top': [Corner.UPPER_LEFT, Corner.UPPER_RIGHT],
+    'bottom': [Corner.LOWER_LEFT, Corner.LOWER_RIGHT],
+    'left': [Corner.UPPER_LEFT, Corner.LOWER_LEFT],
+    'right': [Corner.UPPER_RIGHT, Corner.LOWER_RIGHT],
+    'upper-left': [Corner.UPPER_LEFT],
+    'upper-right': [Corner.UPPER_RIGHT],
+    'bottom-left': [Corner.LOWER_LEFT],
+    'bottom-right': [Corner.LOWER_RIGHT],
+}
+
+
+class StatisticsBackend(Enum):
     """
-    Average colors of an image
+    Implementation used to compute color statistics of an image
 
-    :param image: Image
-    :return: tuple (red, green, blue)
+    PIXEL_LOOP reads every pixel in Python and is kept as a reference implementation,
+    IMAGE_STAT computes the same values from the image histogram in C
     """
-    red, green, blue = 0, 0, 0
-    pixel_count = image.width * image.height
+    PIXEL_LOOP = 'pixel loop'
+    IMAGE_STAT = 'image stat'
 
-    for x in range(image.width):
-        for y in range(image.height):
-            r, g, b = image.getpixel((x, y))
-            red += r
-            green += g
-            blue += b
 
-    return red // pixel_count, green // pixel_count, blue // pixel_count
+class ColorStatistics(NamedTuple):
+    """
+    Per-channel color statistics of an image, one value for each band
+
+    Values follow the definitions of :func:`average_colors` and :func:`colors_stdev`
+    """
+    mean: tuple[int, ...]
+    variance: tuple[float, ...]
+    stdev: tuple[float, ...]
 
 
-def colors_stdev(image: Image) -> tuple[float, float, float]:
+def color_statistics(image: Image.Image,
+                     backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT) -> ColorStatistics:
     """
-    Standard deviations of RGB colors in an image
+    Mean, variance and standard deviation of each channel of an image, computed in a single pass
 
     :param image: image to process
-    :return: standard deviations (red, green, blue)
+    :param backend: implementation used to read the pixels
+    :return: ColorStatistics of the image
+    """
+
+    match backend:
+        case StatisticsBackend.PIXEL_LOOP:
+            sums, squared_sums = _pixel_loop_sums(image)
+        case StatisticsBackend.IMAGE_STAT:
+            stat = ImageStat.Stat(image)
+            sums, squared_sums = stat.sum, stat.sum2
+        case _:
+            raise ValueError(f"Unknown statistics backend: {backend}")
+
+    return statistics_from_sums(sums, squared_sums, image.width * image.height)
+
+
+def statistics_from_sums(sums: list | tuple, squared_sums: list | tuple, pixel_count: int) -> ColorStatistics:
+    """
+    Color statistics of pixels from sums and sums of squares of their values
+
+    :param sums: sum of values of each channel
+    :param squared_sums: sum of squared values of each channel
+    :param pixel_count: number of pixels
+    :return: ColorStatistics of the pixels
+    """
+    mean = tuple(int(total // pixel_count) for total in sums)
+    variance = tuple((squared_total / pixel_count) - avg_value ** 2
+                     for squared_total, avg_value in zip(squared_sums, mean))
+    stdev = tuple(sqrt(max(value, 0)) for value in variance)
+
+    return ColorStatistics(mean=mean, variance=variance, stdev=stdev)
+
+
+def _pixel_loop_sums(image: Image.Image) -> tuple[list[int], list[int]]:
     """
+    Sums and sums of squares of each channel, reading pixels one by one
 
-    avg_red, avg_green, avg_blue = average_colors(image)
-    pixel_count = image.width * image.height
-    red, green, blue = 0, 0, 0
+    :param image: image to process
+    :return: tuple (sums, squared sums)
+    """
+    band_count = len(image.getbands())
+    sums = [0] * band_count
+    squared_sums = [0] * band_count
 
     for x in range(image.width):
         for y in range(image.height):
-            r, g, b = image.getpixel((x, y))
-            red += r ** 2
-            green += g ** 2
-            blue += b ** 2
+            pixel = image.getpixel((x, y))
+            if band_count == 1:
+                pixel = (pixel,)
+            for band, value in enumerate(pixel):
+                sums[band] += value
+                squared_sums[band] += value ** 2
+
+    return sums, squared_sums
 
-    std_red = sqrt((red / pixel_count) - avg_red ** 2)
-    std_green = sqrt((green / pixel_count) - avg_green ** 2)
-    std_blue = sqrt((blue / pixel_count) - avg_blue ** 2)
 
+def average_colors(image: Image,
+                   backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT) -> tuple[int, int, int]:
+    """
+    Average colors of an image
+
+    :param image: Image
+    :param backend: implementation used to read the pixels
+    :return: tuple (red, green, blue)
+    """
+    red, green, blue = color_statistics(image, backend).mean
+    return red, green, blue
+
+
+def colors_stdev(image: Image,
+                 backend: StatisticsBackend = StatisticsBackend.IMAGE_STAT) -> tuple[float, float, float]:
+    """
+    Standard deviations of RGB colors in an image
+
+    :param image: image to process
+    :param backend: implementation used to read the pixels
+    :return: standard deviations (red, green, blue)
+    """
+    std_red, std_green, std_blue = color_statistics(image, backend).stdev
     return std_red, std_green, std_blue
 
 
@@ -71,8 +150,24 @@ def cut_corner(image: Image.Image, corner: Corner, width_proportion: float, heig
     :param height_proportion: float [0.0, 1.0]
     :return: Image object representing the corner
     """
-    width = image.width * width_proportion
-    height = image.height * height_proportion
+    region = image.crop(corner_box(image.size, corner, width_proportion, height_proportion))
+    return region
+
+
+def corner_box(image_size: tuple[int, int], corner: Corner,
+               width_proportion: float, height_proportion: float) -> tuple[int, int, int, int]:
+    """
+    Box of a corner of the image of specified proportions, as cut by :func:`cut_corner`
+
+    :param image_size: (width, height) of the image
+    :param corner: Corner object
+    :param width_proportion: float [0.0, 1.0]
+    :param height_proportion: float [0.0, 1.0]
+    :return: (left, upper, right, lower) box in pixels
+    """
+    image_width, image_height = image_size
+    width = image_width * width_proportion
+    height = image_height * height_proportion
 
     x_start, x_end, y_start, y_end = None, None, None, None
 
@@ -83,83 +178,282 @@ def cut_corner(image: Image.Image, corner: Corner, width_proportion: float, heig
             y_start = 0
             y_end = height
         case Corner.UPPER_RIGHT:
-            x_start = image.width - width
-            x_end = image.width
+            x_start = image_width - width
+            x_end = image_width
             y_start = 0
             y_end = height
         case Corner.LOWER_LEFT:
             x_start = 0
             x_end = width
-            y_start = image.height - height
-            y_end = image.height
+            y_start = image_height - height
+            y_end = image_height
         case Corner.LOWER_RIGHT:
-            x_start = image.width - width
-            x_end = image.width
-            y_start = image.height - height
-            y_end = image.height
+            x_start = image_width - width
+            x_end = image_width
+            y_start = image_height - height
+            y_end = image_height
 
-    region = image.crop((x_start, y_start, x_end, y_end))
-    return region
+    # Rounded the same way as Image.crop rounds the box
+    return round(x_start), round(y_start), round(x_end), round(y_end)
+
+
+def reduce_for_analysis(image: Image.Image, scale: float, corners: Optional[list[Corner]] = None,
+                        width_proportion: float = 1.0, height_proportion: float = 1.0) -> Image.Image:
+    """
+    Returns a downscaled image for computing coarse statistics.
+    JPEG images that were not loaded yet are decoded at reduced size using DCT scaling,
+    which modifies the passed image object; other images are reduced after decoding.
+    Images in modes that can not be reduced are converted with :func:`normalize_mode` first
+
+    :param image: image to reduce, preferably just opened
+    :param scale: (0.0, 1.0] target size / original size ratio
+    :param corners: only reduce these corners, the rest of the returned image is black.
+        Their pixels are the same as in the whole reduced image
+    :param width_proportion: [0.0, 1.0] corner / image width ratio
+    :param height_proportion: [0.0, 1.0] corner / image height ratio
+    :return: image at least scale times the original size
+    :raises ValueError: if scale is not in (0.0, 1.0]
+    """
+    if not 0 < scale <= 1:
+        raise ValueError("scale must be greater than 0 and at most 1")
+
+    requested_size = (max(1, ceil(image.width * scale)), max(1, ceil(image.height * scale)))
+    image.draft(image.mode, requested_size)
+    if image.mode in ('1', 'P') or image.mode.startswith('I;16'):
+        # Pillow can not reduce images in these modes
+        image = normalize_mode(image)
+
+    factor = min(image.width // requested_size[0], image.height // requested_size[1])
+    if factor == 1:
+        return image
+    if corners is None:
+        return image.reduce(factor)
+
+    reduced = Image.new(image.mode, (ceil(image.width / factor), ceil(image.height / factor)))
+    for corner in set(corners):
+        left, upper, right, lower = corner_box(reduced.size, corner, width_proportion, height_proportion)
+        # Cells of reduce() are aligned to the box, the last cells of the image are partial in both cases
+        box = (left * factor, upper * factor, min(right * factor, image.width), min(lower * factor, image.height))
+        reduced.paste(image.reduce(factor, box=box), (left, upper))
+    return reduced
 
 
 def avg(numbers: tuple | list) -> float:
     return sum(numbers) / len(numbers)
 
 
-def add_watermark(image: Image, corner: Corner, watermark: Image,
-                  max_width_proportion: float, max_height_proportion: float, opacity: float) -> Image:
+# Rec. 709 weights of red, green and blue in perceived brightness, as a conversion matrix to 'L' mode
+REC_709_LUMA = (0.2126, 0.7152, 0.0722, 0)
+
+
+def to_luma(image: Image.Image) -> Image.Image:
     """
-    Returns a new image with watermark added in specified corner
+    Perceived brightness of an image as a single channel, using Rec. 709 weights
 
-    :param image: original image
-    :param corner: corner where watermark is added
-    :param watermark: watermark to add
+    :param image: image to convert, images in other modes than RGB and L are converted with :func:`normalize_mode`
+    :return: 'L' image, the original image if it already is an 'L' image
+    """
+    if image.mode == 'L':
+        return image
+    if image.mode != 'RGB':
+        image = normalize_mode(image)
+    return image.convert('L', matrix=REC_709_LUMA)
+
+
+def luma(values: tuple | list) -> float:
+    """
+    Rec. 709 luma of a color
+
+    :param values: (red, green, blue) values, or a single luma value
+    :return: luma value
+    """
+    if len(values) == 1:
+        return values[0]
+    red, green, blue = values[:3]
+    return REC_709_LUMA[0] * red + REC_709_LUMA[1] * green + REC_709_LUMA[2] * blue
+
+
+def watermark_size(image_size: tuple[int, int], watermark_size: tuple[int, int],
+                   max_width_proportion: float, max_height_proportion: float) -> tuple[int, int]:
+    """
+    Size of the watermark scaled to fit in the image, keeping its aspect ratio
+
+    :param image_size: (width, height) of the image
+    :param watermark_size: (width, height) of the original watermark
     :param max_width_proportion: [0, 1] maximum watermark / image width ratio
     :param max_height_proportion: [0, 1] maximum watermark / image height ratio
-    :param opacity: opacity of the watermark
-    :return: new image with watermark
+    :return: (width, height) of the scaled watermark
     """
+    image_width, image_height = image_size
+    original_width, original_height = watermark_size
 
-    max_width = image.width * max_width_proportion
-    max_height = image.height * max_height_proportion
+    max_width = image_width * max_width_proportion
+    max_height = image_height * max_height_proportion
 
     scale = 1
-    if max_height / max_width < watermark.height / watermark.width:
-        scale = max_height / watermark.height
+    if max_height / max_width < original_height / original_width:
+        scale = max_height / original_height
     else:
-        scale = max_width / watermark.width
+        scale = max_width / original_width
 
-    watermark_width = int(watermark.width * scale)
-    watermark_height = int(watermark.height * scale)
-    watermark = watermark.resize((watermark_width, watermark_height), resample=Image.Resampling.NEAREST)
-    # TODO: compare different filters
+    return int(original_width * scale), int(original_height * scale)
+
+
+def prepare_watermark(watermark: Image.Image, size: tuple[int, int], opacity: float,
+                      resample: Image.Resampling = Image.Resampling.NEAREST,
+                      use_alpha_channel: bool = False) -> Image.Image:
+    """
+    Returns a new watermark scaled to size with opacity applied, ready to be pasted
+
+    By default black pixels of the watermark are treated as the background and left fully transparent.
+    With use_alpha_channel, the watermark's own alpha channel is scaled by opacity instead,
+    watermarks without an alpha channel fall back to the default behaviour.
 
+    :param watermark: original watermark
+    :param size: (width, height) of the prepared watermark
+    :param opacity: opacity of the watermark
+    :param resample: resampling filter used for scaling
+    :param use_alpha_channel: use the watermark's alpha channel instead of treating black as transparent
+    :return: new RGBA watermark
+    """
     alpha = int(255 * opacity)
+
+    if use_alpha_channel and has_alpha_channel(watermark):
+        watermark = watermark.convert('RGBA').resize(size, resample=resample)
+        scaled_alpha = watermark.getchannel('A').point(lambda value: value * alpha // 255)
+        watermark.putalpha(scaled_alpha)
+        return watermark
+
+    watermark = watermark.resize(size, resample=resample)
+    # TODO: compare different filters
+
     watermark.putalpha(alpha)
 
     # leave the blank pixels at 100% transparency
-    transparent_watermark = []
-    for item in watermark.getdata():
-        if item[:3] == (0, 0, 0):
-            transparent_watermark.append((0, 0, 0, 0))
-        else:
-            transparent_watermark.append(item)
-    watermark.putdata(transparent_watermark)
+    if watermark.mode == 'RGBA':
+        red, green, blue, _ = watermark.split()
+        brightest = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+        watermark.putalpha(brightest.point(lambda value: alpha if value else 0))
+
+    return watermark
+
+
+def has_alpha_channel(image: Image.Image) -> bool:
+    """
+    Checks if an image carries its own transparency information
+
+    :param image: image to check
+    :return: True if image has an alpha channel or a transparent palette entry
+    """
+    return image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in image.info
+
+
+def watermark_position(image_size: tuple[int, int], watermark_size: tuple[int, int],
+                       corner: Corner) -> tuple[int, int]:
+    """
+    Position of the upper left corner of a watermark placed in a corner of the image
+
+    :param image_size: (width, height) of the image
+    :param watermark_size: (width, height) of the prepared watermark
+    :param corner: corner where watermark is placed
+    :return: (x, y) position
+    """
+    image_width, image_height = image_size
+    width, height = watermark_size
 
     box = None  # upper left corner
     match corner:
         case Corner.UPPER_LEFT:
             box = (0, 0)
         case Corner.UPPER_RIGHT:
-            box = (image.width - watermark.width, 0)
+            box = (image_width - width, 0)
         case Corner.LOWER_LEFT:
-            box = (0, image.height - watermark.height)
+            box = (0, image_height - height)
         case Corner.LOWER_RIGHT:
-            box = (image.width - watermark.width, image.height - watermark.height)
+            box = (image_width - width, image_height - height)
 
-    image_with_watermark = Image.new(mode='RGBA', size=image.size, color=(0, 0, 0, 0))
-    image_with_watermark.paste(image, (0, 0))
-    image_with_watermark.paste(watermark, box, watermark)
-    image_with_watermark = image_with_watermark.convert('RGB')
+    return box
 
+
+def paste_watermark(image: Image.Image, corner: Corner, watermark: Image.Image,
+                    in_place: bool = False, keep_alpha: bool = False) -> Image.Image:
+    """
+    Returns an RGB image with an already prepared watermark added in specified corner.
+    Only the region covered by the watermark is blended
+
+    :param image: original image
+    :param corner: corner where watermark is added
+    :param watermark: watermark prepared with :func:`prepare_watermark`
+    :param in_place: paste into the original image instead of a copy, requires an RGB image
+        or an RGBA image if keep_alpha is set
+    :param keep_alpha: return an RGBA image if the original is an RGBA image, composited over its transparency
+    :return: image with watermark, the original image if in_place is set
+    :raises ValueError: if in_place is set and the image is not in the resulting mode
+    """
+    box = watermark_position(image.size, watermark.size, corner)
+    mode = 'RGBA' if keep_alpha and image.mode == 'RGBA' else 'RGB'
+
+    if in_place:
+        if image.mode != mode:
+            raise ValueError("Watermark can only be pasted in place into an RGB image, "
+                             "or an RGBA image if alpha is kept")
+        image_with_watermark = image
+    else:
+        image_with_watermark = image.convert(mode)
+
+    if mode == 'RGBA':
+        image_with_watermark.alpha_composite(watermark, box)
+    else:
+        image_with_watermark.paste(watermark, box, watermark)
     return image_with_watermark
+
+
+def normalize_mode(image: Image.Image, keep_alpha: bool = False) -> Image.Image:
+    """
+    Converts a decoded photo to the mode watermarks are added in.
+    Transparent photos become RGBA images if keep_alpha is set, otherwise they are flattened onto white.
+    16-bit grayscale photos are scaled to 8 bits, other photos are converted to RGB
+
+    :param image: decoded photo in any mode
+    :param keep_alpha: keep transparency of the photo
+    :return: RGB or RGBA image, the original image if it already has the right mode
+    """
+    if image.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N'):
+        image = image.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA', 'La', 'RGBa') \
+        or image.mode in ('P', 'L', 'RGB') and 'transparency' in image.info
+    if not has_alpha:
+        return image if image.mode == 'RGB' else image.convert('RGB')
+
+    rgba_image = image if image.mode == 'RGBA' else image.convert('RGBA')
+    if keep_alpha:
+        return rgba_image
+
+    flattened = Image.new('RGB', image.size, 'white')
+    flattened.paste(rgba_image, mask=rgba_image.getchannel('A'))
+    return flattened
+
+
+def add_watermark(image: Image, corner: Corner, watermark: Image,
+                  max_width_proportion: float, max_height_proportion: float, opacity: float,
+                  resample: Image.Resampling = Image.Resampling.NEAREST,
+                  use_alpha_channel: bool = False, in_place: bool = False) -> Image:
+    """
+    Returns a new image with watermark added in specified corner
+
+    :param image: original image
+    :param corner: corner where watermark is added
+    :param watermark: watermark to add
+    :param max_width_proportion: [0, 1] maximum watermark / image width ratio
+    :param max_height_proportion: [0, 1] maximum watermark / image height ratio
+    :param opacity: opacity of the watermark
+    :param resample: resampling filter used for scaling the watermark
+    :param use_alpha_channel: use the watermark's alpha channel instead of treating black as transparent
+    :param in_place: add the watermark to the original image instead of a copy, requires an RGB image
+    :return: new image with watermark, the original image if in_place is set
+    """
+
+    size = watermark_size(image.size, watermark.size, max_width_proportion, max_height_proportion)
+    watermark = prepare_watermark(watermark, size, opacity, resample, use_alpha_channel)
+    return paste_watermark(image, corner, watermark, in_place)
@@ -0,0 +1,104 @@
+"""HTTP service for adding watermarks
+
+Keeps watermarks loaded and adds them to photos sent over HTTP, avoiding startup costs of the CLI for every photo.
+Listens on localhost only by default.
+
+POST /watermark with the photo as the request body returns the watermarked photo.
+Optional query parameters corners, width, height and opacity override the defaults given on the command line,
+eg. curl --data-binary @photo.jpg "http://127.0.0.1:8080/watermark?corners=bottom&opacity=0.3" -o watermarked.jpg
+GET /health returns request counters, latencies and watermark cache statistics as JSON.
+"""
+
+import argparse
+import os
+import sys
+
+from core.encoding import OUTPUT_FORMATS
+from core.http_service import DEFAULT_HOST, DEFAULT_PORT, WatermarkServer, WatermarkService
+from core.watermarking import CORNER_PRESETS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--host',
+                        dest='host',
+                        default=DEFAULT_HOST,
+                        help='Address to listen on',
+                        type=str)
+    parser.add_argument('-p', '--port',
+                        dest='port',
+                        default=DEFAULT_PORT,
+                        help='Port to listen on',
+                        type=int)
+    parser.add_argument('-w', '--workers',
+                        dest='workers',
+                        default=os.cpu_count(),
+                        help='Number of requests processed concurrently',
+                        type=int)
+    parser.add_argument('--width',
+                        dest='width',
+                        default=0.15,
+                        help='[0.0, 1.0] Default max watermark to image width ratio',
+                        type=float)
+    parser.add_argument('--height',
+                        dest='height',
+                        default=0.15,
+                        help='[0.0, 1.0] Default max watermark to image height ratio',
+                        type=float)
+    parser.add_argument('-o', '--opacity',
+                        dest='opacity',
+                        default=0.5,
+                        help='[0.0, 1.0] Default watermark opacity (0 - transparent, 1 - opaque)',
+                        type=float)
+    parser.add_argument('-c', '--corners',
+                        dest='corners',
+                        default='top',
+                        type=str,
+                        choices=list(CORNER_PRESETS))
+    parser.add_argument('--format',
+                        dest='output_format',
+                        default='jpeg',
+                        help='Format of watermarked photos',
+                        choices=list(OUTPUT_FORMATS))
+    parser.add_argument('--luma',
+                        dest='luma_analysis',
+                        action='store_true',
+                        help='Pick the corner and watermark from perceived brightness instead of RGB colors')
+    parser.add_argument('--max-body-size',
+                        dest='max_body_size',
+                        default=64,
+                        help='Maximum size of a photo in megabytes',
+                        type=int)
+    parser.add_argument('--quiet',
+                        dest='quiet',
+                        action='store_true',
+                        help='Do not log requests')
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        print('Number of workers must be positive')
+        sys.exit()
+
+    try:
+        service = WatermarkService(corners=args.corners, width=args.width, height=args.height,
+                                   opacity=args.opacity, max_body_size=args.max_body_size * 1024 * 1024,
+                                   output_format=args.output_format, luma_analysis=args.luma_analysis)
+    except ValueError as err:
+        print(err)
+        sys.exit()
+
+    server = WatermarkServer(service, args.host, args.port, args.workers, args.quiet)
+    host, port = server.server_address[:2]
+    print(f'Listening on http://{host}:{port} with {args.workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
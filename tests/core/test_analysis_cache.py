@@ -0,0 +1,54 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+
+from core.analysis_cache import AnalysisCache, AnalysisRecord, content_sha256
+from core.manifest import file_sha256
+from core.watermark_pickers import WatermarkType
+from core.watermarking import ColorStatistics, Corner
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestAnalysisCache(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, AnalysisCache.FILENAME)
+        self.record = AnalysisRecord(Corner.LOWER_LEFT, WatermarkType.DARK, {
+            Corner.LOWER_LEFT: ColorStatistics((200, 201, 202), (1.0, 2.0, 3.0), (1.0, 1.5, 1.75)),
+            Corner.UPPER_LEFT: ColorStatistics((10,), (4.0,), (2.0,)),
+        })
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_put_and_get(self):
+        cache = AnalysisCache(self.filepath, {'corners': ['lower left']})
+        self.assertIsNone(cache.get('hash'))
+        cache.put('hash', self.record)
+        self.assertEqual(cache.get('hash'), self.record)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.close()
+
+        reopened = AnalysisCache(self.filepath, {'corners': ['lower left']})
+        self.assertEqual(reopened.get('hash'), self.record, "Should persist records")
+        other_parameters = AnalysisCache(self.filepath, {'corners': ['upper left']})
+        self.assertIsNone(other_parameters.get('hash'), "Should not use records of other parameters")
+        reopened.close()
+        other_parameters.close()
+
+    def test_pickle(self):
+        cache = AnalysisCache(self.filepath, {})
+        cache.put('hash', self.record)
+
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copy.get('hash'), self.record, "Copy should open its own connection")
+        cache.close()
+        copy.close()
+
+    def test_content_sha256(self):
+        filepath = os.path.join(SAMPLE_PHOTOS_DIR, 'white.jpg')
+        with open(filepath, 'rb') as file:
+            self.assertEqual(content_sha256(file.read()), file_sha256(filepath))
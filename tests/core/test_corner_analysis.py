@@ -0,0 +1,63 @@
+import os
+from unittest import TestCase
+
+from PIL import Image
+
+from core.corner_analysis import CornerAnalysis, LumaAnalysis
+from core.corner_pickers import RgbStdevCornerPicker
+from core.watermark_pickers import AvgRgbWatermarkPicker
+from core.watermarking import Corner, cut_corner, average_colors, colors_stdev, color_statistics, to_luma
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestCornerAnalysis(TestCase):
+
+    def setUp(self) -> None:
+        self.left_dark_right_light = Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'left-dark-right-light.jpg'))
+
+    def tearDown(self) -> None:
+        self.left_dark_right_light.close()
+
+    def test_statistics_match_corner_functions(self):
+        analysis = CornerAnalysis(self.left_dark_right_light, list(Corner), 0.15, 0.15)
+
+        self.assertEqual(analysis.corners, list(Corner), "Should analyse all requested corners")
+        for corner in Corner:
+            region = cut_corner(self.left_dark_right_light, corner, 0.15, 0.15)
+            statistics = analysis.get(corner, 0.15, 0.15)
+            self.assertEqual(statistics.mean, average_colors(region), "Mean should match average_colors")
+            self.assertEqual(statistics.stdev, colors_stdev(region), "Stdev should match colors_stdev")
+
+    def test_luma_statistics(self):
+        analysis = LumaAnalysis(self.left_dark_right_light, list(Corner), 0.15, 0.15)
+
+        for corner in Corner:
+            region = to_luma(cut_corner(self.left_dark_right_light, corner, 0.15, 0.15))
+            self.assertEqual(analysis.get(corner, 0.15, 0.15), color_statistics(region))
+            self.assertEqual(len(analysis.get(corner, 0.15, 0.15).mean), 1, "Should analyse a single channel")
+
+        red = Image.new('RGB', (10, 10), (255, 0, 0))
+        self.assertEqual(LumaAnalysis(red, [Corner.UPPER_LEFT], 0.5, 0.5).get(Corner.UPPER_LEFT, 0.5, 0.5).mean,
+                         (54,), "Should use Rec. 709 weights")
+
+    def test_shared_between_pickers(self):
+        corner_picker = RgbStdevCornerPicker([Corner.UPPER_LEFT, Corner.UPPER_RIGHT], 0.15, 0.15)
+        watermark_picker = AvgRgbWatermarkPicker(0.15, 0.15)
+
+        analysis = corner_picker.analyze(self.left_dark_right_light)
+        corner = corner_picker.pick_best_corner_from_analysis(analysis)
+
+        self.assertEqual(corner, corner_picker.pick_best_corner(self.left_dark_right_light),
+                         "Should pick the same corner as without shared analysis")
+        self.assertEqual(watermark_picker.pick_best_watermark_from_analysis(analysis, corner),
+                         watermark_picker.pick_best_watermark(self.left_dark_right_light, corner),
+                         "Should pick the same watermark as without shared analysis")
+
+    def test_raises_exception_on_mismatch(self):
+        analysis = CornerAnalysis(self.left_dark_right_light, [Corner.UPPER_LEFT], 0.15, 0.15)
+
+        with self.assertRaisesRegex(ValueError, "different proportions"):
+            analysis.get(Corner.UPPER_LEFT, 0.1, 0.15)
+
+        with self.assertRaisesRegex(ValueError, "was not analysed"):
+            analysis.get(Corner.LOWER_LEFT, 0.15, 0.15)
@@ -3,7 +3,7 @@ from unittest import TestCase
 
 from PIL import Image
 
-from core.corner_pickers import RgbStdevCornerPicker
+from core.corner_pickers import RgbStdevCornerPicker, LumaStdevCornerPicker, PyramidCornerPicker
 from core.watermarking import Corner
 from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
 
@@ -47,3 +47,75 @@ class TestRgbStdevCornerPicker(TestCase):
     def test_raises_exception_with_no_corners(self):
         with self.assertRaisesRegex(ValueError, "Must provide at least one corner"):
             RgbStdevCornerPicker([], 0.1, 0.1)
+
+
+class TestLumaStdevCornerPicker(TestCase):
+
+    def test_pick_best_corner(self):
+        picker = LumaStdevCornerPicker([Corner.UPPER_LEFT, Corner.LOWER_LEFT], 0.15, 0.15)
+
+        for filename, expected in [('bottom-uniform-light.jpg', Corner.LOWER_LEFT),
+                                   ('top-uniform-light.jpg', Corner.UPPER_LEFT)]:
+            with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, filename)) as image:
+                analysis = picker.analyze(image)
+                self.assertEqual(len(analysis.get(expected, 0.15, 0.15).stdev), 1, "Should analyse a single channel")
+                self.assertEqual(picker.pick_best_corner_from_analysis(analysis), expected, filename)
+
+    def test_ignores_differences_in_imperceptible_colors(self):
+        image = Image.new('RGB', (100, 100), (0, 128, 0))
+        # Strong blue stripes change perceived brightness less than weaker red stripes
+        for x in range(0, 100, 2):
+            image.paste((0, 128, 120), (x, 0, x + 1, 50))
+            image.paste((60, 128, 0), (x, 50, x + 1, 100))
+
+        self.assertEqual(RgbStdevCornerPicker([Corner.UPPER_LEFT, Corner.LOWER_LEFT], 0.5, 0.5)
+                         .pick_best_corner(image), Corner.LOWER_LEFT)
+        self.assertEqual(LumaStdevCornerPicker([Corner.UPPER_LEFT, Corner.LOWER_LEFT], 0.5, 0.5)
+                         .pick_best_corner(image), Corner.UPPER_LEFT)
+
+
+class TestPyramidCornerPicker(TestCase):
+
+    def setUp(self) -> None:
+        with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'bottom-uniform-light.jpg')) as image:
+            self.bottom_uniform = image.resize((image.width * 4, image.height * 4))
+
+    def test_agrees_with_rgb_stdev_picker(self):
+        for filename in sorted(os.listdir(SAMPLE_PHOTOS_DIR)):
+            if not filename.endswith('.jpg'):
+                continue
+            with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, filename)) as image:
+                for corners in ([Corner.UPPER_LEFT, Corner.LOWER_LEFT], list(Corner)):
+                    self.assertEqual(PyramidCornerPicker(corners, 0.15, 0.15).pick_best_corner(image),
+                                     RgbStdevCornerPicker(corners, 0.15, 0.15).pick_best_corner(image), filename)
+
+    def test_refines_only_contenders(self):
+        picker = PyramidCornerPicker(list(Corner), 0.15, 0.15, coarse_factor=16)
+        analysis = picker.analyze(self.bottom_uniform)
+
+        self.assertEqual(analysis.factors[Corner.UPPER_LEFT], 16, "Should rank corners at the coarsest resolution")
+        self.assertEqual(analysis.contenders, [Corner.LOWER_LEFT], "No corner can beat a uniform one")
+        self.assertEqual(analysis.factors[Corner.LOWER_RIGHT], 16, "Should not read the tied corner again")
+        self.assertEqual(picker.pick_best_corner_from_analysis(analysis), Corner.LOWER_LEFT)
+
+        top = [Corner.UPPER_LEFT, Corner.UPPER_RIGHT]
+        analysis = PyramidCornerPicker(top, 0.15, 0.15, min_difference=0).analyze(self.bottom_uniform)
+        self.assertEqual(set(analysis.factors.values()), {1}, "Should refine close scores to full resolution")
+        self.assertEqual(analysis.statistics, RgbStdevCornerPicker(top, 0.15, 0.15).analyze(self.bottom_uniform)
+                         .statistics, "Should be exact at full resolution")
+
+    def test_resolves_near_ties_at_full_resolution(self):
+        image = Image.new('RGB', (2000, 2000), (128, 128, 128))
+        checkerboard = bytes(138 if (x + y) % 2 else 118 for y in range(300) for x in range(300))
+        image.paste(Image.frombytes('L', (300, 300), checkerboard).convert('RGB'), (0, 0))
+
+        expected = RgbStdevCornerPicker(list(Corner), 0.15, 0.15).pick_best_corner(image)
+        self.assertNotEqual(expected, Corner.UPPER_LEFT)
+        self.assertEqual(PyramidCornerPicker(list(Corner), 0.15, 0.15).pick_best_corner(image), expected,
+                         "Texture averaged away at coarse resolution should not decide the corner")
+
+    def test_raises_exception_with_invalid_parameters(self):
+        with self.assertRaisesRegex(ValueError, "coarse_factor"):
+            PyramidCornerPicker(list(Corner), 0.15, 0.15, coarse_factor=0)
+        with self.assertRaisesRegex(ValueError, "tolerance"):
+            PyramidCornerPicker(list(Corner), 0.15, 0.15, tolerance=-1)
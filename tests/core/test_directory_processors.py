@@ -1,12 +1,23 @@
+import io
 import os.path
 import shutil
 import tempfile
-from unittest import TestCase
+import threading
+import time
+from contextlib import redirect_stdout
+from unittest import TestCase, mock
 
 from PIL import Image
 
-from core.directory_processors import DirectoryProcessor
-from core.exceptions import NotSupportedFileFormatException
+from core.analysis_cache import AnalysisCache
+from core.corner_pickers import LumaStdevCornerPicker, PyramidCornerPicker
+from core.directory_processors import DirectoryProcessor, scan_files
+from core.exceptions import NotSupportedFileFormatException, PlanException
+from core.manifest import ProcessingManifest
+from core.plan import read_plan
+from core.sharding import Shard, merge_shard_summaries
+from core.watermark_pickers import LumaWatermarkPicker, WatermarkType
+from core.watermarking import Corner
 from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
 
 
@@ -23,7 +34,7 @@ class TestDirectoryProcessor(TestCase):
 
         shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "white.jpg"), self.photos_dir)
         shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "black.jpg"), self.photos_dir)
-        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "illegal-format.png"), self.photos_dir)
+        Image.new('RGB', (64, 48)).save(os.path.join(self.photos_dir, "illegal-format.gif"))
         shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "bottom-uniform-light.jpg"), self.photos_dir)
         shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "left-dark-right-light.jpg"), self.photos_dir)
         shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "left-uniform-dark.jpg"), self.photos_dir)
@@ -58,13 +69,65 @@ class TestDirectoryProcessor(TestCase):
         original_white.close()
         watermarked_white.close()
 
-    def test_process_single_file_png(self):
-        filepath_illegal = os.path.join(self.photos_dir, "illegal-format.png")
+    def test_process_single_file_gif(self):
+        filepath_illegal = os.path.join(self.photos_dir, "illegal-format.gif")
 
         with self.assertRaisesRegex(NotSupportedFileFormatException, "Supported file formats are"):
             self.processor.process_single_file(filepath_illegal, self.output_dir,
                                                "Should raise exception on illegal file format")
 
+    def test_process_single_file_other_formats(self):
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "illegal-format.png"), self.photos_dir)
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "white.jpg"), os.path.join(self.photos_dir, "CAMERA.JPG"))
+        with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, "left-dark-right-light.jpg")) as image:
+            image.save(os.path.join(self.photos_dir, "scan.tiff"))
+            image.convert('L').save(os.path.join(self.photos_dir, "gray.webp"), lossless=True)
+            # The format is detected from the contents, not the extension
+            image.save(os.path.join(self.photos_dir, "renamed.png"), format='JPEG')
+        Image.new('RGBA', (300, 200), (0, 0, 0, 0)).save(os.path.join(self.photos_dir, "transparent.png"))
+
+        with redirect_stdout(io.StringIO()):
+            for filename in ("illegal-format.png", "CAMERA.JPG", "scan.tiff", "gray.webp", "renamed.png",
+                             "transparent.png"):
+                self.processor.process_single_file(os.path.join(self.photos_dir, filename), self.output_dir)
+
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+                         ["CAMERA_watermark.JPG", "gray_watermark.jpg", "illegal-format_watermark.jpg",
+                          "renamed_watermark.jpg", "scan_watermark.jpg", "transparent_watermark.jpg"],
+                         "Should keep the extension of JPEG files and save other photos as .jpg")
+        for filename in os.listdir(self.output_dir):
+            with Image.open(os.path.join(self.output_dir, filename)) as watermarked:
+                self.assertEqual((watermarked.format, watermarked.mode), ('JPEG', 'RGB'))
+
+        with Image.open(os.path.join(self.output_dir, "transparent_watermark.jpg")) as watermarked:
+            self.assertEqual(watermarked.getpixel((150, 100)), (255, 255, 255),
+                             "Transparent pixels should be flattened onto white")
+
+        # A GIF renamed to a supported extension is rejected after reading its header
+        Image.new('RGB', (64, 48)).save(os.path.join(self.photos_dir, "animation.jpg"), format='GIF')
+        with self.assertRaisesRegex(NotSupportedFileFormatException, "GIF images are not supported"):
+            self.processor.process_single_file(os.path.join(self.photos_dir, "animation.jpg"), self.output_dir)
+
+    def test_process_single_file_webp_output(self):
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       output_format='webp', quality=80)
+        Image.new('RGBA', (300, 200), (0, 0, 0, 0)).save(os.path.join(self.photos_dir, "transparent.png"))
+
+        with redirect_stdout(io.StringIO()):
+            processor.process_single_file(os.path.join(self.photos_dir, "transparent.png"), self.output_dir)
+            processor.process_single_file(os.path.join(self.photos_dir, "white.jpg"), self.output_dir)
+
+        with Image.open(os.path.join(self.output_dir, "transparent_watermark.webp")) as watermarked:
+            self.assertEqual(watermarked.format, 'WEBP')
+            self.assertEqual(watermarked.mode, 'RGBA', "Should keep transparency")
+            self.assertEqual(watermarked.getpixel((150, 100))[3], 0, "Should only cover the watermark's area")
+        with Image.open(os.path.join(self.output_dir, "white_watermark.webp")) as watermarked:
+            self.assertEqual((watermarked.format, watermarked.mode), ('WEBP', 'RGB'))
+
+        with self.assertRaises(ValueError):
+            DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                               output_format='bmp')
+
     def test_process_directory(self):
         self.assertEqual(len(os.listdir(self.photos_dir)), 8, "Set up correctly")
 
@@ -74,4 +137,435 @@ class TestDirectoryProcessor(TestCase):
 
         watermarked_directory = os.path.join(self.photos_dir, "with-watermark")
         self.assertEqual(len(os.listdir(watermarked_directory)), 7,
-                         "Should process all jpg files and skip the png")
+                         "Should process all jpg files and skip the gif")
+
+    def test_process_directory_reuses_prepared_watermarks(self):
+        self.processor.process_directory(self.photos_dir, self.output_dir)
+
+        cache = self.processor.watermark_cache
+        self.assertEqual(cache.hits + cache.misses, 7, "Should look up a watermark for every photo")
+        self.assertGreater(cache.hits, 0, "Photos of the same size should share prepared watermarks")
+
+    def test_process_directory_in_parallel(self):
+        sequential_dir = os.path.join(self.output_dir, "sequential")
+        parallel_dir = os.path.join(self.output_dir, "parallel")
+
+        self.processor.process_directory(self.photos_dir, sequential_dir)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.processor.process_directory(self.photos_dir, parallel_dir, jobs=2)
+
+        self.assertIn("skipping", output.getvalue(), "Should report skipped files")
+        self.assertEqual(sorted(os.listdir(parallel_dir)), sorted(os.listdir(sequential_dir)),
+                         "Should process the same files")
+        for filename in os.listdir(sequential_dir):
+            with open(os.path.join(sequential_dir, filename), 'rb') as sequential, \
+                    open(os.path.join(parallel_dir, filename), 'rb') as parallel:
+                self.assertEqual(sequential.read(), parallel.read(), f"{filename} should not depend on jobs")
+
+        with self.assertRaisesRegex(ValueError, "must be a positive integer"):
+            self.processor.process_directory(self.photos_dir, parallel_dir, jobs=0)
+
+    def test_process_directory_in_pipeline(self):
+        sequential_dir = os.path.join(self.output_dir, "sequential")
+        pipeline_dir = os.path.join(self.output_dir, "pipeline")
+
+        sequential_output = io.StringIO()
+        with redirect_stdout(sequential_output):
+            self.processor.process_directory(self.photos_dir, sequential_dir)
+        pipeline_output = io.StringIO()
+        with redirect_stdout(pipeline_output):
+            self.processor.process_directory(self.photos_dir, pipeline_dir, threads=2, io_threads=2, queue_size=1)
+
+        self.assertEqual(pipeline_output.getvalue().replace(sequential_dir, pipeline_dir),
+                         sequential_output.getvalue().replace(sequential_dir, pipeline_dir),
+                         "Should report files in the same order")
+        self.assertEqual(sorted(os.listdir(pipeline_dir)), sorted(os.listdir(sequential_dir)),
+                         "Should process the same files")
+        for filename in os.listdir(sequential_dir):
+            with open(os.path.join(sequential_dir, filename), 'rb') as sequential, \
+                    open(os.path.join(pipeline_dir, filename), 'rb') as pipeline:
+                self.assertEqual(sequential.read(), pipeline.read(), f"{filename} should not depend on threads")
+
+        with self.assertRaisesRegex(ValueError, "can not be combined"):
+            self.processor.process_directory(self.photos_dir, pipeline_dir, jobs=2, threads=2)
+
+    def test_process_images(self):
+        filepath = os.path.join(SAMPLE_PHOTOS_DIR, "left-dark-right-light.jpg")
+        with open(filepath, 'rb') as file:
+            data = file.read()
+        expected = self.processor.process_bytes(data)
+
+        with Image.open(filepath) as image:
+            image.load()
+            original = image.tobytes()
+            results = self.processor.process_images([data, io.BytesIO(data), image])
+            self.assertNotIsInstance(results, list, "Should be lazy")
+            results = list(results)
+            self.assertEqual(image.tobytes(), original, "Should not modify the passed image")
+
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertEqual(result.data, expected, "Result should not depend on the type of input")
+            self.assertEqual(result.corner, results[0].corner)
+            self.assertEqual(result.watermark_type, results[0].watermark_type)
+        self.assertIsNone(self.processor.dark_watermark, "Should close watermarks")
+
+        with self.assertRaises(OSError):
+            list(self.processor.process_images([b'not an image']))
+        with self.assertRaises(TypeError):
+            list(self.processor.process_images([42]))
+
+    def test_watch_directory(self):
+        drop_dir = tempfile.mkdtemp()
+        stop = threading.Event()
+        output = io.StringIO()
+
+        def watch():
+            with redirect_stdout(output):
+                self.processor.watch_directory(drop_dir, self.output_dir, interval=0.01, stop=stop)
+
+        watcher_thread = threading.Thread(target=watch)
+        watcher_thread.start()
+        try:
+            shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "white.jpg"), drop_dir)
+            shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "black.jpg"), os.path.join(drop_dir, "CAMERA.JPG"))
+            Image.new('RGB', (64, 48)).save(os.path.join(drop_dir, "illegal-format.gif"))
+            watermarked = os.path.join(self.output_dir, "white_watermark.jpg")
+            watermarked_upper_case = os.path.join(self.output_dir, "CAMERA_watermark.JPG")
+            for _ in range(500):
+                if os.path.exists(watermarked) and os.path.exists(watermarked_upper_case):
+                    break
+                time.sleep(0.01)
+        finally:
+            stop.set()
+            watcher_thread.join()
+
+        self.assertTrue(os.path.exists(watermarked), "Should process photos added while watching")
+        self.assertTrue(os.path.exists(watermarked_upper_case), "Should match extensions ignoring case")
+        self.assertEqual(output.getvalue().count("Added watermark to white.jpg"), 1)
+        self.assertNotIn("illegal-format", output.getvalue(), "Should ignore unsupported files")
+        self.assertIsNone(self.processor.dark_watermark, "Should close watermarks")
+
+        output = io.StringIO()
+        stop.clear()
+        threading.Timer(0.1, stop.set).start()
+        with redirect_stdout(output):
+            self.processor.watch_directory(drop_dir, self.output_dir, interval=0.01, stop=stop)
+        self.assertIn("up to date, skipping", output.getvalue(), "Should skip photos processed before a restart")
+
+        with self.assertRaises(ValueError):
+            self.processor.watch_directory(drop_dir, self.output_dir, interval=0)
+
+    def test_process_directory_with_memory_limit(self):
+        with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, "left-dark-right-light.jpg")) as image:
+            image.convert('L').save(os.path.join(self.photos_dir, "grayscale.jpg"))
+        expected_dir = os.path.join(self.output_dir, "expected")
+        with redirect_stdout(io.StringIO()):
+            self.processor.process_directory(self.photos_dir, expected_dir)
+
+        # Every photo is larger than the limit, so photos are processed one by one with the low-memory path
+        limited = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5, max_memory=1)
+        for name, options in (("sequential", {}), ("parallel", {'jobs': 2}), ("pipeline", {'threads': 2})):
+            limited_dir = os.path.join(self.output_dir, name)
+            with redirect_stdout(io.StringIO()):
+                limited.process_directory(self.photos_dir, limited_dir, **options)
+
+            self.assertEqual(sorted(os.listdir(limited_dir)), sorted(os.listdir(expected_dir)))
+            for filename in os.listdir(expected_dir):
+                with open(os.path.join(expected_dir, filename), 'rb') as expected, \
+                        open(os.path.join(limited_dir, filename), 'rb') as result:
+                    self.assertEqual(expected.read(), result.read(), f"{filename} should not depend on the limit")
+
+        with self.assertRaises(ValueError):
+            DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5, max_memory=0)
+
+    def test_process_directory_skips_decompression_bombs(self):
+        Image.new('RGB', (3000, 1000), (120, 120, 120)).save(os.path.join(self.photos_dir, "panorama.jpg"))
+        limited = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                     max_memory=10 ** 6)
+
+        # Twice the limit is below the panorama and above the sample photos and watermarks
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 500000):
+            for name, options in (("sequential", {}), ("parallel", {'jobs': 2}), ("pipeline", {'threads': 2})):
+                output = io.StringIO()
+                with redirect_stdout(output):
+                    limited.process_directory(self.photos_dir, os.path.join(self.output_dir, name), **options)
+
+                self.assertEqual(len(limited.profile.files), 7, f"{name} should process the other photos")
+                self.assertIn("skipping " + os.path.join(self.photos_dir, "panorama.jpg"), output.getvalue())
+                self.assertNotIn("panorama_watermark.jpg", os.listdir(os.path.join(self.output_dir, name)))
+
+    def test_process_directory_with_analysis_scale(self):
+        processor = DirectoryProcessor(max_width_proportion=0.15,
+                                       max_height_proportion=0.15,
+                                       opacity=0.5,
+                                       analysis_scale=0.25)
+        processor.process_directory(self.photos_dir, self.output_dir)
+        self.assertEqual(len(os.listdir(self.output_dir)), 7, "Should process all jpg files")
+
+        with Image.open(os.path.join(self.output_dir, "white_watermark.jpg")) as watermarked, \
+                Image.open(os.path.join(self.photos_dir, "white.jpg")) as original:
+            self.assertEqual(watermarked.size, original.size, "Should watermark the full resolution photo")
+
+        with open(os.path.join(self.photos_dir, "left-uniform-dark.jpg"), 'rb') as file:
+            data = file.read()
+        expected = self.processor.process_bytes(data)
+        with mock.patch.object(Image, 'open', wraps=Image.open) as opened:
+            self.assertEqual(processor.process_bytes(data), expected)
+        photo_decodes = [call for call in opened.call_args_list if isinstance(call.args[0], io.BytesIO)]
+        self.assertEqual(len(photo_decodes), 1, "Should reduce the decoded photo instead of decoding it again")
+
+        with self.assertRaisesRegex(ValueError, "analysis_scale must be greater than 0"):
+            DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                               analysis_scale=1.5)
+
+    def test_process_directory_with_corner_picker(self):
+        picker = PyramidCornerPicker([Corner.LOWER_LEFT, Corner.LOWER_RIGHT], 0.15, 0.15)
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       corner_picker=picker)
+        self.assertIs(processor.corner_picker, picker)
+        self.assertEqual(processor.corners, picker.corners, "Should use corners of the picker")
+
+        processor.process_directory(self.photos_dir, self.output_dir)
+        self.assertEqual(len(os.listdir(self.output_dir)), 7, "Should process all jpg files")
+        with open(os.path.join(SAMPLE_PHOTOS_DIR, "top-uniform-light.jpg"), 'rb') as file:
+            result, = processor.process_images([file.read()])
+        self.assertIn(result.corner, picker.corners)
+
+        with self.assertRaisesRegex(ValueError, "same proportions"):
+            DirectoryProcessor(max_width_proportion=0.1, max_height_proportion=0.15, opacity=0.5,
+                               corner_picker=picker)
+
+    def test_process_directory_with_luma_analysis(self):
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       luma_analysis=True)
+        self.assertIsInstance(processor.corner_picker, LumaStdevCornerPicker)
+        self.assertIsInstance(processor.watermark_picker, LumaWatermarkPicker)
+
+        processor.process_directory(self.photos_dir, self.output_dir)
+        self.assertEqual(len(os.listdir(self.output_dir)), 7, "Should process all jpg files")
+        with open(os.path.join(SAMPLE_PHOTOS_DIR, "bottom-uniform-light.jpg"), 'rb') as file:
+            result, = processor.process_images([file.read()])
+        self.assertEqual(result.corner, Corner.LOWER_LEFT)
+        self.assertEqual(result.watermark_type, WatermarkType.DARK)
+
+    def test_process_directory_in_shards(self):
+        processed = []
+        for index in range(3):
+            self.processor.process_directory(self.photos_dir, self.output_dir, shard=Shard(index, 3))
+            processed.extend(os.path.basename(file['file']) for file in self.processor.profile.files)
+            counters = self.processor.profile.counters
+            self.assertEqual(counters['shard_files'],
+                             len(self.processor.profile.files) + counters.get('failed_files', 0))
+            self.assertIn(Shard(index, 3).summary_filename, os.listdir(self.output_dir),
+                          "Should save a summary of the shard")
+
+        photos = [file for file in os.listdir(self.photos_dir) if file.endswith(".jpg")]
+        self.assertEqual(sorted(processed), sorted(photos),
+                         "Every photo should be processed by exactly one shard")
+        report = merge_shard_summaries(self.output_dir)
+        self.assertEqual(report['files_processed'], 7)
+        self.assertEqual((report['counters']['shard_files'], report['counters']['failed_files']), (8, 1),
+                         "Should count the gif in its shard as failed")
+        self.assertEqual(report['missing_shards'], [])
+
+    def test_process_directory_in_shards_incrementally(self):
+        # Both shards load the manifest before either of them records a photo, as on two machines
+        loaded = threading.Barrier(2)
+        original_init = ProcessingManifest.__init__
+
+        def init(manifest, *args, **kwargs):
+            original_init(manifest, *args, **kwargs)
+            loaded.wait(timeout=10)
+
+        with mock.patch.object(ProcessingManifest, '__init__', init), redirect_stdout(io.StringIO()):
+            processors = [DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5)
+                          for _ in range(2)]
+            shards = [threading.Thread(target=processor.process_directory, args=(self.photos_dir, self.output_dir),
+                                       kwargs={'incremental': True, 'shard': Shard(index, 2)})
+                      for index, processor in enumerate(processors)]
+            for shard in shards:
+                shard.start()
+            for shard in shards:
+                shard.join()
+
+        self.processor.process_directory(self.photos_dir, self.output_dir, incremental=True)
+        self.assertEqual(self.processor.profile.files, [], "Records of both shards should be kept")
+
+    def test_process_directory_with_analysis_cache(self):
+        self.processor.process_directory(self.photos_dir, self.output_dir, cache_analysis=True)
+        self.assertEqual(self.processor.profile.counters['analysis_cache_misses'], 7)
+        self.assertIsNone(self.processor.analysis_cache, "Should not keep the cache after the run")
+        self.assertIn(AnalysisCache.FILENAME, os.listdir(self.output_dir))
+        with open(os.path.join(self.output_dir, "bottom-uniform-light_watermark.jpg"), 'rb') as file:
+            first_run = file.read()
+
+        def fail(image):
+            raise AssertionError("Should not analyse cached photos")
+
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5)
+        processor.corner_picker.analyze = fail
+        processor.process_directory(self.photos_dir, self.output_dir, cache_analysis=True)
+        self.assertEqual(processor.profile.counters['analysis_cache_hits'], 7)
+        with open(os.path.join(self.output_dir, "bottom-uniform-light_watermark.jpg"), 'rb') as file:
+            self.assertEqual(file.read(), first_run, "Should make the same decision")
+
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.9)
+        processor.corner_picker.analyze = fail
+        processor.process_directory(self.photos_dir, self.output_dir, threads=2, cache_analysis=True)
+        self.assertEqual(processor.profile.counters['analysis_cache_hits'], 7, "Opacity should not affect analysis")
+
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       corners=[Corner.UPPER_LEFT])
+        processor.process_directory(self.photos_dir, self.output_dir, cache_analysis=True)
+        self.assertEqual(processor.profile.counters['analysis_cache_misses'], 7, "Corners should affect analysis")
+
+    def test_process_directory_counts_cache_lookups_of_workers(self):
+        self.processor.process_directory(self.photos_dir, self.output_dir, cache_analysis=True)
+        sequential = dict(self.processor.profile.counters)
+
+        shutil.rmtree(self.output_dir)
+        self.processor.process_directory(self.photos_dir, self.output_dir, jobs=2, cache_analysis=True)
+        counters = self.processor.profile.counters
+        self.assertEqual(counters['analysis_cache_misses'], 7)
+        self.assertEqual(counters['watermark_cache_hits'] + counters['watermark_cache_misses'],
+                         sequential['watermark_cache_hits'] + sequential['watermark_cache_misses'],
+                         "Should count watermark lookups of every worker")
+
+        self.processor.process_directory(self.photos_dir, self.output_dir, jobs=2, cache_analysis=True)
+        self.assertEqual(self.processor.profile.counters['analysis_cache_hits'], 7)
+
+    def test_plan_and_apply(self):
+        self.processor.process_directory(self.photos_dir, self.output_dir)
+        with open(os.path.join(self.output_dir, "left-uniform-dark_watermark.jpg"), 'rb') as file:
+            processed = file.read()
+
+        plan_output_dir = tempfile.mkdtemp()
+        plan_path = os.path.join(plan_output_dir, "plan.jsonl")
+        self.processor.plan_directory(self.photos_dir, plan_path, plan_output_dir)
+        self.assertEqual(os.listdir(plan_output_dir), ["plan.jsonl"], "Should not write photos")
+
+        entries = {os.path.basename(entry.source): entry for entry in read_plan(plan_path)}
+        self.assertEqual(len(entries), 7, "Should plan all jpg files")
+        entry = entries["left-uniform-dark.jpg"]
+        self.assertEqual(entry.output, os.path.join(plan_output_dir, "left-uniform-dark_watermark.jpg"))
+        self.assertEqual(entry.watermark_type, WatermarkType.LIGHT)
+        self.assertEqual(set(entry.statistics), set(self.processor.corners))
+        self.assertEqual(entry.image_size[0] * 0.15 // 1, entry.watermark_size[0], "Should plan the watermark size")
+        self.assertEqual(entry.output_format, 'jpeg')
+
+        self.processor.apply_plan(plan_path, threads=2)
+        self.assertEqual(len(os.listdir(plan_output_dir)), 8)
+        with open(entry.output, 'rb') as file:
+            self.assertEqual(file.read(), processed, "Should watermark the same as process_directory")
+
+        # Only the edited photo is watermarked, in the edited corner
+        edited = entry._replace(corner=Corner.LOWER_RIGHT, output=os.path.join(plan_output_dir, "edited.jpg"))
+        with open(plan_path, 'w', encoding='utf-8') as file:
+            file.write(edited.to_json() + '\n')
+        self.processor.corner_picker.analyze = None
+        self.processor.apply_plan(plan_path, jobs=2)
+        self.assertEqual(len(self.processor.profile.files), 1)
+        with open(edited.output, 'rb') as file:
+            result, = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                         corners=[Corner.LOWER_RIGHT]).process_images([file.read()])
+        self.assertEqual(result.corner, Corner.LOWER_RIGHT)
+        shutil.rmtree(plan_output_dir)
+
+    def test_apply_plan_with_other_output_format(self):
+        plan_path = os.path.join(self.output_dir, "plan.jsonl")
+        self.processor.plan_directory(self.photos_dir, plan_path, self.output_dir)
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       output_format='webp')
+        with self.assertRaisesRegex(PlanException, "planned for jpeg output, not webp"):
+            processor.apply_plan(plan_path)
+
+        # Plans written by hand do not record the output format
+        entry = read_plan(plan_path)[0]._replace(output_format=None)
+        with open(plan_path, 'w', encoding='utf-8') as file:
+            file.write(entry.to_json() + '\n')
+        with self.assertRaisesRegex(PlanException, "can not be saved as webp"):
+            processor.apply_plan(plan_path)
+        self.assertEqual(os.listdir(self.output_dir), ["plan.jsonl"], "Should not process any photo")
+
+    def test_process_directory_recursive(self):
+        nested_dir = os.path.join(self.photos_dir, "2022", "07")
+        os.makedirs(nested_dir)
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "white.jpg"), nested_dir)
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "black.jpg"), os.path.join(nested_dir, "CAMERA.JPG"))
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "black.jpg"), os.path.join(self.photos_dir, "TOP.JPG"))
+        Image.new('RGB', (64, 48)).save(os.path.join(nested_dir, "illegal-format.gif"))
+
+        self.processor.process_directory(self.photos_dir, recursive=True)
+        watermarked_directory = os.path.join(self.photos_dir, "with-watermark")
+        self.assertEqual(len(os.listdir(watermarked_directory)), 9,
+                         "Should process top level jpg files and mirror the nested folder")
+        self.assertIn("TOP_watermark.JPG", os.listdir(watermarked_directory), "Should ignore the extension's case")
+        self.assertEqual(sorted(os.listdir(os.path.join(watermarked_directory, "2022", "07"))),
+                         ["CAMERA_watermark.JPG", "white_watermark.jpg"],
+                         "Should mirror the folder tree and ignore the gif")
+
+        self.processor.process_directory(self.photos_dir, recursive=True)
+        self.assertNotIn("with-watermark", os.listdir(watermarked_directory),
+                         "Should not descend into its own output folder")
+
+    def test_scan_files(self):
+        nested_dir = os.path.join(self.photos_dir, "nested")
+        os.makedirs(nested_dir)
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "white.jpg"), nested_dir)
+
+        self.assertEqual(len(list(scan_files(self.photos_dir))), 8, "Should only list top level files")
+        self.assertEqual(len(list(scan_files(self.photos_dir, recursive=True, extensions=['.jpg']))), 8,
+                         "Should list nested files with matching extensions")
+        self.assertEqual(len(list(scan_files(self.photos_dir, recursive=True, excluded_directories=[nested_dir]))),
+                         8, "Should skip excluded directories")
+
+    def test_process_directory_incremental(self):
+        self.processor.process_directory(self.photos_dir, self.output_dir, incremental=True)
+        self.assertEqual(len(os.listdir(self.output_dir)), 8, "Should process all jpg files and save the manifest")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.processor.process_directory(self.photos_dir, self.output_dir, incremental=True)
+        self.assertEqual(output.getvalue().count("is up to date"), 7, "Should skip all processed photos")
+
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "black.jpg"), os.path.join(self.photos_dir, "white.jpg"))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5) \
+                .process_directory(self.photos_dir, self.output_dir, jobs=2, incremental=True)
+        self.assertIn("Added watermark to white.jpg", output.getvalue(), "Should process the changed photo")
+        self.assertEqual(output.getvalue().count("is up to date"), 6, "Should skip unchanged photos")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.6) \
+                .process_directory(self.photos_dir, self.output_dir, incremental=True)
+        self.assertNotIn("is up to date", output.getvalue(), "Should process all photos after a config change")
+
+    def test_process_directory_profile(self):
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       cprofile_sample=2)
+        processor.process_directory(self.photos_dir, self.output_dir, jobs=2)
+
+        report = processor.profile.report()
+        self.assertEqual(report['files_processed'], 7, "Should profile every processed photo")
+        self.assertEqual(set(report['stages']),
+                         {'read', 'decode', 'analysis', 'composite', 'encode', 'write', 'total'},
+                         "Should measure every stage")
+        self.assertIn('cprofile', report, "Should collect cProfile statistics from workers")
+
+    def test_process_directory_with_encoder_options(self):
+        processor = DirectoryProcessor(max_width_proportion=0.15, max_height_proportion=0.15, opacity=0.5,
+                                       quality='keep', progressive=True, optimize=True)
+        processor.process_directory(self.photos_dir, self.output_dir)
+
+        with Image.open(os.path.join(self.output_dir, "white_watermark.jpg")) as watermarked, \
+                Image.open(os.path.join(self.photos_dir, "white.jpg")) as original:
+            self.assertEqual(watermarked.quantization, original.quantization, "Should reuse quantization tables")
+            self.assertTrue(watermarked.info.get('progressive'), "Should save progressive JPEGs")
+
+        sizes = processor.profile.report()['sizes']
+        self.assertGreater(sizes['input_size'], 0, "Should report size of original photos")
+        self.assertGreater(sizes['output_size'], 0, "Should report size of watermarked photos")
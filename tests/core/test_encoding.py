@@ -0,0 +1,75 @@
+import io
+import os
+from unittest import TestCase
+
+from PIL import Image
+
+from core.encoding import OUTPUT_FORMATS, available_output_formats, jpeg_save_options, save_options
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestJpegSaveOptions(TestCase):
+
+    def setUp(self) -> None:
+        self.jpeg = Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'left-dark-right-light.jpg'))
+        self.png = Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'illegal-format.png'))
+
+    def tearDown(self) -> None:
+        self.jpeg.close()
+        self.png.close()
+
+    def test_default_options(self):
+        self.assertEqual(jpeg_save_options(self.jpeg),
+                         {'format': 'JPEG', 'quality': 100, 'progressive': False, 'optimize': False},
+                         "Should save with quality 100 by default")
+
+    def test_keep_quality(self):
+        options = jpeg_save_options(self.jpeg, quality='keep')
+        self.assertEqual(options['qtables'], self.jpeg.quantization, "Should reuse quantization tables")
+        self.assertIn('subsampling', options, "Should reuse subsampling")
+
+        encoded = io.BytesIO()
+        self.jpeg.convert('RGB').save(encoded, **options)
+        with Image.open(encoded) as saved:
+            self.assertEqual(saved.quantization, self.jpeg.quantization, "Should save with the original tables")
+
+        self.assertEqual(jpeg_save_options(self.png, quality='keep')['quality'], 100,
+                         "Should fall back to quality 100 for sources other than JPEG")
+
+    def test_raises_exception_with_invalid_options(self):
+        with self.assertRaisesRegex(ValueError, "quality must be an integer between 1 and 100"):
+            jpeg_save_options(self.jpeg, quality=101)
+
+        with self.assertRaisesRegex(ValueError, "subsampling must be one of"):
+            jpeg_save_options(self.jpeg, subsampling='4:1:1')
+
+
+class TestSaveOptions(TestCase):
+
+    def setUp(self) -> None:
+        self.jpeg = Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'left-dark-right-light.jpg'))
+
+    def tearDown(self) -> None:
+        self.jpeg.close()
+
+    def test_jpeg(self):
+        self.assertEqual(save_options(self.jpeg, 'jpeg', quality='keep'), jpeg_save_options(self.jpeg, quality='keep'))
+
+    def test_other_formats(self):
+        self.assertIn('jpeg', available_output_formats())
+        for output_format in set(available_output_formats()) - {'jpeg'}:
+            options = save_options(self.jpeg, output_format, quality=70, optimize=True)
+            self.assertEqual(options['format'], OUTPUT_FORMATS[output_format][0])
+            self.assertEqual(options['quality'], 70)
+            self.assertNotIn('quality', save_options(self.jpeg, output_format, quality='keep'),
+                             "Should use the encoder's default quality")
+
+            output = io.BytesIO()
+            self.jpeg.save(output, **options)
+            output.seek(0)
+            with Image.open(output) as saved:
+                self.assertEqual(saved.format, OUTPUT_FORMATS[output_format][0])
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            save_options(self.jpeg, 'bmp')
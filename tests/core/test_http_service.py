@@ -0,0 +1,100 @@
+import json
+import os.path
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from core.directory_processors import DirectoryProcessor
+from core.http_service import WatermarkServer, WatermarkService
+from core.watermarking import CORNER_PRESETS
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestHttpService(TestCase):
+
+    def setUp(self) -> None:
+        self.service = WatermarkService(corners='all', width=0.15, height=0.15, opacity=0.5)
+        self.server = WatermarkServer(self.service, port=0, workers=2, quiet=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+        with open(os.path.join(SAMPLE_PHOTOS_DIR, "left-dark-right-light.jpg"), 'rb') as file:
+            self.photo = file.read()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def post(self, data: bytes, query: str = '') -> tuple[int, dict, bytes]:
+        request = urllib.request.Request(f"{self.url}/watermark{query}", data=data, method='POST')
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, dict(response.headers), response.read()
+        except urllib.error.HTTPError as err:
+            return err.code, dict(err.headers), err.read()
+
+    def test_watermark(self):
+        status, headers, body = self.post(self.photo)
+
+        expected = DirectoryProcessor(0.15, 0.15, 0.5, corners=CORNER_PRESETS['all']).process_bytes(self.photo)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'image/jpeg')
+        self.assertEqual(body, expected, "Should match the library API")
+        self.assertIn(headers['X-Watermark-Type'], ('dark', 'light'))
+
+    def test_query_parameters(self):
+        status, headers, _ = self.post(self.photo, '?corners=upper-left&opacity=0.3')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['X-Watermark-Corner'], 'upper left')
+
+        for query in ('?corners=middle', '?opacity=2', '?width=wide', '?unknown=1'):
+            status, _, body = self.post(self.photo, query)
+            self.assertEqual(status, 400, query)
+            self.assertIn('error', json.loads(body))
+
+    def test_invalid_photo(self):
+        status, _, _ = self.post(b'not an image')
+        self.assertEqual(status, 400)
+
+    def test_photo_above_pixel_limit(self):
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            status, _, body = self.post(self.photo)
+        self.assertEqual(status, 413)
+        self.assertIn('decompression bomb', json.loads(body)['error'])
+
+        status, _, _ = self.post(self.photo)
+        self.assertEqual(status, 200, "Server should keep answering")
+
+    def test_concurrent_requests_and_health(self):
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: self.post(self.photo), range(8)))
+        self.assertEqual(len({body for _, _, body in results}), 1, "Concurrent results should be identical")
+        self.post(b'not an image')
+
+        with urllib.request.urlopen(f"{self.url}/health") as response:
+            metrics = json.loads(response.read())
+
+        self.assertEqual(metrics['status'], 'ok')
+        self.assertEqual(metrics['requests'], 9)
+        self.assertEqual(metrics['errors'], 1)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['latency']['count'], 9)
+        self.assertGreater(metrics['watermark_cache']['hits'], 0, "Should reuse prepared watermarks")
+
+    def test_unavailable_output_format(self):
+        # Pillow builds without AVIF support do not know its MIME type either
+        with mock.patch('PIL.features.check', return_value=False), mock.patch.dict(Image.MIME):
+            Image.MIME.pop('AVIF', None)
+            with self.assertRaisesRegex(ValueError, "avif is not supported by the installed Pillow"):
+                WatermarkService(output_format='avif')
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(f"{self.url}/missing")
+        self.assertEqual(context.exception.code, 404)
@@ -0,0 +1,104 @@
+import os
+import random
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from core.integral_image import IntegralImage, Window, candidate_windows, pick_best_window
+from core.watermarking import color_statistics
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestIntegralImage(TestCase):
+
+    def setUp(self) -> None:
+        self.photo = Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'left-dark-right-light.jpg'))
+
+    def tearDown(self) -> None:
+        self.photo.close()
+
+    def assertStatisticsEqual(self, expected, actual):
+        self.assertEqual(expected.mean, actual.mean)
+        for expected_value, actual_value in zip(expected.variance, actual.variance):
+            self.assertAlmostEqual(expected_value, actual_value, places=3)
+
+    def test_statistics_match_color_statistics(self):
+        integral_image = IntegralImage(self.photo, max_cells=max(self.photo.size))
+        self.assertEqual(integral_image.cell_size, 1)
+
+        for box in [(0, 0, *self.photo.size), (10, 20, 30, 40), (400, 300, 462, 318), (0, 0, 1, 1)]:
+            self.assertStatisticsEqual(color_statistics(self.photo.crop(box)), integral_image.statistics(box))
+
+    def test_cells(self):
+        integral_image = IntegralImage(self.photo, max_cells=100)
+        self.assertEqual(integral_image.cell_size, 5)
+        self.assertEqual((integral_image.columns, integral_image.rows), (93, 64))
+
+        for box in [(0, 0, *self.photo.size), (10, 20, 30, 40), (400, 300, 462, 318)]:
+            self.assertStatisticsEqual(color_statistics(self.photo.crop(box)), integral_image.statistics(box))
+
+        self.assertEqual(integral_image.cell_box((11, 22, 459, 318)), (2, 4, 92, 64), "Should align to cells")
+        with self.assertRaisesRegex(ValueError, "is empty"):
+            integral_image.statistics((10, 10, 11, 11))
+
+    def test_strips(self):
+        whole = IntegralImage(self.photo, max_cells=100)
+        # Strips of two rows of cells, the last strip ends with a partial row
+        with mock.patch('core.integral_image._STRIP_PIXELS', 462 * 10):
+            strips = IntegralImage(self.photo, max_cells=100)
+
+        for box in [(0, 0, *self.photo.size), (10, 20, 30, 40), (400, 300, 462, 318)]:
+            self.assertStatisticsEqual(whole.statistics(box), strips.statistics(box))
+            self.assertStatisticsEqual(color_statistics(self.photo.crop(box)), strips.statistics(box))
+
+    def test_other_modes(self):
+        grayscale = self.photo.convert('L')
+        self.assertStatisticsEqual(color_statistics(grayscale.convert('RGB')),
+                                   IntegralImage(grayscale).statistics((0, 0, *grayscale.size)))
+
+
+class TestCandidateWindows(TestCase):
+
+    def test_candidate_windows(self):
+        windows = candidate_windows((100, 50), (20, 10), margin=0.1, grid_steps=4)
+        names = [window.name for window in windows]
+        boxes = [window.box for window in windows]
+
+        self.assertEqual(len(boxes), len(set(boxes)), "Windows should be distinct")
+        for left, upper, right, lower in boxes:
+            self.assertEqual((right - left, lower - upper), (20, 10))
+            self.assertTrue(0 <= left and right <= 100 and 0 <= upper and lower <= 50, "Should fit in the image")
+        self.assertEqual(boxes[:2], [(0, 0, 20, 10), (10, 5, 30, 15)])
+        self.assertIn('lower right inner', names)
+        self.assertIn('right middle', names)
+        self.assertIn((40, 20, 60, 30), boxes, "Should include the grid")
+        self.assertEqual(len(candidate_windows((100, 50), (20, 10), margin=0, grid_steps=0)), 8)
+
+    def test_raises_exception_if_window_does_not_fit(self):
+        with self.assertRaisesRegex(ValueError, "must fit"):
+            candidate_windows((100, 50), (101, 10))
+
+
+class TestPickBestWindow(TestCase):
+
+    def setUp(self) -> None:
+        noise = random.Random(0)
+        self.image = Image.new('RGB', (200, 100))
+        self.image.putdata([(noise.randrange(256),) * 3 for _ in range(200 * 100)])
+        self.image.paste((120, 120, 120), (90, 0, 110, 10))
+
+    def test_pick_best_window(self):
+        windows = candidate_windows(self.image.size, (20, 10))
+        self.assertEqual(pick_best_window(self.image, windows), Window('top middle', (90, 0, 110, 10)),
+                         "Should find the uniform region outside of the corners")
+        self.assertEqual(pick_best_window(self.image, [Window('a', (0, 0, 20, 10)), Window('b', (95, 0, 105, 5))]),
+                         Window('b', (95, 0, 105, 5)), "Should choose from the given windows")
+
+    def test_builds_tables_only_for_many_windows(self):
+        with mock.patch('core.integral_image.IntegralImage', wraps=IntegralImage) as tables:
+            pick_best_window(self.image, candidate_windows(self.image.size, (20, 10)))
+            self.assertFalse(tables.called, "Should read a few windows directly")
+
+            windows = candidate_windows(self.image.size, (20, 10), grid_steps=20)
+            self.assertEqual(pick_best_window(self.image, windows).box, (90, 0, 110, 10))
+            self.assertTrue(tables.called, "Should use the tables for many windows")
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from core.manifest import ProcessingManifest
+from core.sharding import Shard
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestProcessingManifest(TestCase):
+
+    def setUp(self) -> None:
+        self.photos_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+
+        self.photo = os.path.join(self.photos_dir, "white.jpg")
+        self.output = os.path.join(self.output_dir, "white_watermark.jpg")
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "white.jpg"), self.photo)
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "white.jpg"), self.output)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.photos_dir)
+        shutil.rmtree(self.output_dir)
+
+    def test_records_are_loaded_by_next_run(self):
+        manifest = ProcessingManifest(self.output_dir, {'opacity': 0.5})
+        self.assertFalse(manifest.is_up_to_date("white.jpg", self.photo), "Should not be processed yet")
+        manifest.record("white.jpg", self.photo, self.output)
+        manifest.close()
+
+        manifest = ProcessingManifest(self.output_dir, {'opacity': 0.5})
+        self.assertTrue(manifest.is_up_to_date("white.jpg", self.photo), "Should be up to date")
+
+        manifest = ProcessingManifest(self.output_dir, {'opacity': 0.6})
+        self.assertFalse(manifest.is_up_to_date("white.jpg", self.photo), "Parameters changed")
+
+    def test_detects_changed_and_missing_files(self):
+        for use_content_hash, replacement in [(False, "black.jpg"), (True, "white.jpg")]:
+            manifest = ProcessingManifest(self.output_dir, {}, use_content_hash)
+            manifest.record("white.jpg", self.photo, self.output)
+            self.assertTrue(manifest.is_up_to_date("white.jpg", self.photo), "Should be up to date")
+
+            shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, replacement), self.photo)
+            self.assertFalse(manifest.is_up_to_date("white.jpg", self.photo), "Photo has changed")
+            manifest.close()
+
+        manifest = ProcessingManifest(self.output_dir, {})
+        manifest.record("white.jpg", self.photo, self.output)
+        os.remove(self.output)
+        self.assertFalse(manifest.is_up_to_date("white.jpg", self.photo), "Output was removed")
+        manifest.close()
+
+    def test_ignores_incomplete_record(self):
+        manifest = ProcessingManifest(self.output_dir, {})
+        manifest.record("white.jpg", self.photo, self.output)
+        manifest._file.write('{"source": "black.jpg", "outp')
+        manifest._file.close()
+
+        manifest = ProcessingManifest(self.output_dir, {})
+        self.assertEqual(list(manifest.records), ["white.jpg"], "Should skip the interrupted record")
+
+    def test_concurrent_shards_keep_records_of_each_other(self):
+        black = os.path.join(self.photos_dir, "black.jpg")
+        shutil.copy(os.path.join(SAMPLE_PHOTOS_DIR, "black.jpg"), black)
+        first = ProcessingManifest(self.output_dir, {}, filename=Shard(0, 2).manifest_filename)
+        second = ProcessingManifest(self.output_dir, {}, filename=Shard(1, 2).manifest_filename)
+        first.record("white.jpg", self.photo, self.output)
+        second.record("black.jpg", black, self.output)
+        first.close()
+        second.close()
+
+        manifest = ProcessingManifest(self.output_dir, {})
+        self.assertTrue(manifest.is_up_to_date("white.jpg", self.photo), "Should keep records of the first shard")
+        self.assertTrue(manifest.is_up_to_date("black.jpg", black), "Should keep records of the second shard")
+
+    def test_latest_record_is_used(self):
+        manifest = ProcessingManifest(self.output_dir, {'opacity': 0.5})
+        manifest.record("white.jpg", self.photo, self.output)
+        manifest.close()
+        manifest = ProcessingManifest(self.output_dir, {'opacity': 0.6}, filename=Shard(0, 2).manifest_filename)
+        manifest.record("white.jpg", self.photo, self.output)
+        manifest.close()
+
+        manifest = ProcessingManifest(self.output_dir, {'opacity': 0.5})
+        self.assertFalse(manifest.is_up_to_date("white.jpg", self.photo),
+                         "Output was overwritten with other parameters by the shard")
@@ -0,0 +1,79 @@
+import os.path
+import threading
+import time
+from unittest import TestCase, mock
+
+from PIL import Image
+
+from core.memory import MemoryBudget, decoded_size, estimate_footprint, parse_memory_size
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestMemory(TestCase):
+
+    def test_parse_memory_size(self):
+        self.assertEqual(parse_memory_size('100'), 100)
+        self.assertEqual(parse_memory_size('512M'), 512 * 1024 ** 2)
+        self.assertEqual(parse_memory_size('4g'), 4 * 1024 ** 3)
+        self.assertEqual(parse_memory_size('1.5GiB'), int(1.5 * 1024 ** 3))
+        for text in ('', 'G', '-1G', 'four gigabytes'):
+            with self.assertRaises(ValueError):
+                parse_memory_size(text)
+
+    def test_estimate_footprint(self):
+        self.assertEqual(decoded_size((100, 50), 'RGB'), 15000)
+        self.assertEqual(decoded_size((100, 50), 'L'), 5000)
+        self.assertEqual(decoded_size((100, 50), 'I;16'), 10000)
+
+        filepath = os.path.join(SAMPLE_PHOTOS_DIR, "black.jpg")
+        with open(filepath, 'rb') as file:
+            self.assertEqual(estimate_footprint(filepath), estimate_footprint(file))
+        self.assertGreater(estimate_footprint(filepath), 0)
+        self.assertEqual(estimate_footprint(os.path.join(SAMPLE_PHOTOS_DIR, "missing.jpg")), 0)
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            self.assertEqual(estimate_footprint(filepath), 0, "Photos above the pixel limit fail when opened")
+
+    def test_budget(self):
+        budget = MemoryBudget(100)
+        self.assertTrue(budget.try_acquire(60))
+        self.assertFalse(budget.try_acquire(60))
+        self.assertTrue(budget.try_acquire(40))
+        budget.release(60)
+        budget.release(40)
+
+        self.assertTrue(budget.try_acquire(500), "Oversized work should be admitted alone")
+        self.assertFalse(budget.try_acquire(1))
+        budget.release(500)
+        self.assertEqual(budget.used, 0)
+
+        with self.assertRaises(ValueError):
+            MemoryBudget(0)
+
+    def test_acquire_waits_for_release(self):
+        budget = MemoryBudget(100)
+        budget.acquire(80)
+        admitted = threading.Event()
+
+        def acquire():
+            budget.acquire(50)
+            admitted.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        time.sleep(0.05)
+        self.assertFalse(admitted.is_set(), "Should wait until the work fits")
+        self.assertFalse(budget.try_acquire(10), "Should not overtake waiting work")
+
+        budget.release(80)
+        thread.join(1)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(budget.used, 50)
+
+    def test_close_admits_waiting_work(self):
+        budget = MemoryBudget(100)
+        budget.acquire(100)
+        thread = threading.Thread(target=budget.acquire, args=(100,))
+        thread.start()
+        budget.close()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
@@ -0,0 +1,77 @@
+import threading
+import time
+from unittest import TestCase
+
+from core.pipeline import Stage, StageFailure, run_pipeline
+
+
+def _slow_square(number: int) -> int:
+    # Later items finish first, so results arrive out of order
+    time.sleep(0.001 * (10 - number))
+    return number * number
+
+
+def _fail_on_three(number: int) -> int:
+    if number == 3:
+        raise ValueError("three")
+    return number
+
+
+class TestPipeline(TestCase):
+
+    def test_results_in_order(self):
+        stages = [Stage('square', _slow_square, 4), Stage('negate', lambda number: -number, 2)]
+        results = list(run_pipeline(range(10), stages, queue_size=1))
+        self.assertEqual(results, [-number * number for number in range(10)])
+
+    def test_failure_skips_later_stages(self):
+        called = []
+        stages = [Stage('fail', _fail_on_three, 2), Stage('record', lambda number: called.append(number) or number)]
+        results = list(run_pipeline(range(5), stages))
+
+        self.assertEqual(results[:3], [0, 1, 2])
+        self.assertEqual(results[4], 4)
+        self.assertIsInstance(results[3], StageFailure)
+        self.assertEqual(results[3].stage, 'fail')
+        self.assertEqual(results[3].item, 3)
+        self.assertIsInstance(results[3].exception, ValueError)
+        self.assertNotIn(3, called)
+
+    def test_bounded_queues(self):
+        consumed = []
+
+        def items():
+            for number in range(100):
+                consumed.append(number)
+                yield number
+
+        results = run_pipeline(items(), [Stage('identity', lambda number: number)], queue_size=2)
+        self.assertEqual(next(results), 0)
+        time.sleep(0.05)
+        self.assertLess(len(consumed), 10, "Should not read items ahead of the queues")
+        results.close()
+
+    def test_error_in_items_is_raised(self):
+        def items():
+            yield 1
+            raise RuntimeError("broken input")
+
+        results = run_pipeline(items(), [Stage('identity', lambda number: number)])
+        self.assertEqual(next(results), 1)
+        with self.assertRaisesRegex(RuntimeError, "broken input"):
+            next(results)
+
+    def test_threads_finish_when_closed_early(self):
+        before = threading.active_count()
+        results = run_pipeline(range(1000), [Stage('identity', lambda number: number, 3)], queue_size=1)
+        next(results)
+        results.close()
+        self.assertEqual(threading.active_count(), before)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            list(run_pipeline([1], []))
+        with self.assertRaises(ValueError):
+            list(run_pipeline([1], [Stage('identity', lambda number: number, 0)]))
+        with self.assertRaises(ValueError):
+            list(run_pipeline([1], [Stage('identity', lambda number: number)], queue_size=0))
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from core.exceptions import PlanException
+from core.plan import PlanEntry, read_plan, write_plan_entries
+from core.watermark_pickers import WatermarkType
+from core.watermarking import ColorStatistics, Corner
+
+
+class TestPlan(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'plan.jsonl')
+        self.entry = PlanEntry('photos/a.jpg', 'photos/with-watermark/a_watermark.jpg', Corner.LOWER_LEFT,
+                               WatermarkType.DARK, (400, 300), (60, 18),
+                               {Corner.LOWER_LEFT: ColorStatistics((200, 201, 202), (1.0, 4.0, 9.0), (1.0, 2.0, 3.0))},
+                               'jpeg')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        with open(self.filepath, 'w', encoding='utf-8') as file:
+            self.assertEqual(write_plan_entries(file, [self.entry, self.entry._replace(source='photos/b.jpg')]), 2)
+
+        self.assertEqual(read_plan(self.filepath), [self.entry, self.entry._replace(source='photos/b.jpg')])
+
+    def test_read_edited_plan(self):
+        with open(self.filepath, 'w', encoding='utf-8') as file:
+            file.write('{"source": "a.jpg", "output": "out/a.jpg", "corner": "upper right", '
+                       '"watermark_type": "LIGHT"}\n\n')
+
+        entry, = read_plan(self.filepath)
+        self.assertEqual((entry.corner, entry.watermark_type), (Corner.UPPER_RIGHT, WatermarkType.LIGHT))
+        self.assertEqual(entry.statistics, {}, "Statistics should be optional")
+        self.assertIsNone(entry.output_format, "Output format should be optional")
+
+    def test_raises_exception_with_invalid_entry(self):
+        for line, message in [('{"source": "a.jpg"}', "Missing or invalid field"),
+                              ('{"source": "a.jpg", "output": "b.jpg", "corner": "middle", '
+                               '"watermark_type": "dark"}', "'middle' is not a valid Corner"),
+                              ('not json', "Invalid JSON")]:
+            with open(self.filepath, 'w', encoding='utf-8') as file:
+                file.write(self.entry.to_json() + '\n' + line + '\n')
+            with self.assertRaisesRegex(PlanException, f"plan.jsonl:2: {message}"):
+                read_plan(self.filepath)
@@ -0,0 +1,57 @@
+import cProfile
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from core.profiling import RunProfile, StageTimer, percentile
+
+
+class TestRunProfile(TestCase):
+
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50, "Should compute the median")
+        self.assertEqual(percentile(values, 95), 95, "Should compute the 95th percentile")
+        self.assertEqual(percentile([3.0], 95), 3, "Should handle a single value")
+
+    def test_stage_timer(self):
+        timer = StageTimer()
+        with timer.stage('decode'):
+            pass
+        with timer.stage('decode'):
+            pass
+        with timer.stage('encode'):
+            pass
+
+        self.assertEqual(list(timer.durations), ['decode', 'encode'], "Should sum repeated stages")
+        self.assertGreaterEqual(timer.durations['decode'], 0, "Should measure time")
+
+    def test_summary(self):
+        profile = RunProfile()
+        profile.add_file('a.jpg', {'decode': 1.0, 'encode': 2.0})
+        profile.add_file('b.jpg', {'decode': 3.0, 'encode': 4.0})
+
+        summary = profile.summary()
+        self.assertEqual(summary['decode'], {'count': 2, 'total': 4.0, 'p50': 1.0, 'p95': 3.0, 'max': 3.0},
+                         "Should aggregate stage timings")
+        self.assertEqual(summary['total']['total'], 10.0, "Should aggregate total time of files")
+
+    def test_save(self):
+        profile = RunProfile()
+        profile.add_file('a.jpg', {'decode': 1.0})
+        profiler = cProfile.Profile()
+        profiler.enable()
+        sorted(range(100))
+        profiler.disable()
+        profiler.create_stats()
+        profile.add_cprofile_stats(profiler.stats)
+
+        output_dir = tempfile.mkdtemp()
+        profile.save(os.path.join(output_dir, 'report.json'))
+
+        with open(os.path.join(output_dir, 'report.json'), encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertEqual(report['files_processed'], 1, "Should report processed files")
+        self.assertIn('cprofile', report, "Should include cProfile statistics")
+        self.assertIn('report.prof', os.listdir(output_dir), "Should save raw cProfile statistics")
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from core.exceptions import ShardException
+from core.profiling import RunProfile
+from core.sharding import Shard, merge_shard_summaries, shard_index, write_shard_summary
+
+
+class TestShard(TestCase):
+
+    def test_parse(self):
+        self.assertEqual(Shard.parse("1/4"), Shard(1, 4))
+        self.assertEqual(str(Shard.parse("0/1")), "0/1")
+        for spec in ["4/4", "-1/4", "1", "1/0", "a/b", "1/4/5"]:
+            with self.assertRaises(ValueError, msg=f"{spec} should be invalid"):
+                Shard.parse(spec)
+
+    def test_partition_is_disjoint_and_stable(self):
+        paths = [f"2022/trip-{number}/IMG_{number:04}.jpg" for number in range(200)]
+        shards = [Shard(index, 3) for index in range(3)]
+
+        for path in paths:
+            self.assertEqual(sum(shard.contains(path) for shard in shards), 1, "Should be in exactly one shard")
+        sizes = [sum(shard.contains(path) for path in paths) for shard in shards]
+        self.assertTrue(all(size > 40 for size in sizes), f"Shards should be balanced, got {sizes}")
+
+        # The partition must not change between runs, machines or versions
+        self.assertEqual([shard_index(path, 4) for path in ["a.jpg", "2022/b.jpg", "white.jpg", "black.jpg"]],
+                         [2, 1, 1, 1])
+        self.assertEqual(shard_index("a.jpg", 1), 0)
+
+
+class TestMergeShardSummaries(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def write_summary(self, shard: Shard, files: list[str], wall_time: float) -> None:
+        profile = RunProfile()
+        for file in files:
+            profile.add_file(file, {'decode': 1.0, 'encode': 2.0}, 100, 50)
+        profile.wall_time = wall_time
+        profile.counters['shard_files'] = len(files) + 1
+        profile.counters['failed_files'] = 1
+        write_shard_summary(os.path.join(self.directory, shard.summary_filename), shard, '/photos', profile)
+
+    def test_merge(self):
+        self.write_summary(Shard(0, 3), ["a.jpg", "b.jpg"], 5.0)
+        self.write_summary(Shard(2, 3), ["c.jpg"], 7.0)
+
+        report = merge_shard_summaries(self.directory)
+        self.assertEqual(report['files_processed'], 3)
+        self.assertEqual(report['wall_time'], 7.0, "Shards run at the same time")
+        self.assertEqual(report['stages']['decode']['count'], 3)
+        self.assertEqual(report['sizes']['input_size'], 300)
+        self.assertEqual(report['counters'], {'shard_files': 5, 'failed_files': 2})
+        self.assertEqual([shard['index'] for shard in report['shards']], [0, 2])
+        self.assertEqual(report['missing_shards'], [1], "Should report shards without a summary")
+        json.dumps(report)
+
+    def test_raises_exception_with_invalid_summaries(self):
+        with self.assertRaisesRegex(ShardException, "No shard summaries"):
+            merge_shard_summaries(self.directory)
+
+        self.write_summary(Shard(0, 2), ["a.jpg"], 1.0)
+        self.write_summary(Shard(0, 3), ["a.jpg"], 1.0)
+        with self.assertRaisesRegex(ShardException, "different partitions"):
+            merge_shard_summaries(self.directory)
+
+        os.remove(os.path.join(self.directory, Shard(0, 3).summary_filename))
+        with open(os.path.join(self.directory, Shard(1, 2).summary_filename), 'w', encoding='utf-8') as file:
+            file.write('{"shard": ')
+        with self.assertRaisesRegex(ShardException, "Invalid shard summary"):
+            merge_shard_summaries(self.directory)
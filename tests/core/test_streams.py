@@ -0,0 +1,69 @@
+import io
+import os.path
+from unittest import TestCase
+
+from PIL import Image
+
+from core.directory_processors import DirectoryProcessor
+from core.exceptions import FramingException
+from core.streams import FRAME_HEADER, process_framed_stream, process_stream, read_frame, write_frame
+from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
+
+
+class TestStreams(TestCase):
+
+    def setUp(self) -> None:
+        self.processor = DirectoryProcessor(max_width_proportion=0.15,
+                                            max_height_proportion=0.15,
+                                            opacity=0.5)
+        with open(os.path.join(SAMPLE_PHOTOS_DIR, "left-dark-right-light.jpg"), 'rb') as file:
+            self.photo = file.read()
+
+    def test_frames_round_trip(self):
+        stream = io.BytesIO()
+        write_frame(stream, b'first')
+        write_frame(stream, b'')
+        write_frame(stream, b'third')
+        stream.seek(0)
+
+        self.assertEqual(read_frame(stream), b'first')
+        self.assertEqual(read_frame(stream), b'')
+        self.assertEqual(read_frame(stream), b'third')
+        self.assertIsNone(read_frame(stream))
+
+    def test_truncated_frame(self):
+        with self.assertRaises(FramingException):
+            read_frame(io.BytesIO(FRAME_HEADER.pack(10) + b'short'))
+        with self.assertRaises(FramingException):
+            read_frame(io.BytesIO(b'\x00\x00'))
+
+    def test_process_stream(self):
+        output = io.BytesIO()
+        process_stream(self.processor, io.BytesIO(self.photo), output)
+
+        self.assertEqual(output.getvalue(), self.processor.process_bytes(self.photo))
+        with Image.open(io.BytesIO(output.getvalue())) as image:
+            self.assertEqual(image.format, 'JPEG')
+
+        with self.assertRaises(OSError):
+            process_stream(self.processor, io.BytesIO(b'not an image'), io.BytesIO())
+
+    def test_process_framed_stream(self):
+        source = io.BytesIO()
+        write_frame(source, self.photo)
+        write_frame(source, b'not an image')
+        write_frame(source, self.photo)
+        source.seek(0)
+        target = io.BytesIO()
+        errors = io.StringIO()
+
+        failed = process_framed_stream(self.processor, source, target, errors)
+
+        target.seek(0)
+        expected = self.processor.process_bytes(self.photo)
+        self.assertEqual(failed, 1)
+        self.assertIn("Frame 1", errors.getvalue())
+        self.assertEqual(read_frame(target), expected)
+        self.assertEqual(read_frame(target), b'', "Failed photo should produce an empty frame")
+        self.assertEqual(read_frame(target), expected)
+        self.assertIsNone(read_frame(target))
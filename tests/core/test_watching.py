@@ -0,0 +1,59 @@
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from core.watching import FolderWatcher
+
+
+class TestFolderWatcher(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.watcher = FolderWatcher(lambda: [os.path.join(self.directory, name)
+                                              for name in os.listdir(self.directory)], stable_polls=1)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def write(self, name: str, data: bytes, mode: str = 'wb') -> str:
+        filepath = os.path.join(self.directory, name)
+        with open(filepath, mode) as file:
+            file.write(data)
+        return filepath
+
+    def test_reports_stable_files_once(self):
+        filepath = self.write("photo.jpg", b'first part')
+        self.assertEqual(self.watcher.poll(), [], "Should wait until the file stops changing")
+
+        self.write("photo.jpg", b', second part', 'ab')
+        self.assertEqual(self.watcher.poll(), [], "File is still being written")
+
+        self.assertEqual(self.watcher.poll(), [filepath])
+        self.assertEqual(self.watcher.poll(), [], "Should report every version once")
+
+    def test_reports_changed_files_again(self):
+        filepath = self.write("photo.jpg", b'original')
+        self.watcher.poll()
+        self.assertEqual(self.watcher.poll(), [filepath])
+
+        self.write("photo.jpg", b'replaced with a longer photo')
+        self.assertEqual(self.watcher.poll(), [])
+        self.assertEqual(self.watcher.poll(), [filepath])
+
+    def test_empty_and_removed_files(self):
+        filepath = self.write("photo.jpg", b'')
+        self.watcher.poll()
+        self.assertEqual(self.watcher.poll(), [], "Should not report empty files")
+
+        os.remove(filepath)
+        self.assertEqual(self.watcher.poll(), [])
+
+    def test_without_stability_check(self):
+        watcher = FolderWatcher(lambda: [os.path.join(self.directory, name) for name in os.listdir(self.directory)],
+                                stable_polls=0)
+        filepath = self.write("photo.jpg", b'data')
+        self.assertEqual(watcher.poll(), [filepath])
+
+        with self.assertRaises(ValueError):
+            FolderWatcher(lambda: [], stable_polls=-1)
@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from PIL import Image
+
+from core.watermark_cache import PreparedWatermarkCache
+from core.watermarking import prepare_watermark
+from resources.watermarks import DEFAULT_DARK_WATERMARK, DEFAULT_LIGHT_WATERMARK
+
+
+class TestPreparedWatermarkCache(TestCase):
+
+    def setUp(self) -> None:
+        self.dark_watermark = Image.open(DEFAULT_DARK_WATERMARK)
+        self.light_watermark = Image.open(DEFAULT_LIGHT_WATERMARK)
+
+    def tearDown(self) -> None:
+        self.dark_watermark.close()
+        self.light_watermark.close()
+
+    def test_get_counts_hits_and_misses(self):
+        cache = PreparedWatermarkCache(max_size=4)
+
+        first = cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (120, 64), 0.5)
+        second = cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (120, 64), 0.5)
+        cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (120, 64), 0.6)
+        cache.get(DEFAULT_LIGHT_WATERMARK, self.light_watermark, (120, 64), 0.5)
+
+        self.assertIs(first, second, "Should return the cached watermark")
+        self.assertEqual(cache.hits, 1, "Should count one hit")
+        self.assertEqual(cache.misses, 3, "Opacity and watermark file are part of the key")
+        self.assertEqual(cache.hit_rate, 0.25, "Should compute the hit rate")
+        self.assertEqual(list(first.getdata()),
+                         list(prepare_watermark(self.dark_watermark, (120, 64), 0.5).getdata()),
+                         "Should store the prepared watermark")
+
+    def test_evicts_least_recently_used(self):
+        cache = PreparedWatermarkCache(max_size=2)
+
+        cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (10, 5), 0.5)
+        cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (20, 10), 0.5)
+        cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (10, 5), 0.5)
+        cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (30, 15), 0.5)
+        self.assertEqual(len(cache), 2, "Should not exceed max_size")
+
+        cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (10, 5), 0.5)
+        self.assertEqual(cache.hits, 2, "Recently used watermark should be kept")
+
+        cache.get(DEFAULT_DARK_WATERMARK, self.dark_watermark, (20, 10), 0.5)
+        self.assertEqual(cache.misses, 4, "Least recently used watermark should be evicted")
+
+    def test_raises_exception_with_invalid_size(self):
+        with self.assertRaisesRegex(ValueError, "must be a positive integer"):
+            PreparedWatermarkCache(max_size=0)
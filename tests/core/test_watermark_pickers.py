@@ -4,7 +4,8 @@ from unittest import TestCase
 
 from PIL import Image
 
-from core.watermark_pickers import AvgRgbWatermarkPicker, WatermarkType
+from core.corner_analysis import CornerAnalysis
+from core.watermark_pickers import AvgRgbWatermarkPicker, LumaWatermarkPicker, WatermarkType
 from core.watermarking import Corner
 from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
 
@@ -63,3 +64,28 @@ class TestAvgRgbWatermarkPicker(TestCase):
                          "Should choose dark watermark on light background")
         self.assertEqual(picker.pick_best_watermark(self.left_dark_right_light, Corner.LOWER_LEFT), WatermarkType.LIGHT,
                          "Should choose light watermark on dark background")
+
+
+class TestLumaWatermarkPicker(TestCase):
+
+    def test_pick_best_watermark(self):
+        picker = LumaWatermarkPicker(0.1, 0.1)
+
+        for filename, corner, expected in [('bottom-uniform-light.jpg', Corner.LOWER_LEFT, WatermarkType.DARK),
+                                           ('left-uniform-dark.jpg', Corner.UPPER_LEFT, WatermarkType.LIGHT),
+                                           ('left-dark-right-light.jpg', Corner.UPPER_RIGHT, WatermarkType.DARK)]:
+            with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, filename)) as image:
+                self.assertEqual(picker.pick_best_watermark(image, corner), expected, filename)
+
+    def test_uses_perceived_brightness(self):
+        green = Image.new('RGB', (100, 100), (0, 220, 0))
+
+        self.assertEqual(AvgRgbWatermarkPicker(0.1, 0.1).pick_best_watermark(green, Corner.UPPER_LEFT),
+                         WatermarkType.LIGHT)
+        self.assertEqual(LumaWatermarkPicker(0.1, 0.1).pick_best_watermark(green, Corner.UPPER_LEFT),
+                         WatermarkType.DARK, "Green should be perceived as bright")
+
+        rgb_analysis = CornerAnalysis(green, [Corner.UPPER_LEFT], 0.1, 0.1)
+        self.assertEqual(LumaWatermarkPicker(0.1, 0.1).pick_best_watermark_from_analysis(rgb_analysis,
+                                                                                         Corner.UPPER_LEFT),
+                         WatermarkType.DARK, "Should accept statistics of RGB channels")
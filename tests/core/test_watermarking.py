@@ -3,7 +3,9 @@ from unittest import TestCase
 
 from PIL import Image
 
-from core.watermarking import cut_corner, Corner, add_watermark
+from core.watermarking import cut_corner, Corner, add_watermark, average_colors, colors_stdev, \
+    color_statistics, StatisticsBackend, prepare_watermark, reduce_for_analysis, paste_watermark, normalize_mode, \
+    watermark_position, corner_box
 from resources.watermarks import DEFAULT_DARK_WATERMARK
 from tests.resources.sample_photos import SAMPLE_PHOTOS_DIR
 
@@ -79,3 +81,128 @@ class TestWatermarking(TestCase):
                                      height_proportion=0.15)
         self.assertNotEqual(list(watermarked_corner.getdata()), list(original_corner.getdata()),
                             "Top-left corner should be different than the original")
+
+    def test_statistics_backends_parity(self):
+        for filename in os.listdir(SAMPLE_PHOTOS_DIR):
+            if not filename.endswith('.jpg'):
+                continue
+
+            with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, filename)) as image:
+                for corner in Corner:
+                    region = cut_corner(image, corner, 0.15, 0.15)
+                    self.assertEqual(average_colors(region, StatisticsBackend.PIXEL_LOOP),
+                                     average_colors(region, StatisticsBackend.IMAGE_STAT),
+                                     f"Average colors should match for {filename}, {corner}")
+                    self.assertEqual(colors_stdev(region, StatisticsBackend.PIXEL_LOOP),
+                                     colors_stdev(region, StatisticsBackend.IMAGE_STAT),
+                                     f"Standard deviations should match for {filename}, {corner}")
+
+    def test_color_statistics(self):
+        statistics = color_statistics(self.white)
+        self.assertEqual(statistics.mean, (255, 255, 255), "Should be white")
+        self.assertEqual(statistics.variance, (0, 0, 0), "Uniform image should have no variance")
+        self.assertEqual(statistics.stdev, (0, 0, 0), "Uniform image should have no deviation")
+
+        statistics = color_statistics(self.black.convert('L'), StatisticsBackend.PIXEL_LOOP)
+        self.assertEqual(statistics.mean, (0,), "Should compute a single band for grayscale images")
+
+    def test_prepare_watermark_matches_pixel_masking(self):
+        for size, opacity in [((1228, 660), 0.5), ((90, 48), 0.3), ((200, 107), 1)]:
+            expected = self.dark_watermark.resize(size, resample=Image.Resampling.NEAREST)
+            expected.putalpha(int(255 * opacity))
+            expected.putdata([(0, 0, 0, 0) if item[:3] == (0, 0, 0) else item for item in expected.getdata()])
+
+            prepared = prepare_watermark(self.dark_watermark, size, opacity)
+            self.assertEqual(prepared.mode, 'RGBA', "Should be an RGBA image")
+            self.assertEqual(list(prepared.getdata()), list(expected.getdata()),
+                             "Should be identical to masking pixels one by one")
+
+    def test_prepare_watermark_with_alpha_channel(self):
+        watermark = Image.new('RGBA', (4, 2), (0, 0, 0, 0))
+        watermark.putpixel((0, 0), (0, 0, 0, 255))
+        watermark.putpixel((1, 0), (255, 255, 255, 128))
+
+        prepared = prepare_watermark(watermark, (4, 2), 0.5, use_alpha_channel=True)
+        self.assertEqual(prepared.getpixel((0, 0)), (0, 0, 0, 127), "Should keep opaque black pixels")
+        self.assertEqual(prepared.getpixel((1, 0)), (255, 255, 255, 63), "Should scale alpha by opacity")
+        self.assertEqual(prepared.getpixel((2, 0))[3], 0, "Should keep transparent pixels transparent")
+
+        without_alpha = prepare_watermark(watermark.convert('RGB'), (4, 2), 0.5, use_alpha_channel=True)
+        self.assertEqual(without_alpha.getpixel((0, 0)), (0, 0, 0, 0),
+                         "Should fall back to black-keying without an alpha channel")
+
+    def test_reduce_for_analysis(self):
+        with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'white.jpg')) as image:
+            reduced = reduce_for_analysis(image, 0.25)
+            self.assertGreaterEqual(reduced.width, 150, "Should not be smaller than requested")
+            self.assertLess(reduced.width, 300, "Should be reduced")
+            self.assertEqual(reduced.getpixel((0, 0)), (255, 255, 255), "Should keep colors")
+
+        with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'illegal-format.png')) as image:
+            self.assertEqual(reduce_for_analysis(image, 0.5).width, 229, "Should reduce images other than JPEG")
+
+        with self.assertRaisesRegex(ValueError, "scale must be greater than 0"):
+            reduce_for_analysis(self.white, 0)
+
+    def test_reduce_only_corners_for_analysis(self):
+        with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, 'bottom-uniform-light.jpg')) as image:
+            image = image.resize((image.width * 2 + 3, image.height * 2 + 1))
+        reduced = reduce_for_analysis(image, 0.25)
+        corners = reduce_for_analysis(image, 0.25, [Corner.UPPER_LEFT, Corner.LOWER_RIGHT], 0.15, 0.2)
+
+        self.assertEqual(corners.size, reduced.size)
+        for corner in (Corner.UPPER_LEFT, Corner.LOWER_RIGHT):
+            box = corner_box(reduced.size, corner, 0.15, 0.2)
+            self.assertEqual(corners.crop(box).tobytes(), reduced.crop(box).tobytes(), corner)
+        self.assertEqual(corners.getpixel((reduced.width // 2, reduced.height // 2)), (0, 0, 0),
+                         "Should not reduce the rest of the image")
+
+    def test_paste_watermark_matches_full_frame_compositing(self):
+        watermark = prepare_watermark(self.dark_watermark, (90, 48), 0.5)
+        for filename in ['left-dark-right-light.jpg', 'illegal-format.png']:
+            with Image.open(os.path.join(SAMPLE_PHOTOS_DIR, filename)) as image:
+                for corner in Corner:
+                    expected = Image.new(mode='RGBA', size=image.size, color=(0, 0, 0, 0))
+                    expected.paste(image, (0, 0))
+                    expected.paste(watermark, watermark_position(image.size, watermark.size, corner), watermark)
+                    expected = expected.convert('RGB')
+
+                    watermarked = paste_watermark(image, corner, watermark)
+                    self.assertEqual(list(watermarked.getdata()), list(expected.getdata()),
+                                     f"Should be pixel-identical for {filename}, {corner}")
+
+    def test_paste_watermark_in_place(self):
+        watermark = prepare_watermark(self.dark_watermark, (90, 48), 0.5)
+        image = self.white.copy()
+        expected = paste_watermark(image, Corner.LOWER_RIGHT, watermark)
+
+        watermarked = paste_watermark(image, Corner.LOWER_RIGHT, watermark, in_place=True)
+        self.assertIs(watermarked, image, "Should modify the original image")
+        self.assertEqual(list(watermarked.getdata()), list(expected.getdata()), "Should match the copying path")
+
+        with self.assertRaisesRegex(ValueError, "only be pasted in place into an RGB image"):
+            paste_watermark(image.convert('RGBA'), Corner.LOWER_RIGHT, watermark, in_place=True)
+
+    def test_paste_watermark_keep_alpha(self):
+        watermark = prepare_watermark(self.dark_watermark, (90, 48), 1)
+        transparent = Image.new('RGBA', (300, 200), (255, 255, 255, 0))
+
+        watermarked = paste_watermark(transparent, Corner.UPPER_LEFT, watermark, keep_alpha=True)
+        self.assertEqual(watermarked.mode, 'RGBA')
+        self.assertEqual(watermarked.getpixel((299, 199))[3], 0, "Should keep transparency outside the watermark")
+        self.assertEqual(watermarked.getchannel('A').crop((0, 0, 90, 48)).getextrema(),
+                         watermark.getchannel('A').getextrema(), "Watermark should be composited over transparency")
+        self.assertEqual(paste_watermark(transparent, Corner.UPPER_LEFT, watermark).mode, 'RGB')
+
+    def test_normalize_mode(self):
+        rgb = self.white.convert('RGB')
+        self.assertIs(normalize_mode(rgb), rgb, "Should not copy RGB images")
+        self.assertEqual(normalize_mode(self.white.convert('L')).mode, 'RGB')
+        self.assertEqual(normalize_mode(self.white.convert('CMYK')).mode, 'RGB')
+
+        transparent = Image.new('LA', (10, 10), (0, 0))
+        self.assertEqual(normalize_mode(transparent).getpixel((0, 0)), (255, 255, 255), "Should flatten onto white")
+        self.assertEqual(normalize_mode(transparent, keep_alpha=True).mode, 'RGBA')
+
+        sixteen_bit = Image.new('I;16', (10, 10), 65535)
+        self.assertEqual(normalize_mode(sixteen_bit).getpixel((0, 0)), (255, 255, 255), "Should scale to 8 bits")